@@ -4,7 +4,29 @@ This module provides test functions for apnea alarm functionality,
 following medical device standards.
 """
 
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
 from robot.api.deco import keyword
+from capture_format import is_capture, iter_csv_chunks, open_capture
+from config import device_config
+from instrumentation import instrumented
+
+# Standard apnea threshold (10 seconds per medical guidelines), from the
+# active device profile
+ALARM_THRESHOLD = device_config.apnea_threshold
+
+# Flow magnitude (L/min) below which the patient is considered not breathing
+APNEA_FLOW_THRESHOLD = 2.0
+
+
+def apnea_alarm_triggered(duration, threshold=ALARM_THRESHOLD):
+    """Return whether an apnea of ``duration`` seconds raises the alarm.
+
+    Works element-wise on numpy arrays.
+    """
+    return duration >= threshold
 
 
 @keyword("Test Apnea Alarm")
@@ -22,16 +44,13 @@ def test_apnea_alarm(apnea_duration, expected_alarm):
         Converts all inputs to appropriate types for comparison.
         Follows ISO 80601-2-70 requirements for apnea detection.
     """
-    # Standard apnea threshold (10 seconds per medical guidelines)
-    ALARM_THRESHOLD = 10.0  
-    
     try:
         # Convert inputs to proper types
         duration = float(apnea_duration)
         should_alarm = str(expected_alarm).strip().upper() == "TRUE"
         
         # Check if alarm behavior matches expectation
-        actual_alarm = duration >= ALARM_THRESHOLD
+        actual_alarm = apnea_alarm_triggered(duration)
         return actual_alarm == should_alarm
         
     except (ValueError, TypeError):
@@ -39,5 +58,222 @@ def test_apnea_alarm(apnea_duration, expected_alarm):
         return False
 
 
+class ApneaDetector:
+    """Streaming apnea detector for one flow channel.
+
+    Samples are fed in chunks; only the state of the currently open
+    low-flow run is kept between chunks, so memory use does not grow with
+    recording length. Completed episodes are returned by ``feed`` and
+    ``finish``, not kept.
+
+    A run lasts from its first low-flow sample until breathing resumes (or
+    the recording ends). It raises the alarm at the first sample whose
+    time since onset reaches the alarm threshold, or, if breathing resumes
+    exactly at the threshold, when it does.
+    """
+
+    __slots__ = (
+        "flow_threshold", "alarm_threshold", "short_pauses",
+        "_in_apnea", "_onset", "_alarm_time", "_last_time",
+    )
+
+    def __init__(self, flow_threshold=APNEA_FLOW_THRESHOLD, alarm_threshold=ALARM_THRESHOLD):
+        """Create a detector.
+
+        Args:
+            flow_threshold: Flow magnitude below which a sample counts as apnea.
+            alarm_threshold: Seconds of continuous apnea that raise the alarm.
+        """
+        self.flow_threshold = float(flow_threshold)
+        self.alarm_threshold = float(alarm_threshold)
+        self.short_pauses = 0
+        self._in_apnea = False
+        self._onset = 0.0
+        self._alarm_time: Optional[float] = None
+        self._last_time: Optional[float] = None
+
+    def feed(self, timestamps, flow) -> List[Dict[str, float]]:
+        """Process one chunk of samples.
+
+        Args:
+            timestamps: Sample times in seconds, monotonically increasing.
+            flow: Flow samples aligned with ``timestamps``.
+
+        Returns:
+            List of episodes completed within this chunk.
+        """
+        t = np.asarray(timestamps, dtype=np.float64)
+        low = np.abs(np.asarray(flow, dtype=np.float64)) < self.flow_threshold
+        if not t.size:
+            return []
+        episodes = []
+
+        # Indices where the apnea state flips, relative to the carried state
+        previous = np.concatenate(([self._in_apnea], low[:-1]))
+        run_start = 0
+        for index in np.flatnonzero(low != previous):
+            if low[index]:
+                self._in_apnea = True
+                self._onset = float(t[index])
+                self._alarm_time = None
+                run_start = index
+            else:
+                self._check_alarm(t, run_start, index)
+                episodes.extend(self._close(float(t[index])))
+        if self._in_apnea:
+            self._check_alarm(t, run_start, t.size)
+        self._last_time = float(t[-1])
+        return episodes
+
+    def finish(self) -> List[Dict[str, float]]:
+        """Close an apnea run still open at the end of the recording.
+
+        Returns:
+            The episode it completes, if it raised the alarm.
+        """
+        if self._in_apnea and self._last_time is not None:
+            return self._close(self._last_time)
+        return []
+
+    def _check_alarm(self, t, start, stop) -> None:
+        if self._alarm_time is not None:
+            return
+        due = self._onset + self.alarm_threshold
+        index = start + int(np.searchsorted(t[start:stop], due, side="left"))
+        if index < stop:
+            self._alarm_time = float(t[index])
+
+    def _close(self, end: float) -> List[Dict[str, float]]:
+        self._in_apnea = False
+        # A run ending exactly at the threshold has no sample at or past it
+        if self._alarm_time is None and apnea_alarm_triggered(end - self._onset, self.alarm_threshold):
+            self._alarm_time = end
+        alarm_time, self._alarm_time = self._alarm_time, None
+        if alarm_time is None:
+            self.short_pauses += 1
+            return []
+        return [{
+            "onset": self._onset,
+            "end": end,
+            "duration": end - self._onset,
+            "alarm_time": alarm_time,
+            "alarm_latency": alarm_time - self._onset,
+        }]
+
+
+def iter_recording_chunks(source, chunk_size=65_536, start=None, end=None) -> Iterator[np.ndarray]:
+    """Yield ``(n, 1 + channels)`` chunks of ``timestamp, flow...`` rows.
+
+    Args:
+        source: Path to a capture (``.cpcap``, only the window is read), a
+            ``.npy`` file (memory-mapped), a CSV file (read incrementally,
+            optional header row), or an iterable of chunks.
+        chunk_size: Rows per chunk for file sources.
+        start: Skip rows before this time in seconds.
+        end: Stop at rows from this time in seconds.
+    """
+    if is_capture(source):
+        yield from open_capture(source).iter_chunks(chunk_size, start, end)
+        return
+    for chunk in _iter_chunks(source, chunk_size):
+        if start is not None or end is not None:
+            timestamps = chunk[:, 0]
+            keep = np.ones(timestamps.size, dtype=bool)
+            if start is not None:
+                keep &= timestamps >= start
+            if end is not None:
+                keep &= timestamps < end
+            chunk = chunk[keep]
+        if chunk.size:
+            yield chunk
+
+
+def _iter_chunks(source, chunk_size) -> Iterator[np.ndarray]:
+    if not isinstance(source, (str, Path)):
+        for chunk in source:
+            yield np.atleast_2d(np.asarray(chunk, dtype=np.float64))
+        return
+
+    path = Path(source)
+    if path.suffix == ".npy":
+        data = np.load(path, mmap_mode="r")
+        for start in range(0, data.shape[0], chunk_size):
+            yield np.asarray(data[start:start + chunk_size], dtype=np.float64)
+        return
+    yield from iter_csv_chunks(path, chunk_size)
+
+
+@instrumented("apnea.detect", "validation")
+def detect_apnea(
+    source,
+    flow_threshold=APNEA_FLOW_THRESHOLD,
+    alarm_threshold=ALARM_THRESHOLD,
+    chunk_size=65_536,
+    start=None,
+    end=None,
+) -> Dict[int, Dict]:
+    """Run one streaming detector per flow channel over a recording, or a
+    ``start``/``end`` window of it.
+
+    Returns:
+        Dict mapping channel index (0-based, after the timestamp column)
+        to its ``episodes`` and ``short_pauses``.
+    """
+    detectors: Dict[int, ApneaDetector] = {}
+    episodes: Dict[int, List[Dict[str, float]]] = {}
+    for chunk in iter_recording_chunks(source, chunk_size, start, end):
+        timestamps = chunk[:, 0]
+        for channel in range(chunk.shape[1] - 1):
+            detector = detectors.get(channel)
+            if detector is None:
+                detector = detectors[channel] = ApneaDetector(flow_threshold, alarm_threshold)
+                episodes[channel] = []
+            episodes[channel].extend(detector.feed(timestamps, chunk[:, channel + 1]))
+    for channel, detector in detectors.items():
+        episodes[channel].extend(detector.finish())
+    return {
+        channel: {"episodes": episodes[channel], "short_pauses": detector.short_pauses}
+        for channel, detector in detectors.items()
+    }
+
+
+@keyword("Detect Apnea Episodes")
+def detect_apnea_episodes(recording, flow_threshold=APNEA_FLOW_THRESHOLD, chunk_size=65_536,
+                          start=None, end=None):
+    """Detect apnea episodes in a flow recording and report alarm latency.
+
+    Args:
+        recording: Capture, ``.npy`` or CSV file of ``timestamp, flow[, flow...]``
+            rows.
+        flow_threshold: Flow magnitude in L/min treated as no breathing.
+        chunk_size: Rows processed per chunk.
+        start: Analyse from this time in seconds (default: the beginning).
+        end: Analyse up to this time in seconds (default: the end).
+
+    Returns:
+        dict: ``episodes`` (list of per-episode dicts with ``channel``,
+        ``onset``, ``end``, ``duration``, ``alarm_time``, ``alarm_latency``),
+        ``episode_count``, ``short_pauses`` and ``max_alarm_latency``.
+
+    Note:
+        Follows ISO 80601-2-70 requirements for apnea detection.
+    """
+    channels = detect_apnea(
+        recording, float(flow_threshold), ALARM_THRESHOLD, int(chunk_size),
+        None if start is None else float(start), None if end is None else float(end),
+    )
+    episodes = [
+        {"channel": channel, **episode}
+        for channel, result in sorted(channels.items())
+        for episode in result["episodes"]
+    ]
+    return {
+        "episodes": episodes,
+        "episode_count": len(episodes),
+        "short_pauses": sum(result["short_pauses"] for result in channels.values()),
+        "max_alarm_latency": max((e["alarm_latency"] for e in episodes), default=0.0),
+    }
+
+
 # Required Robot Framework configuration
-ROBOT_LIBRARY_SCOPE = "GLOBAL"
\ No newline at end of file
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
@@ -0,0 +1,269 @@
+"""Crash-safe file operations for firmware images.
+
+Images are never modified in place: new content is written to a temporary
+file in the target directory, verified, fsynced and renamed over the
+target, so a power loss leaves either the old or the new image. Backups
+and rollbacks share the image's inode through hard links, making them
+O(1) instead of full copies.
+
+For fault injection, ``power_loss_at(offset)`` cuts the next copy in the
+calling thread after ``offset`` bytes and raises ``PowerLoss`` without any
+cleanup, leaving the partial temporary file exactly as a real power cut
+would. The other operations cut at a fixed point (``offset`` is ignored):
+
+* ``copy_rename`` -- a staged copy is complete but not yet renamed,
+* ``copy_sync`` -- a copy is renamed into place, the directory not synced,
+* ``link`` -- the temporary link is made but not yet renamed, and
+* ``link_sync`` -- a link is renamed into place, the directory not synced.
+"""
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+FAULT_OPERATIONS = ("copy", "copy_rename", "copy_sync", "link", "link_sync")
+
+# Linux FICLONE ioctl: share extents with the source (btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+_COPY_CHUNK = 8 * 1024 * 1024
+
+_fault = threading.local()
+
+
+class PowerLoss(BaseException):
+    """Injected power cut; like a real one, it is not handled as an error."""
+
+
+@contextlib.contextmanager
+def power_loss_at(offset: int, operation: str = "copy"):
+    """Lose power during the next ``operation`` in this thread.
+
+    Args:
+        offset: For a ``"copy"``, bytes of the next copy written before
+            the power loss; an offset at or past the image size loses
+            power after the data is written but before it is renamed into
+            place. Ignored for the other operations.
+        operation: One of ``FAULT_OPERATIONS``.
+    """
+    if operation not in FAULT_OPERATIONS:
+        raise ValueError(f"Unknown operation {operation!r}")
+    _fault.offset = int(offset)
+    _fault.operation = operation
+    try:
+        yield
+    finally:
+        _fault.offset = None
+        _fault.operation = None
+
+
+def _take_fault(operation: str) -> Optional[int]:
+    """Return and clear the pending power loss offset for ``operation``."""
+    if getattr(_fault, "operation", None) != operation:
+        return None
+    offset = _fault.offset
+    _fault.offset = None
+    _fault.operation = None
+    return offset
+
+
+def _torn_copy(src_fd: int, dst_fd: int, offset: int) -> None:
+    """Write the first ``offset`` bytes, make them durable, then lose power."""
+    remaining = offset
+    while remaining > 0:
+        chunk = os.read(src_fd, min(_COPY_CHUNK, remaining))
+        if not chunk:
+            break
+        os.write(dst_fd, chunk)
+        remaining -= len(chunk)
+    os.fsync(dst_fd)
+    raise PowerLoss(f"Power lost after {offset - remaining} bytes")
+
+
+def _temp_path(target: Path) -> Path:
+    # Unique per thread: fleet devices and publishers copy concurrently
+    return target.with_name(f".{target.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+
+
+def fsync_dir(directory) -> None:
+    """Persist a rename or link in ``directory``."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+    try:
+        fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+        return True
+    except OSError:
+        return False
+
+
+def _kernel_copy(src_fd: int, dst_fd: int, size: int) -> bool:
+    """Copy without user-space buffers via copy_file_range or sendfile."""
+    for copy in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+        if copy is None:
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                if copy is os.sendfile:
+                    sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+                else:
+                    sent = os.copy_file_range(src_fd, dst_fd, size - offset, offset, offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError as e:
+            if e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                os.ftruncate(dst_fd, 0)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                continue
+            raise
+        if offset == size:
+            return True
+    return False
+
+
+def _streaming_copy(src_fd: int, dst_fd: int) -> str:
+    """Copy through one buffer, hashing the data on the way."""
+    sha = hashlib.sha256()
+    buffer = bytearray(_COPY_CHUNK)
+    view = memoryview(buffer)
+    while True:
+        read = os.readv(src_fd, [view])
+        if not read:
+            return sha.hexdigest()
+        sha.update(view[:read])
+        written = 0
+        while written < read:
+            written += os.write(dst_fd, view[written:read])
+
+
+def _copy_to_temp(src, tmp: Path, hashed: bool) -> Optional[str]:
+    """Write ``src`` to ``tmp`` and fsync it, returning its digest if ``hashed``."""
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        # A temp file left by a power loss may be a link to a live image:
+        # write a fresh inode, never through the old one
+        tmp.unlink(missing_ok=True)
+        dst_fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            size = os.fstat(src_fd).st_size
+            offset = _take_fault("copy")
+            if offset is not None:
+                _torn_copy(src_fd, dst_fd, offset)
+            if not hashed and (_reflink(src_fd, dst_fd) or _kernel_copy(src_fd, dst_fd, size)):
+                written = None
+            else:
+                written = _streaming_copy(src_fd, dst_fd)
+            os.fsync(dst_fd)
+        finally:
+            os.close(dst_fd)
+        return written
+    finally:
+        os.close(src_fd)
+
+
+@contextlib.contextmanager
+def staged_copy(src, dst, expected_sha256: Optional[str] = None, hashed: bool = True):
+    """Copy ``src`` to a temporary file beside ``dst`` and rename it over ``dst`` on exit.
+
+    The body can inspect the staged copy, e.g. validate it, before it
+    replaces ``dst``; an exception in the body discards it instead.
+
+    Args:
+        src: Source image.
+        dst: Target path; replaced only when the body completes.
+        expected_sha256: Digest the copy must have.
+        hashed: Hash the data while copying it. Without a digest to check,
+            ``False`` leaves the copy to the kernel.
+
+    Yields:
+        Tuple[Path, Optional[str]]: The staged file and its SHA-256 hex
+        digest (None when the kernel copied it unhashed).
+
+    Raises:
+        ValueError: If the digest does not match ``expected_sha256``.
+    """
+    dst = Path(dst)
+    tmp = _temp_path(dst)
+    try:
+        written = _copy_to_temp(src, tmp, hashed or expected_sha256 is not None)
+        if expected_sha256 is not None and written != expected_sha256:
+            raise ValueError(
+                f"Digest mismatch: expected {expected_sha256}, got {written}"
+            )
+        yield tmp, written
+        if _take_fault("copy_rename") is not None:
+            raise PowerLoss(f"Power lost before {tmp.name} was renamed into place")
+        os.replace(tmp, dst)
+        if _take_fault("copy_sync") is not None:
+            raise PowerLoss(f"Power lost before the rename to {dst.name} was synced")
+        fsync_dir(dst.parent)
+    except PowerLoss:
+        raise
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def atomic_copy(src, dst, expected_sha256: Optional[str] = None) -> Optional[str]:
+    """Copy ``src`` over ``dst`` atomically.
+
+    With ``expected_sha256`` the data is copied through one user-space
+    buffer and hashed on the way, so the image is read once and verified
+    before the rename. Without it the copy is left to the kernel: a reflink
+    when the filesystem supports it, else copy_file_range or sendfile, with
+    the buffered loop as the last resort.
+
+    Args:
+        src: Source image.
+        dst: Target path; replaced only after verification.
+        expected_sha256: Digest the copy must have.
+
+    Returns:
+        Optional[str]: SHA-256 hex digest of the installed data, or None
+        when the kernel copied it unhashed.
+
+    Raises:
+        ValueError: If the digest does not match ``expected_sha256``.
+    """
+    with staged_copy(src, dst, expected_sha256, hashed=False) as (_, written):
+        pass
+    return written
+
+
+def atomic_link(src, dst) -> None:
+    """Make ``dst`` refer to the same inode as ``src``, atomically.
+
+    Falls back to ``atomic_copy`` where hard links are not possible
+    (e.g. across filesystems).
+    """
+    dst = Path(dst)
+    tmp = _temp_path(dst)
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        atomic_copy(src, dst)
+        return
+    if _take_fault("link") is not None:
+        raise PowerLoss(f"Power lost before {tmp.name} was renamed into place")
+    os.replace(tmp, dst)
+    if _take_fault("link_sync") is not None:
+        raise PowerLoss(f"Power lost before the rename to {dst.name} was synced")
+    # Renaming a link over another link to the same inode is a no-op that
+    # leaves the temp name behind
+    tmp.unlink(missing_ok=True)
+    fsync_dir(dst.parent)
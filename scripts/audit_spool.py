@@ -0,0 +1,487 @@
+"""Durable on-disk spool for audit events.
+
+Events are appended as CRC-protected records to segmented, append-only
+files so that logging never waits on InfluxDB and no event is lost while
+the database is slow or unreachable. A replay worker drains the spool to
+the InfluxDB ``/write`` endpoint in bulk once it accepts writes again.
+
+Record layout: ``<uint32 length><uint32 crc32><payload>``, payload being
+one line of InfluxDB line protocol.
+
+Several processes may share one spool (parallel shards inherit
+``AUDIT_SPOOL_DIR``). Every writer appends only to segments it created,
+named by creation time, pid and a random suffix, and holds an exclusive
+``flock`` on its open segment. A segment nobody holds a lock on is closed
+for good: writers never reopen one. The replay cursor keeps an offset per
+segment; open segments are replayed up to their last complete record and
+only closed, fully replayed segments are deleted. One replayer at a time
+drains the spool, serialised by ``replay.lock``.
+
+A record in a closed segment whose CRC does not match is counted and
+skipped; its length prefix still locates the next record. If the prefix
+itself is unusable (it runs past the end of the segment), the rest of the
+segment cannot be framed: once the records before it are replayed, the
+segment is moved to ``quarantine/`` for inspection instead of deleted.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from robot.api.deco import keyword
+from instrumentation import instrumented
+
+_HEADER = struct.Struct("<II")
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".log"
+_CURSOR_FILE = "cursor"
+_REPLAY_LOCK = "replay.lock"
+_QUARANTINE_DIR = "quarantine"
+
+# Record status while reading a segment
+_OK = "ok"
+_CORRUPT = "corrupt"
+_UNFRAMED = "unframed"
+
+
+class AuditSpool:
+    """Append-only, segmented record log with batched fsync."""
+
+    def __init__(
+        self,
+        directory,
+        segment_size: int = 4 * 1024 * 1024,
+        fsync_every: int = 64,
+        fsync_interval: float = 0.5,
+    ):
+        """Open (or create) a spool directory.
+
+        This writer's first segment is created on the first append, so a
+        torn tail left by a crash is never appended to and a spool opened
+        only for replay adds no segment.
+
+        Args:
+            directory: Spool directory.
+            segment_size: Bytes after which a new segment is started.
+            fsync_every: Records appended between fsync calls.
+            fsync_interval: Maximum seconds between fsync calls.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._pid = os.getpid()
+        self._active: Optional[str] = None
+        self._active_size = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self.appended_records = 0
+        self.corrupt_records = 0
+
+    def segments(self) -> List[str]:
+        """Return the names of all segments, oldest first."""
+        return sorted(
+            path.name for path in self.directory.glob(f"{_SEGMENT_PREFIX}*{_SEGMENT_SUFFIX}")
+        )
+
+    def segment_path(self, name: str) -> Path:
+        return self.directory / name
+
+    @property
+    def active_segment(self) -> Optional[str]:
+        """Segment this writer appends to, or None before the first append."""
+        return self._active
+
+    def append(self, payload: str) -> None:
+        """Append one record; fsync happens in batches."""
+        data = payload.encode("utf-8")
+        record = _HEADER.pack(len(data), zlib.crc32(data)) + data
+        with self._lock:
+            if self._fd is not None and self._pid != os.getpid():
+                # Forked child: leave the parent's segment to the parent
+                os.close(self._fd)
+                self._fd = None
+            if self._fd is None:
+                self._open_segment()
+            elif self._active_size and self._active_size + len(record) > self.segment_size:
+                self._sync_locked()
+                os.close(self._fd)
+                self._open_segment()
+            os.write(self._fd, record)
+            self._active_size += len(record)
+            self._unsynced += 1
+            self.appended_records += 1
+            if (
+                self._unsynced >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval
+            ):
+                self._sync_locked()
+
+    def sync(self) -> None:
+        """Force buffered records to stable storage."""
+        with self._lock:
+            self._sync_locked()
+
+    def close(self) -> None:
+        """Sync and close this writer's segment, which releases it for deletion."""
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                self._sync_locked()
+                os.close(self._fd)
+            self._fd = None
+            self._active = None
+
+    def is_closed(self, name: str) -> bool:
+        """Return whether no writer holds ``name``, so it can never grow again."""
+        try:
+            fd = os.open(self.segment_path(name), os.O_RDONLY)
+        except FileNotFoundError:
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        finally:
+            os.close(fd)
+        return True
+
+    @contextlib.contextmanager
+    def replay_lock(self, timeout: Optional[float] = None):
+        """Hold the spool's replay lock, so one process drains at a time.
+
+        Args:
+            timeout: Seconds to wait for another replayer (default: forever).
+
+        Yields:
+            bool: Whether the lock is held; False once ``timeout`` expired.
+        """
+        fd = os.open(self.directory / _REPLAY_LOCK, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if timeout is None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield True
+                return
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        yield False
+                        return
+                    time.sleep(0.05)
+            yield True
+        finally:
+            os.close(fd)
+
+    def read_cursor(self) -> Dict[str, int]:
+        """Return the offset of the first record not yet replayed, per segment."""
+        try:
+            with open(self.directory / _CURSOR_FILE) as file:
+                cursor = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return cursor if isinstance(cursor, dict) else {}
+
+    def commit_cursor(
+        self, cursor: Dict[str, int], finished: List[str] = (), quarantined: List[str] = ()
+    ) -> None:
+        """Delete fully replayed closed segments and persist the replay position.
+
+        Segments are deleted (or quarantined) first: a crash in between
+        leaves only cursor entries for missing segments, which are ignored,
+        never a replayed segment without its offset.
+        """
+        for name in finished:
+            self.segment_path(name).unlink(missing_ok=True)
+        if quarantined:
+            quarantine = self.directory / _QUARANTINE_DIR
+            quarantine.mkdir(exist_ok=True)
+            for name in quarantined:
+                with contextlib.suppress(FileNotFoundError):
+                    os.replace(self.segment_path(name), quarantine / name)
+                    print(f"Quarantined damaged audit spool segment {name}")
+        existing = set(self.segments())
+        cursor = {name: offset for name, offset in cursor.items() if name in existing}
+        path = self.directory / _CURSOR_FILE
+        tmp = path.with_name(f".{_CURSOR_FILE}.tmp-{os.getpid()}")
+        with open(tmp, "w") as file:
+            json.dump(cursor, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, path)
+
+    def read_records(
+        self, cursor: Dict[str, int], limit: int
+    ) -> Tuple[List[str], Dict[str, int], List[str], List[str]]:
+        """Read up to ``limit`` records starting at a cursor.
+
+        In a closed segment, a record failing its CRC is counted and skipped,
+        and one whose length prefix is unusable ends the segment, which is
+        then to be quarantined; in an open segment either marks the end of
+        readable data.
+
+        Returns:
+            Tuple: (payloads, next cursor, closed segments read to the end,
+            closed segments to quarantine).
+        """
+        cursor = dict(cursor)
+        payloads: List[str] = []
+        finished: List[str] = []
+        quarantined: List[str] = []
+        for name in self.segments():
+            # Decide before reading: a segment closed now has its final size
+            closed = self.is_closed(name)
+            offset = cursor.get(name, 0)
+            damaged = False
+            for data, end, status in self._iter_segment(name, offset):
+                if status != _OK:
+                    if not closed:
+                        break
+                    self.corrupt_records += 1
+                    if status == _UNFRAMED:
+                        damaged = True
+                        break
+                    offset = end
+                    continue
+                payloads.append(data)
+                offset = end
+                if len(payloads) >= limit:
+                    cursor[name] = offset
+                    return payloads, cursor, finished, quarantined
+            cursor[name] = offset
+            if damaged:
+                quarantined.append(name)
+            elif closed:
+                finished.append(name)
+        return payloads, cursor, finished, quarantined
+
+    def pending_records(self) -> int:
+        """Count records not yet replayed (scans the spool)."""
+        cursor = self.read_cursor()
+        return sum(
+            status == _OK
+            for name in self.segments()
+            for _, _, status in self._iter_segment(name, cursor.get(name, 0))
+        )
+
+    def _iter_segment(self, name: str, offset: int) -> Iterator[Tuple[str, int, str]]:
+        """Yield ``(payload, next offset, status)`` per record from ``offset``.
+
+        A CRC mismatch (``_CORRUPT``) still advances past the record; a
+        header or payload cut short by the end of the file (``_UNFRAMED``)
+        ends the iteration.
+        """
+        try:
+            with open(self.segment_path(name), "rb") as file:
+                file.seek(offset)
+                while True:
+                    header = file.read(_HEADER.size)
+                    if not header:
+                        return
+                    if len(header) < _HEADER.size:
+                        yield "", offset, _UNFRAMED
+                        return
+                    length, crc = _HEADER.unpack(header)
+                    data = file.read(length)
+                    if len(data) < length:
+                        yield "", offset, _UNFRAMED
+                        return
+                    offset += _HEADER.size + length
+                    if zlib.crc32(data) != crc:
+                        yield "", offset, _CORRUPT
+                        continue
+                    yield data.decode("utf-8"), offset, _OK
+        except FileNotFoundError:
+            return
+
+    def _open_segment(self) -> None:
+        self._pid = os.getpid()
+        name = (f"{_SEGMENT_PREFIX}{time.time_ns():020d}-{self._pid}-"
+                f"{uuid.uuid4().hex[:8]}{_SEGMENT_SUFFIX}")
+        # Locked before it becomes visible, so no replayer sees it unheld
+        tmp = self.directory / f".{name}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.rename(tmp, self.segment_path(name))
+        self._fd = fd
+        self._active = name
+        self._active_size = 0
+
+    def _sync_locked(self) -> None:
+        if self._fd is not None and self._unsynced:
+            os.fsync(self._fd)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+
+class SpoolReplayer:
+    """Background worker that drains an AuditSpool to InfluxDB in bulk."""
+
+    def __init__(
+        self,
+        spool: AuditSpool,
+        url: str,
+        batch_size: int = 5000,
+        interval: float = 1.0,
+        max_backoff: float = 30.0,
+        timeout: float = 5.0,
+    ):
+        """Create a replayer.
+
+        Args:
+            spool: Spool to drain.
+            url: Full InfluxDB write URL including ``db`` and ``precision=ns``.
+            batch_size: Records per HTTP request.
+            interval: Seconds between drain attempts while healthy.
+            max_backoff: Upper bound for the retry delay while unreachable.
+            timeout: HTTP request timeout in seconds.
+        """
+        self.spool = spool
+        self.url = url
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.replayed_records = 0
+        self.failed_requests = 0
+        # requests is only loaded once a replayer exists
+        import requests
+        self._session = requests.Session()
+        self._drain_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def drain(self, timeout: Optional[float] = None) -> int:
+        """Replay every pending record until the spool is empty or a write fails.
+
+        Args:
+            timeout: Seconds to spend at most, waiting for another replayer
+                and on HTTP requests included (default: no limit). Records
+                left over stay spooled for a later drain.
+
+        Returns:
+            int: Number of records replayed by this call.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._drain_lock.acquire(timeout=-1 if timeout is None else timeout):
+            return 0
+        try:
+            return self._drain_locked(deadline)
+        finally:
+            self._drain_lock.release()
+
+    def _drain_locked(self, deadline: Optional[float]) -> int:
+        replayed = 0
+        with self.spool.replay_lock(_remaining(deadline)) as locked:
+            if not locked:
+                return replayed
+            self.spool.sync()
+            cursor = self.spool.read_cursor()
+            while True:
+                remaining = _remaining(deadline)
+                if remaining == 0:
+                    return replayed
+                payloads, next_cursor, finished, quarantined = self.spool.read_records(
+                    cursor, self.batch_size
+                )
+                if payloads and not self._post("\n".join(payloads), remaining):
+                    return replayed
+                if payloads or finished or quarantined or next_cursor != cursor:
+                    self.spool.commit_cursor(next_cursor, finished, quarantined)
+                if not payloads:
+                    return replayed
+                cursor = {name: offset for name, offset in next_cursor.items()
+                          if name not in finished and name not in quarantined}
+                replayed += len(payloads)
+                self.replayed_records += len(payloads)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-replay", daemon=True)
+        self._thread.start()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @instrumented("influx.write_points", "influx")
+    def _post(self, body: str, timeout: Optional[float] = None) -> bool:
+        import requests
+
+        if timeout is None or timeout > self.timeout:
+            timeout = self.timeout
+        try:
+            response = self._session.post(self.url, data=body.encode("utf-8"), timeout=timeout)
+            if response.status_code == 204:
+                return True
+            print(f"Audit replay error {response.status_code}: {response.text}")
+        except requests.exceptions.RequestException as e:
+            print(f"Audit replay connection error: {str(e)}")
+        self.failed_requests += 1
+        return False
+
+    def _run(self) -> None:
+        delay = self.interval
+        while not self._stop.is_set():
+            self._wake.wait(delay)
+            self._wake.clear()
+            before = self.failed_requests
+            self.drain()
+            if self.failed_requests > before:
+                delay = min(delay * 2, self.max_backoff)
+            else:
+                delay = self.interval
+        self.drain()
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left until ``deadline``, or None without one."""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+@keyword("Replay Audit Spool")
+def replay_audit_spool(spool_dir, influx_url, database="firmware_audit"):
+    """Drain the spool in ``spool_dir`` to InfluxDB and return the record count.
+
+    Args:
+        spool_dir: Spool directory.
+        influx_url: Base URL of InfluxDB, e.g. ``http://localhost:8086``.
+        database: Target database.
+    """
+    spool = AuditSpool(spool_dir)
+    try:
+        replayer = SpoolReplayer(
+            spool, f"{influx_url}/write?db={database}&precision=ns", timeout=2.0
+        )
+        return replayer.drain()
+    finally:
+        spool.close()
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
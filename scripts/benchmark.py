@@ -0,0 +1,435 @@
+"""Benchmarks for the QA toolchain's hot paths.
+
+Each case runs in a fresh interpreter so its peak RSS is its own, against
+generated fixtures: structured firmware images from 1 MB up to
+``max_firmware_size``, Robot output.xml files with 10k-100k tests, pressure
+traces of millions of samples (.npy and capture), and a local stub InfluxDB endpoint that
+audit events are written to.
+
+Results give throughput, latency percentiles and peak RSS per case. They
+can be saved as a JSON baseline, and a later run compared against it
+flags every case whose throughput, p95 latency or peak RSS got worse by
+more than a threshold (exit code 1).
+
+Usage:
+    python3 scripts/benchmark.py --save-baseline bench_baseline.json
+    python3 scripts/benchmark.py --baseline bench_baseline.json --threshold 0.15
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from robot.api.deco import keyword
+from config import device_config, firmware_paths
+from influx_stub import StubInfluxServer
+
+MB = 1024 * 1024
+
+# Fixture sizes: (full run, --quick run)
+IMAGE_SIZES = ([1 * MB, 4 * MB, device_config.max_firmware_size], [1 * MB])
+OUTPUT_TESTS = ([10_000, 100_000], [2_000])
+TRACE_SAMPLES = (2_000_000, 200_000)
+PRESSURE_CALLS = (20_000, 2_000)
+AUDIT_EVENTS = (50_000, 5_000)
+
+# Scripts run as ``python3 scripts/<name>.py`` or imported by the suites
+SCRIPT_MODULES = (
+    "influx_logger", "fault_injector", "pressure_validator", "alarm_testing",
+    "firmware_updater", "rollback", "simulate_failure", "validate_firmware",
+    "checksum_validator", "send_to_influx_v1", "traceability",
+)
+
+# Default allowed slowdown before a case is flagged
+REGRESSION_THRESHOLD = 0.10
+
+
+# -- fixtures ---------------------------------------------------------------
+
+def firmware_image(fixtures: Path, size: int) -> Path:
+    """Return a structured firmware image of ``size`` bytes, generating it once."""
+    import firmware_keywords
+
+    path = fixtures / f"firmware_{size}.bin"
+    if not path.exists():
+        path.write_bytes(firmware_keywords.synthetic_image(size, "1.1.0"))
+    return path
+
+
+def output_xml(fixtures: Path, tests: int, fail_every: int = 50) -> Path:
+    """Return a Robot 6 style output.xml with ``tests`` tests, generating it once."""
+    path = fixtures / f"output_{tests}.xml"
+    if path.exists():
+        return path
+    start = "20261018 10:00:00.000"
+    end = "20261018 10:00:00.020"
+    failed = 0
+    with open(path, "w", encoding="utf-8") as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                   '<robot generator="Robot 6.0.2" rpa="false" schemaversion="3">\n'
+                   '<suite id="s1" name="Bench" source="/bench">\n')
+        for index in range(tests):
+            status = "FAIL" if index % fail_every == fail_every - 1 else "PASS"
+            failed += status == "FAIL"
+            file.write(
+                f'<test id="s1-t{index}" name="Test {index}" line="{index}">\n'
+                f'<kw name="Validate Pressure" library="pressure_validator">\n'
+                f'<arg>12.{index % 10}</arg>\n'
+                f'<status status="{status}" starttime="{start}" endtime="{end}"/>\n'
+                f'</kw>\n<tag>req:REQ-{index % 500}</tag>\n'
+                f'<status status="{status}" starttime="{start}" endtime="{end}">'
+                f'{"boom" if status == "FAIL" else ""}</status>\n</test>\n'
+            )
+        file.write(f'<status status="FAIL" starttime="{start}" endtime="{end}"/>\n</suite>\n'
+                   f'<statistics>\n<total>\n<stat pass="{tests - failed}" fail="{failed}" '
+                   f'skip="0">All Tests</stat>\n</total>\n</statistics>\n<errors>\n</errors>\n'
+                   f'</robot>\n')
+    return path
+
+
+def pressure_trace(fixtures: Path, samples: int) -> Path:
+    """Return a ``timestamp,measured,target`` .npy trace, generating it once."""
+    path = fixtures / f"trace_{samples}.npy"
+    if not path.exists():
+        rng = np.random.default_rng(0)
+        timestamps = np.arange(samples) / 100.0
+        target = np.full(samples, 12.0)
+        np.save(path, np.column_stack([timestamps, target + rng.normal(0, 0.2, samples), target]))
+    return path
+
+
+def pressure_capture(fixtures: Path, samples: int) -> Path:
+    """Return the ``pressure_trace`` fixture as a capture, generating it once."""
+    from capture_format import CaptureWriter
+
+    path = fixtures / f"trace_{samples}.cpcap"
+    if not path.exists():
+        with CaptureWriter(path, ["measured", "target"]) as writer:
+            writer.append(np.load(pressure_trace(fixtures, samples), mmap_mode="r"))
+    return path
+
+
+# -- cases ------------------------------------------------------------------
+#
+# A case returns per-repetition latencies (seconds) and the units of work
+# one repetition performs; throughput is units per second.
+
+def _timed(function: Callable, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_sha256(fixtures: Path, size: int, quick: bool) -> Dict:
+    from checksum_validator import sha256
+
+    image = firmware_image(fixtures, size)
+    return {"samples": _timed(lambda: sha256(image, use_cache=False), 3 if quick else 10),
+            "units": size / MB, "unit": "MB"}
+
+
+def bench_update_firmware(fixtures: Path, size: int, quick: bool) -> Dict:
+    import firmware_keywords
+    from firmware_updater import update_firmware
+
+    sandbox = Path(tempfile.mkdtemp(dir=fixtures))
+    firmware_keywords.create_firmware_sandbox(sandbox, size)
+    installed, new, backup = firmware_paths(sandbox)
+    samples = _timed(lambda: update_firmware(new, installed, backup), 3 if quick else 10)
+    return {"samples": samples, "units": 1, "unit": "updates"}
+
+
+def bench_rollback(fixtures: Path, size: int, quick: bool) -> Dict:
+    import firmware_keywords
+    from rollback import rollback
+
+    sandbox = Path(tempfile.mkdtemp(dir=fixtures))
+    firmware_keywords.create_firmware_sandbox(sandbox, size)
+    installed, _, backup = firmware_paths(sandbox)
+    samples = _timed(lambda: rollback(backup, installed), 20 if quick else 100)
+    return {"samples": samples, "units": 1, "unit": "rollbacks"}
+
+
+def bench_validate_pressure(fixtures: Path, quick: bool) -> Dict:
+    from pressure_validator import validate_pressure
+
+    calls = PRESSURE_CALLS[quick]
+    samples = _timed(lambda: validate_pressure(12.2, 12.0), calls)
+    return {"samples": samples, "units": 1, "unit": "calls"}
+
+
+def bench_validate_pressure_trace(fixtures: Path, quick: bool) -> Dict:
+    from pressure_validator import validate_pressure_trace
+
+    samples = TRACE_SAMPLES[quick]
+    trace = pressure_trace(fixtures, samples)
+    return {"samples": _timed(lambda: validate_pressure_trace(str(trace)), 3 if quick else 5),
+            "units": samples, "unit": "samples"}
+
+
+def bench_validate_pressure_window(fixtures: Path, quick: bool) -> Dict:
+    """One minute (6000 samples) from the middle of a capture."""
+    from pressure_validator import validate_pressure_trace
+
+    capture = pressure_capture(fixtures, TRACE_SAMPLES[quick])
+    start = TRACE_SAMPLES[quick] / 200.0
+    samples = _timed(lambda: validate_pressure_trace(str(capture), start=start, end=start + 60),
+                     20 if quick else 100)
+    return {"samples": samples, "units": 6000, "unit": "samples"}
+
+
+def bench_log_event(fixtures: Path, quick: bool) -> Dict:
+    """Per-call enqueue latency; throughput includes the flush to the stub."""
+    from influx_logger import AuditLogger
+
+    events = AUDIT_EVENTS[quick]
+    audit_logger = AuditLogger()
+    start = time.perf_counter()
+    samples = _timed(lambda: audit_logger.log_event("benchmark", {"status": "ok"}), events)
+    audit_logger.flush(60.0)
+    elapsed = time.perf_counter() - start
+    stats = audit_logger.stats()
+    audit_logger.close()
+    if stats["flushed"] != events:
+        raise RuntimeError(f"Only {stats['flushed']} of {events} events reached the stub")
+    return {"samples": samples, "units": 1, "unit": "events",
+            "throughput": events / elapsed}
+
+
+def bench_parse_results(fixtures: Path, tests: int, quick: bool) -> Dict:
+    from send_to_influx_v1 import ResultSender
+
+    xml_file = output_xml(fixtures, tests)
+    sender = ResultSender()
+    return {"samples": _timed(lambda: sender.parse_results(str(xml_file)), 3),
+            "units": tests, "unit": "tests"}
+
+
+def bench_startup(fixtures: Path, module: str, quick: bool) -> Dict:
+    """Interpreter start plus import of a script, as each subprocess pays it."""
+    scripts_dir = Path(__file__).resolve().parent
+    command = [sys.executable, "-c", f"import {module}"]
+    samples = _timed(lambda: subprocess.run(command, cwd=scripts_dir, check=True), 3 if quick else 10)
+    return {"samples": samples, "units": 1, "unit": "starts",
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+
+
+def cases(quick: bool) -> Dict[str, tuple]:
+    """Return ``name -> (function, args)`` for every benchmark case."""
+    table: Dict[str, tuple] = {}
+    for size in IMAGE_SIZES[quick]:
+        label = f"{round(size / MB)}mb"
+        table[f"sha256_{label}"] = (bench_sha256, (size,))
+        table[f"update_firmware_{label}"] = (bench_update_firmware, (size,))
+        table[f"rollback_{label}"] = (bench_rollback, (size,))
+    table["validate_pressure"] = (bench_validate_pressure, ())
+    table["validate_pressure_trace"] = (bench_validate_pressure_trace, ())
+    table["validate_pressure_window"] = (bench_validate_pressure_window, ())
+    table["log_event"] = (bench_log_event, ())
+    for tests in OUTPUT_TESTS[quick]:
+        table[f"parse_results_{tests // 1000}k"] = (bench_parse_results, (tests,))
+    for module in SCRIPT_MODULES:
+        table[f"startup_{module}"] = (bench_startup, (module,))
+    return table
+
+
+# -- running ----------------------------------------------------------------
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(result: Dict) -> Dict:
+    """Reduce a case's raw samples to throughput and latency percentiles."""
+    ordered = sorted(result["samples"])
+    total = sum(ordered)
+    throughput = result.get("throughput") or (
+        result["units"] * len(ordered) / total if total > 0 else 0.0
+    )
+    return {
+        "unit": result["unit"],
+        "throughput": throughput,
+        "repetitions": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": _percentile(ordered, 0.50),
+        "p95": _percentile(ordered, 0.95),
+        "p99": _percentile(ordered, 0.99),
+        "max": ordered[-1],
+    }
+
+
+def _child(name: str, fixtures: str, quick: bool, conn) -> None:
+    function, args = cases(quick)[name]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function(Path(fixtures), *args, quick)
+        summary = summarize(result)
+        # Linux reports ru_maxrss in KiB
+        summary["peak_rss_kb"] = (
+            result.get("peak_rss_kb") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        )
+        conn.send(summary)
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_benchmarks(names: Optional[List[str]] = None, quick: bool = False,
+                   fixtures=None) -> Dict[str, Dict]:
+    """Run benchmark cases, each in its own process.
+
+    Args:
+        names: Case names or name prefixes to run (default: all).
+        quick: Use small fixtures and few repetitions.
+        fixtures: Directory for generated fixtures, reused between runs
+            (default: a temporary directory).
+
+    Returns:
+        Dict[str, Dict]: Summary per case, or ``{"error": ...}``.
+    """
+    cleanup = fixtures is None
+    fixtures = Path(fixtures or tempfile.mkdtemp(prefix="cpap_bench_"))
+    fixtures.mkdir(parents=True, exist_ok=True)
+    selected = [
+        name for name in cases(quick)
+        if not names or any(name.startswith(prefix) for prefix in names)
+    ]
+    context = multiprocessing.get_context("spawn")
+    results: Dict[str, Dict] = {}
+    saved_env = {key: os.environ.get(key)
+                 for key in ("INFLUXDB_HOST", "INFLUXDB_PORT", "AUDIT_SPOOL_DIR")}
+    # Spawned children copy our sys.path and must be able to import this module
+    scripts_dir = str(Path(__file__).resolve().parent)
+    added_path = scripts_dir not in sys.path
+    if added_path:
+        sys.path.insert(0, scripts_dir)
+    with StubInfluxServer() as stub:
+        host, port = stub.url.rsplit("//", 1)[1].split(":")
+        # Children inherit the environment: audit loggers write to the stub,
+        # through a spool of their own
+        spool_dir = fixtures / "audit_spool"
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        os.environ.update(INFLUXDB_HOST=host, INFLUXDB_PORT=port, AUDIT_SPOOL_DIR=str(spool_dir))
+        try:
+            for name in selected:
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=_child, args=(name, str(fixtures), quick, sender))
+                process.start()
+                sender.close()
+                try:
+                    results[name] = receiver.recv()
+                except EOFError:
+                    results[name] = {"error": f"benchmark process exited with {process.exitcode}"}
+                process.join()
+        finally:
+            for key, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+            if added_path:
+                sys.path.remove(scripts_dir)
+            if cleanup:
+                shutil.rmtree(fixtures, ignore_errors=True)
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict],
+            threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """Return a message for every metric that regressed beyond ``threshold``.
+
+    Lower throughput, or higher p95 latency or peak RSS, by more than the
+    threshold fraction counts as a regression.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or "error" in base:
+            continue
+        if "error" in result:
+            regressions.append(f"{name}: {result['error']}")
+            continue
+        if result["throughput"] < base["throughput"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {result['throughput']:.1f} {result['unit']}/s "
+                f"< baseline {base['throughput']:.1f}"
+            )
+        for metric in ("p95", "peak_rss_kb"):
+            if result[metric] > base[metric] * (1 + threshold):
+                regressions.append(
+                    f"{name}: {metric} {result[metric]:.6g} > baseline {base[metric]:.6g}"
+                )
+    return regressions
+
+
+def _print_table(results: Dict[str, Dict]) -> None:
+    print(f"{'case':<26}{'throughput':>22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'RSS MB':>9}")
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name:<26}  ERROR {result['error']}")
+            continue
+        rate = f"{result['throughput']:.1f} {result['unit']}/s"
+        print(
+            f"{name:<26}{rate:>22}{result['p50'] * 1e3:>10.3f}{result['p95'] * 1e3:>10.3f}"
+            f"{result['p99'] * 1e3:>10.3f}{result['peak_rss_kb'] / 1024:>9.1f}"
+        )
+
+
+@keyword("Run Benchmarks")
+def run_benchmarks_keyword(*names, quick=True):
+    """Run benchmark cases (names or prefixes) and return their summaries."""
+    results = run_benchmarks(list(names), quick=quick in (True, "True", "true"))
+    errors = {name: r["error"] for name, r in results.items() if "error" in r}
+    if errors:
+        raise RuntimeError(f"Benchmarks failed: {errors}")
+    return results
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the QA toolchain's hot paths")
+    parser.add_argument("cases", nargs="*", help="Case names or prefixes (default: all)")
+    parser.add_argument("--quick", action="store_true", help="Small fixtures, few repetitions")
+    parser.add_argument("--fixtures", help="Keep generated fixtures in this directory")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Write results as a baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Allowed relative regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.cases, args.quick, args.fixtures)
+    _print_table(results)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%}")
+    if any("error" in result for result in results.values()):
+        sys.exit(1)
@@ -0,0 +1,292 @@
+"""Batched boundary and property-based checks of the safety thresholds.
+
+One keyword call evaluates thousands of generated cases against the same
+decision functions the validation keywords use:
+
+* ``pressure_tolerance`` -- ``pressure_within_tolerance`` for every target
+  and tolerance in the grid, at the tolerance edges, a few ULPs and
+  decades either side of them, and at seeded random pressures,
+* ``apnea_alarm`` -- ``apnea_alarm_triggered`` around every alarm
+  threshold in the same way, and
+* ``apnea_detector`` -- one synthetic flow recording per threshold with
+  pauses of random and near-threshold lengths, run once through the
+  streaming detector with a random chunk size.
+
+Each case is compared with an exact oracle: near a boundary the decision is
+recomputed in rational arithmetic, so float rounding in the implementation
+shows up as a failure. The result is a single summary with the minimal
+failing input -- the one closest to its boundary.
+"""
+
+import math
+from fractions import Fraction
+from typing import Dict, List, Optional
+
+import numpy as np
+from robot.api.deco import keyword
+
+from alarm_testing import ApneaDetector, apnea_alarm_triggered
+from config import device_config
+from influx_logger import SuiteFlushListener, logger as _logger
+from instrumentation import instrumented
+from pressure_validator import pressure_within_tolerance
+
+PROPERTIES = ("pressure_tolerance", "apnea_alarm", "apnea_detector")
+
+# Safe therapy pressure range (cmH2O) swept by default
+DEFAULT_TARGETS = tuple(4.0 + 0.5 * step for step in range(33))
+
+# Offsets from each boundary: absolute steps and ULP steps
+_OFFSETS = (1e-9, 1e-6, 1e-3, 1e-2, 1e-1)
+_ULP_STEPS = 3
+
+# Detector recordings are sampled at 64 Hz so timestamps are exact in binary
+_SAMPLE_PERIOD = 1 / 64
+_BREATHING_FLOW = 20.0
+
+
+def _floats(values) -> List[float]:
+    """Accept a number, a comma-separated string or a list from Robot."""
+    if isinstance(values, str):
+        values = values.split(",")
+    elif not isinstance(values, (list, tuple, np.ndarray)):
+        values = [values]
+    return [float(value) for value in values]
+
+
+def _around(edges: np.ndarray) -> np.ndarray:
+    """Return ``(len(edges), k)`` probe values at and around each edge."""
+    columns = [edges]
+    for direction in (-np.inf, np.inf):
+        value = edges
+        for _ in range(_ULP_STEPS):
+            value = np.nextafter(value, direction)
+            columns.append(value)
+    for offset in _OFFSETS:
+        columns.extend((edges - offset, edges + offset))
+    return np.stack(columns, axis=1)
+
+
+def _exact_within(measured: float, target: float, tolerance: float) -> bool:
+    return abs(Fraction(measured) - Fraction(target)) <= Fraction(tolerance)
+
+
+class _Failures:
+    """Counts failures per property and keeps the one closest to its boundary."""
+
+    def __init__(self):
+        self.cases: Dict[str, int] = {name: 0 for name in PROPERTIES}
+        self.failures: Dict[str, int] = {name: 0 for name in PROPERTIES}
+        self.minimal: Optional[Dict] = None
+
+    def add(self, prop: str, cases: int, failed: np.ndarray, distance: np.ndarray, describe) -> None:
+        self.cases[prop] += cases
+        failed = np.flatnonzero(failed)
+        if not failed.size:
+            return
+        self.failures[prop] += int(failed.size)
+        index = int(failed[np.argmin(distance[failed])])
+        if self.minimal is None or distance[index] < self.minimal["distance"]:
+            self.minimal = {"property": prop, "distance": float(distance[index]), **describe(index)}
+
+
+def _check_pressure(failures: _Failures, targets, tolerances, random_cases: int, rng) -> None:
+    grid_t, grid_tol = (a.ravel() for a in np.meshgrid(targets, tolerances))
+    probes = np.concatenate((_around(grid_t - grid_tol), _around(grid_t + grid_tol)), axis=1)
+    width = probes.shape[1]
+    boundary_t = np.repeat(grid_t, width)
+    boundary_tol = np.repeat(grid_tol, width)
+
+    random_t = rng.choice(targets, random_cases)
+    random_tol = rng.choice(tolerances, random_cases)
+    random_m = random_t + rng.uniform(-3.0, 3.0, random_cases) * random_tol
+
+    measured = np.concatenate((probes.ravel(), random_m))
+    target = np.concatenate((boundary_t, random_t))
+    tolerance = np.concatenate((boundary_tol, random_tol))
+
+    actual = np.asarray(pressure_within_tolerance(measured, target, tolerance), dtype=bool)
+    margin = np.abs(measured - target) - tolerance
+    expected = margin <= 0
+    # Decide every case near its boundary exactly
+    scale = np.maximum(1.0, np.maximum(np.abs(target), tolerance))
+    for index in np.flatnonzero(np.abs(margin) <= 1e-6 * scale):
+        expected[index] = _exact_within(measured[index], target[index], tolerance[index])
+
+    failures.add(
+        "pressure_tolerance", measured.size, actual != expected, np.abs(margin),
+        lambda i: {
+            "inputs": {"measured": float(measured[i]), "target": float(target[i]),
+                       "tolerance": float(tolerance[i])},
+            "expected": bool(expected[i]), "actual": bool(actual[i]),
+        },
+    )
+
+
+def _check_alarm(failures: _Failures, thresholds, random_cases: int, rng) -> None:
+    probes = _around(thresholds)
+    threshold = np.repeat(thresholds, probes.shape[1])
+    random_threshold = rng.choice(thresholds, random_cases)
+    duration = np.concatenate((probes.ravel(), rng.uniform(0.0, 2.0, random_cases) * random_threshold))
+    threshold = np.concatenate((threshold, random_threshold))
+
+    actual = np.asarray(apnea_alarm_triggered(duration, threshold), dtype=bool)
+    expected = np.array([Fraction(d) >= Fraction(t) for d, t in zip(duration.tolist(), threshold.tolist())])
+
+    failures.add(
+        "apnea_alarm", duration.size, actual != expected, np.abs(duration - threshold),
+        lambda i: {
+            "inputs": {"duration": float(duration[i]), "threshold": float(threshold[i])},
+            "expected": bool(expected[i]), "actual": bool(actual[i]),
+        },
+    )
+
+
+def _check_detector(failures: _Failures, threshold: float, pauses: int, rng) -> None:
+    # Pause lengths in samples; a pause of n samples lasts n periods, until
+    # breathing resumes
+    edge = math.ceil(threshold / _SAMPLE_PERIOD)
+    lengths = np.concatenate((
+        np.arange(max(1, edge - 3), edge + 3),
+        rng.integers(1, 2 * edge, max(0, pauses - 6)),
+    ))
+    rng.shuffle(lengths)
+    gaps = rng.integers(1, 64, lengths.size + 1)
+
+    low = np.zeros(int(gaps.sum() + lengths.sum()), dtype=bool)
+    onsets = np.cumsum(gaps[:-1]) + np.concatenate(([0], np.cumsum(lengths[:-1])))
+    for onset, length in zip(onsets, lengths):
+        low[onset:onset + length] = True
+    timestamps = np.arange(low.size) * _SAMPLE_PERIOD
+    flow = np.where(low, 0.0, _BREATHING_FLOW)
+
+    detector = ApneaDetector(alarm_threshold=threshold)
+    chunk_size = int(rng.integers(1, 4 * edge))
+    episodes = []
+    for start in range(0, low.size, chunk_size):
+        episodes += detector.feed(timestamps[start:start + chunk_size], flow[start:start + chunk_size])
+    episodes += detector.finish()
+
+    period = Fraction(_SAMPLE_PERIOD)
+    expected = np.array([int(n) * period >= Fraction(threshold) for n in lengths])
+    alarmed = {episode["onset"] for episode in episodes}
+    actual = np.array([float(timestamps[onset]) in alarmed for onset in onsets])
+    failed = actual != expected
+    if len(episodes) != int(actual.sum()):
+        failed[:] = True  # Episodes at times where no pause started
+
+    durations = lengths * _SAMPLE_PERIOD
+    failures.add(
+        "apnea_detector", lengths.size, failed, np.abs(durations - threshold),
+        lambda i: {
+            "inputs": {"pause_duration": float(durations[i]), "threshold": threshold,
+                       "sample_period": _SAMPLE_PERIOD, "chunk_size": chunk_size},
+            "expected": bool(expected[i]), "actual": bool(actual[i]),
+        },
+    )
+
+
+@instrumented("boundary.check", "validation")
+def check_threshold_boundaries(
+    targets=DEFAULT_TARGETS,
+    tolerances=None,
+    alarm_thresholds=None,
+    random_cases: int = 10_000,
+    detector_pauses: int = 200,
+    seed: int = 0,
+    properties=PROPERTIES,
+) -> Dict:
+    """Evaluate boundary and random cases of the threshold decisions.
+
+    Args:
+        targets: Target pressures in cmH2O.
+        tolerances: Pressure tolerances (default: ``device_config``).
+        alarm_thresholds: Apnea alarm thresholds in seconds (default:
+            ``device_config``).
+        random_cases: Random cases per property, on top of the boundary cases.
+        detector_pauses: Pauses in each synthetic flow recording.
+        seed: Seed of the random generator; the same seed gives the same cases.
+        properties: Names from ``PROPERTIES`` to check.
+
+    Returns:
+        Dict: ``cases``, ``failures``, ``passed``, per-property counts and
+        ``minimal_failure`` (None when every case passed).
+    """
+    rng = np.random.default_rng(int(seed))
+    targets = np.array(_floats(targets))
+    tolerances = np.array(_floats(
+        device_config.pressure_tolerance if tolerances is None else tolerances
+    ))
+    thresholds = np.array(_floats(
+        device_config.apnea_threshold if alarm_thresholds is None else alarm_thresholds
+    ))
+    properties = [p.strip() for p in properties.split(",")] if isinstance(properties, str) else list(properties)
+    unknown = set(properties) - set(PROPERTIES)
+    if unknown:
+        raise ValueError(f"Unknown properties: {', '.join(sorted(unknown))}")
+
+    failures = _Failures()
+    if "pressure_tolerance" in properties:
+        _check_pressure(failures, targets, tolerances, int(random_cases), rng)
+    if "apnea_alarm" in properties:
+        _check_alarm(failures, thresholds, int(random_cases), rng)
+    if "apnea_detector" in properties:
+        for threshold in thresholds:
+            _check_detector(failures, float(threshold), int(detector_pauses), rng)
+
+    cases = sum(failures.cases.values())
+    failed = sum(failures.failures.values())
+    return {
+        "cases": cases,
+        "failures": failed,
+        "passed": failed == 0,
+        "seed": int(seed),
+        "properties": {
+            name: {"cases": failures.cases[name], "failures": failures.failures[name]}
+            for name in properties
+        },
+        "minimal_failure": failures.minimal,
+    }
+
+
+@keyword("Check Threshold Boundaries")
+def check_threshold_boundaries_keyword(
+    targets=DEFAULT_TARGETS,
+    tolerances=None,
+    alarm_thresholds=None,
+    random_cases=10_000,
+    detector_pauses=200,
+    seed=0,
+    properties=PROPERTIES,
+):
+    """Check the pressure and apnea thresholds over a parameter grid in one call.
+
+    Arguments are those of ``check_threshold_boundaries``; lists may be
+    given as comma-separated strings. One audit event records the summary.
+
+    Returns:
+        dict: The summary; ``passed`` is False if any case failed.
+
+    Note:
+        Follows ISO 80601-2-70 requirements for pressure accuracy and apnea
+        detection.
+    """
+    summary = check_threshold_boundaries(
+        targets, tolerances, alarm_thresholds, random_cases, detector_pauses, seed, properties
+    )
+    minimal = summary["minimal_failure"]
+    _logger.log_event("boundary_check", {
+        "cases": summary["cases"],
+        "failures": summary["failures"],
+        "seed": summary["seed"],
+        "minimal_failure": str(minimal) if minimal else "",
+        "result": "passed" if summary["passed"] else "failed",
+    })
+    print(f"Boundary check: {summary['cases']} cases, {summary['failures']} failures"
+          + (f", minimal failing input {minimal}" if minimal else ""))
+    return summary
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
+ROBOT_LIBRARY_LISTENER = SuiteFlushListener()
@@ -0,0 +1,446 @@
+"""Binary columnar capture format for sensor recordings.
+
+A capture (``.cpcap``) holds a recording as one contiguous, fixed-width
+column per channel, so a validator memory-maps the file and slices any
+time window of a multi-GB recording without reading the rest of it.
+
+File layout (little endian, every section 64-byte aligned)::
+
+    header    magic "CPCP", format u16, column count u16, row count u64,
+              rows per block u64, block index offset u64
+    columns   per column: name 16s, dtype 4s (numpy str, e.g. "<f4"),
+              data offset u64
+    crc32     u32 over header and column table
+    index     per block: first and last timestamp, int64 ns
+    data      each column's values for all rows, in table order
+
+The first column is always ``timestamp`` (int64 nanoseconds, non-
+decreasing); the others are float64 by default (NaN marks a missing
+reading), float32 or int64. Columns keep the order of the CSV they came
+from, so a pressure capture is ``timestamp, measured[, target]`` and a
+flow recording ``timestamp, flow[, flow...]``, as in the CSV formats.
+
+Validators compare readings against the tolerance band exactly as parsed
+from the CSV, and a capture exported back to CSV writes every value and
+timestamp without rounding, so verdicts at a ±0.5 cmH2O edge survive the
+round trip. Narrowing to float32 would move such samples; use it only for
+recordings that are never checked at a boundary.
+
+The block index locates a time window by searching the index and then
+the timestamps of a single block. ``CaptureWriter`` streams rows to
+per-column spill files and assembles the capture atomically on close,
+so converting a CSV never holds the recording in memory.
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import struct
+import zlib
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from robot.api.deco import keyword
+from atomic_io import fsync_dir
+from config import TEST_DATA_DIR
+
+MAGIC = b"CPCP"
+FORMAT_VERSION = 1
+CAPTURE_SUFFIX = ".cpcap"
+DEFAULT_BLOCK_ROWS = 65_536
+
+_HEADER = struct.Struct("<4sHHQQQ")
+_COLUMN = struct.Struct("<16s4sQ")
+_TABLE_CRC = struct.Struct("<I")
+_ALIGN = 64
+_DTYPES = {"float32": "<f4", "float64": "<f8", "int64": "<i8"}
+_COPY_BUFFER = 8 * 1024 * 1024
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def to_ns(seconds) -> np.ndarray:
+    """Convert timestamps in seconds to int64 nanoseconds."""
+    seconds = np.asarray(seconds, dtype=np.float64)
+    if np.isnan(seconds).any():
+        raise ValueError("Timestamps must not be missing")
+    return np.rint(seconds * 1e9).astype(np.int64)
+
+
+class CaptureWriter:
+    """Streams ``timestamp, value...`` rows into a new capture file."""
+
+    def __init__(self, path, columns: Sequence[str], dtype: str = "float64",
+                 block_rows: int = DEFAULT_BLOCK_ROWS):
+        """Start a capture.
+
+        Args:
+            path: Capture to create; replaced only when the writer closes.
+            columns: Names of the value columns, after ``timestamp``.
+            dtype: ``float32``, ``float64`` or ``int64`` for the value columns.
+            block_rows: Rows per block of the time index.
+
+        Raises:
+            ValueError: On an unknown dtype, a name longer than 16 bytes or
+                a non-positive block size.
+        """
+        if dtype not in _DTYPES:
+            raise ValueError(f"Unknown dtype {dtype!r} (expected one of {', '.join(_DTYPES)})")
+        if block_rows <= 0:
+            raise ValueError("block_rows must be positive")
+        self.path = Path(path)
+        self.names = ["timestamp", *columns]
+        for name in self.names:
+            if not name or len(name.encode()) > 16:
+                raise ValueError(f"Column name {name!r} must be 1 to 16 bytes")
+        self.dtypes = [np.dtype("<i8")] + [np.dtype(_DTYPES[dtype])] * len(columns)
+        self.block_rows = block_rows
+        self.rows = 0
+        self._last = None
+        self._spills = [
+            self.path.with_name(f".{self.path.name}.col{index}.tmp-{os.getpid()}")
+            for index in range(len(self.names))
+        ]
+        self._files = [open(spill, "wb") for spill in self._spills]
+
+    def append(self, chunk) -> None:
+        """Append rows of ``timestamp`` (seconds) followed by one value per column.
+
+        Raises:
+            ValueError: If the row width is wrong or timestamps go backwards.
+        """
+        chunk = np.atleast_2d(np.asarray(chunk, dtype=np.float64))
+        if chunk.shape[1] != len(self.names):
+            raise ValueError(f"Expected {len(self.names)} columns, got {chunk.shape[1]}")
+        if not chunk.shape[0]:
+            return
+        timestamps = to_ns(chunk[:, 0])
+        previous = timestamps[:1] if self._last is None else np.array([self._last])
+        if (np.diff(timestamps, prepend=previous) < 0).any():
+            raise ValueError("Timestamps must not decrease")
+        self._last = int(timestamps[-1])
+        self._files[0].write(timestamps.tobytes())
+        for index, file in enumerate(self._files[1:], start=1):
+            file.write(chunk[:, index].astype(self.dtypes[index]).tobytes())
+        self.rows += chunk.shape[0]
+
+    def close(self) -> Path:
+        """Write the capture and remove the spill files.
+
+        Returns:
+            Path: The capture.
+        """
+        for file in self._files:
+            file.close()
+        try:
+            self._assemble()
+        finally:
+            for spill in self._spills:
+                spill.unlink(missing_ok=True)
+        return self.path
+
+    def discard(self) -> None:
+        """Abandon the capture, leaving any existing file untouched."""
+        for file in self._files:
+            file.close()
+        for spill in self._spills:
+            spill.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def _index(self) -> np.ndarray:
+        if not self.rows:
+            return np.empty((0, 2), dtype=np.int64)
+        timestamps = np.memmap(self._spills[0], dtype="<i8", mode="r")
+        firsts = np.asarray(timestamps[::self.block_rows])
+        lasts = np.asarray(timestamps[self.block_rows - 1::self.block_rows])
+        if lasts.size < firsts.size:
+            lasts = np.append(lasts, timestamps[-1])
+        del timestamps
+        return np.column_stack((firsts, lasts)).astype("<i8")
+
+    def _assemble(self) -> None:
+        index = self._index()
+        table_end = _HEADER.size + _COLUMN.size * len(self.names) + _TABLE_CRC.size
+        index_offset = _aligned(table_end)
+        offset = _aligned(index_offset + index.nbytes)
+        offsets = []
+        for dtype in self.dtypes:
+            offsets.append(offset)
+            offset = _aligned(offset + self.rows * dtype.itemsize)
+
+        header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(self.names), self.rows,
+                              self.block_rows, index_offset)
+        table = b"".join(
+            _COLUMN.pack(name.encode(), dtype.str.encode(), column_offset)
+            for name, dtype, column_offset in zip(self.names, self.dtypes, offsets)
+        )
+        tmp = self.path.with_name(f".{self.path.name}.tmp-{os.getpid()}")
+        try:
+            with open(tmp, "wb") as file:
+                file.write(header + table + _TABLE_CRC.pack(zlib.crc32(header + table)))
+                file.seek(index_offset)
+                file.write(index.tobytes())
+                for spill, column_offset in zip(self._spills, offsets):
+                    file.seek(column_offset)
+                    with open(spill, "rb") as source:
+                        shutil.copyfileobj(source, file, _COPY_BUFFER)
+                file.truncate(offset)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        fsync_dir(self.path.parent)
+
+
+class Capture:
+    """Read-only, memory-mapped view of a capture file.
+
+    Columns are numpy views of the mapping: slicing them reads only the
+    pages of the rows sliced. The mapping is released when the capture and
+    every view taken from it are gone.
+    """
+
+    def __init__(self, path):
+        """Open a capture.
+
+        Raises:
+            ValueError: If the file is not a valid capture.
+        """
+        self.path = Path(path)
+        raw = np.memmap(self.path, dtype=np.uint8, mode="r")
+        if raw.size < _HEADER.size:
+            raise ValueError(f"{self.path}: truncated header")
+        magic, fmt, count, rows, block_rows, index_offset = _HEADER.unpack_from(raw, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path}: not a capture file")
+        if fmt != FORMAT_VERSION:
+            raise ValueError(f"{self.path}: unsupported capture format {fmt}")
+        table_end = _HEADER.size + _COLUMN.size * count
+        (crc,) = _TABLE_CRC.unpack_from(raw, table_end)
+        if zlib.crc32(raw[:table_end]) != crc:
+            raise ValueError(f"{self.path}: header CRC mismatch")
+
+        self.rows = rows
+        self.block_rows = block_rows
+        self.columns: Dict[str, np.ndarray] = {}
+        for index in range(count):
+            name, dtype, offset = _COLUMN.unpack_from(raw, _HEADER.size + index * _COLUMN.size)
+            dtype = np.dtype(dtype.rstrip(b"\0").decode())
+            end = offset + rows * dtype.itemsize
+            if end > raw.size:
+                raise ValueError(f"{self.path}: column {index} extends past end of file")
+            self.columns[name.rstrip(b"\0").decode()] = raw[offset:end].view(dtype)
+        blocks = -(-rows // block_rows) if rows else 0
+        self.index = raw[index_offset:index_offset + blocks * 16].view("<i8").reshape(blocks, 2)
+        self.timestamps = next(iter(self.columns.values()))
+
+    @property
+    def names(self) -> List[str]:
+        """Names of the value columns, after ``timestamp``."""
+        return list(self.columns)[1:]
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _row(self, ns: int) -> int:
+        """Return the first row at or after ``ns``, searching one block."""
+        block = int(np.searchsorted(self.index[:, 1], ns, side="left"))
+        if block == len(self.index):
+            return self.rows
+        start = block * self.block_rows
+        timestamps = self.timestamps[start:start + self.block_rows]
+        return start + int(np.searchsorted(timestamps, ns, side="left"))
+
+    def window(self, start: Optional[float] = None, end: Optional[float] = None) -> slice:
+        """Return the rows with ``start <= timestamp < end`` (seconds) as a slice."""
+        first = 0 if start is None else self._row(int(to_ns(start)))
+        last = self.rows if end is None else self._row(int(to_ns(end)))
+        return slice(first, max(first, last))
+
+    def read(self, start: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        """Return the window as float64 ``timestamp (s), value...`` rows."""
+        rows = self.window(start, end)
+        values = [column[rows] for column in self.columns.values()]
+        return np.column_stack([values[0] / 1e9] + values[1:]).astype(np.float64, copy=False)
+
+    def iter_chunks(self, chunk_rows: int = DEFAULT_BLOCK_ROWS, start: Optional[float] = None,
+                    end: Optional[float] = None) -> Iterator[np.ndarray]:
+        """Yield the window as float64 ``timestamp (s), value...`` chunks."""
+        rows = self.window(start, end)
+        for first in range(rows.start, rows.stop, chunk_rows):
+            last = min(first + chunk_rows, rows.stop)
+            values = [column[first:last] for column in self.columns.values()]
+            yield np.column_stack([values[0] / 1e9] + values[1:]).astype(np.float64, copy=False)
+
+    def info(self) -> Dict:
+        """Return the columns, row count, blocks and time span in seconds."""
+        return {
+            "path": str(self.path),
+            "columns": {name: column.dtype.name for name, column in self.columns.items()},
+            "rows": self.rows,
+            "blocks": len(self.index),
+            "start": float(self.index[0, 0]) / 1e9 if self.rows else None,
+            "end": float(self.index[-1, 1]) / 1e9 if self.rows else None,
+        }
+
+
+def is_capture(source) -> bool:
+    """Return whether ``source`` is a path to a capture file."""
+    return isinstance(source, (str, Path)) and Path(source).suffix == CAPTURE_SUFFIX
+
+
+def open_capture(path) -> Capture:
+    """Open a capture, looking up relative paths in ``TEST_DATA_DIR`` as a fallback."""
+    path = Path(path)
+    if not path.is_absolute() and not path.exists() and (TEST_DATA_DIR / path).exists():
+        path = TEST_DATA_DIR / path
+    return Capture(path)
+
+
+def csv_columns(path) -> Tuple[Optional[List[str]], int]:
+    """Return the header names of a CSV (None if it has none) and its width."""
+    with open(path, newline="") as file:
+        rows = csv.reader(line for line in file if not line.startswith("#"))
+        first = next(rows, [])
+    try:
+        [float(value) for value in first]
+    except ValueError:
+        return [name.strip() for name in first], len(first)
+    return None, len(first)
+
+
+def iter_csv_chunks(path, chunk_rows: int = DEFAULT_BLOCK_ROWS) -> Iterator[np.ndarray]:
+    """Yield the numeric rows of a CSV (optional header, ``#`` comments) as float64 chunks."""
+    with open(path, newline="") as file:
+        rows = csv.reader(line for line in file if not line.startswith("#"))
+        first = next(rows, None)
+        if first is None:
+            return
+        try:
+            pending = [[float(value) for value in first]]
+        except ValueError:
+            pending = []  # Header row
+        while True:
+            pending.extend(
+                [float(value) for value in row] for row in islice(rows, chunk_rows - len(pending))
+            )
+            if not pending:
+                return
+            yield np.array(pending, dtype=np.float64)
+            pending = []
+
+
+def csv_to_capture(csv_path, capture_path=None, dtype: str = "float64",
+                   block_rows: int = DEFAULT_BLOCK_ROWS) -> Path:
+    """Convert a ``timestamp, value...`` CSV into a capture, streaming.
+
+    Args:
+        csv_path: CSV with timestamps in seconds and an optional header row;
+            without a header the value columns are named ``channel1``,
+            ``channel2``, ...
+        capture_path: Output (default: the CSV path with ``.cpcap`` suffix).
+        dtype: Type of the value columns.
+        block_rows: Rows per block of the time index.
+
+    Returns:
+        Path: The capture.
+    """
+    names, width = csv_columns(csv_path)
+    if width < 2:
+        raise ValueError(f"{csv_path}: expected a timestamp and at least one value column")
+    columns = names[1:] if names else [f"channel{index}" for index in range(1, width)]
+    capture_path = Path(capture_path or Path(csv_path).with_suffix(CAPTURE_SUFFIX))
+    with CaptureWriter(capture_path, columns, dtype, block_rows) as writer:
+        for chunk in iter_csv_chunks(csv_path):
+            writer.append(chunk)
+    return capture_path
+
+
+def _seconds_text(ns: int) -> str:
+    """Format integer nanoseconds as exact decimal seconds."""
+    seconds, fraction = divmod(abs(ns), 10**9)
+    text = f"{seconds}.{fraction:09d}".rstrip("0").rstrip(".")
+    return f"-{text}" if ns < 0 else text
+
+
+def capture_to_csv(capture_path, csv_path=None, chunk_rows: int = DEFAULT_BLOCK_ROWS) -> Path:
+    """Write a capture back out as a CSV with a header row.
+
+    Timestamps are written from the nanosecond column and values in their
+    shortest round-trip form, so nothing is rounded on the way out.
+
+    Returns:
+        Path: The CSV.
+    """
+    capture = open_capture(capture_path)
+    csv_path = Path(csv_path or capture.path.with_suffix(".csv"))
+    columns = list(capture.columns.values())
+    with open(csv_path, "w") as file:
+        file.write(",".join(capture.columns) + "\n")
+        for first in range(0, capture.rows, chunk_rows):
+            values = [column[first:first + chunk_rows].tolist() for column in columns]
+            file.writelines(
+                ",".join([_seconds_text(row[0]), *map(repr, row[1:])]) + "\n"
+                for row in zip(*values)
+            )
+    return csv_path
+
+
+@keyword("Convert CSV To Capture")
+def convert_csv_to_capture(csv_path, capture_path=None, dtype="float64"):
+    """Convert a sensor CSV into a memory-mappable capture.
+
+    Returns:
+        str: Path of the capture.
+    """
+    return str(csv_to_capture(csv_path, capture_path, dtype))
+
+
+@keyword("Convert Capture To CSV")
+def convert_capture_to_csv(capture_path, csv_path=None):
+    """Write a capture back out as a CSV.
+
+    Returns:
+        str: Path of the CSV.
+    """
+    return str(capture_to_csv(capture_path, csv_path))
+
+
+@keyword("Capture Info")
+def capture_info(path):
+    """Return a capture's ``columns`` (name to dtype), ``rows``, ``blocks``,
+    and ``start`` and ``end`` times in seconds."""
+    return open_capture(path).info()
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert sensor recordings to and from captures")
+    parser.add_argument("source", help="CSV to convert, or a .cpcap to export as CSV")
+    parser.add_argument("output", nargs="?")
+    parser.add_argument("--dtype", choices=sorted(_DTYPES), default="float64")
+    parser.add_argument("--block-rows", type=int, default=DEFAULT_BLOCK_ROWS)
+    args = parser.parse_args()
+
+    if is_capture(args.source):
+        print(capture_to_csv(args.source, args.output))
+    else:
+        print(csv_to_capture(args.source, args.output, args.dtype, args.block_rows))
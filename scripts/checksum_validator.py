@@ -1,26 +1,197 @@
-"""SHA-256 checksum verification for firmware integrity."""
+"""SHA-256 checksum verification for firmware integrity.
 
+Directory reports cache digests in a sidecar index (``.sha256_index.json``)
+next to the images, keyed by path, size, mtime and inode, so unchanged
+images are never re-hashed. Many images can be hashed concurrently.
+
+A digest that is compared against an expected one is always computed from
+the file (``sha256`` does not use the index unless asked), since an image
+rewritten in place could still match its index key.
+"""
+
+import argparse
 import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from robot.api.deco import keyword
 from config import NEW_FIRMWARE_PATH, DEVICE_FIRMWARE_PATH
 
+INDEX_NAME = ".sha256_index.json"
+
+# Files below this size are read in one call instead of memory-mapped
+_MMAP_THRESHOLD = 1024 * 1024
+
+# Files modified more recently than this are not cached: a rewrite within the
+# same timestamp tick could keep size, mtime and inode unchanged
+_RACY_WINDOW_NS = 2_000_000_000
+
+
+def _hash_file(path) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size >= _MMAP_THRESHOLD:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                sha.update(view)
+        else:
+            sha.update(file.read())
+    return sha.hexdigest()
+
 
-def sha256(path):
+class DigestCache:
+    """Persistent sidecar index of file digests for one directory."""
+
+    def __init__(self, directory):
+        self.path = Path(directory) / INDEX_NAME
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.hashed_bytes = 0
+        try:
+            with open(self.path) as file:
+                self._entries = json.load(file)
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+
+    @staticmethod
+    def _key(stat) -> List[int]:
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def digest(self, path) -> str:
+        """Return the digest of ``path``, hashing only if it changed."""
+        path = Path(path)
+        stat = path.stat()
+        key = self._key(stat)
+        name = path.name
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry["key"] == key:
+                self.hits += 1
+                return entry["sha256"]
+        digest = _hash_file(path)
+        with self._lock:
+            self.misses += 1
+            self.hashed_bytes += stat.st_size
+            if time.time_ns() - stat.st_mtime_ns > _RACY_WINDOW_NS:
+                self._entries[name] = {"key": key, "sha256": digest}
+                self._dirty = True
+        return digest
+
+    def save(self) -> None:
+        """Atomically write the index if it changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp = self.path.with_name(f"{self.path.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+            try:
+                with open(tmp, "w") as file:
+                    json.dump(self._entries, file)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"Warning: could not save digest index - {str(e)}")
+                return
+            self._dirty = False
+
+
+def sha256(path, use_cache: bool = False):
     """Calculate SHA-256 hash of a file.
 
     Args:
         path (Path): Path to the file.
+        use_cache (bool): Reuse the digest from the sidecar index if the
+            file looks unchanged. Only for reporting; default is False.
 
     Returns:
         str: Hex digest of the file hash.
     """
-    sha = hashlib.sha256()
-    with open(path, 'rb') as file:
-        while chunk := file.read(8192):
-            sha.update(chunk)
-    return sha.hexdigest()
+    if not use_cache:
+        return _hash_file(path)
+    cache = DigestCache(Path(path).parent)
+    digest = cache.digest(path)
+    cache.save()
+    return digest
 
 
-if __name__ == "__main__":
+def sha256_many(paths: Iterable, workers: Optional[int] = None) -> Dict[str, Dict]:
+    """Hash many files concurrently, reusing cached digests.
+
+    Args:
+        paths: Files to hash.
+        workers: Thread pool size (default: CPU count).
+
+    Returns:
+        Dict: Summary with ``digests`` (path -> hex digest), ``files``,
+        ``bytes``, ``cache_hits``, ``seconds`` and ``mb_per_s`` (bytes
+        actually hashed per second).
+    """
+    paths = [Path(p) for p in paths]
+    caches = {directory: DigestCache(directory) for directory in {p.parent for p in paths}}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        digests = list(pool.map(lambda p: caches[p.parent].digest(p), paths))
+    elapsed = time.perf_counter() - start
+    for cache in caches.values():
+        cache.save()
+
+    hashed_bytes = sum(cache.hashed_bytes for cache in caches.values())
+    return {
+        "digests": {str(p): d for p, d in zip(paths, digests)},
+        "files": len(paths),
+        "bytes": sum(p.stat().st_size for p in paths),
+        "cache_hits": sum(cache.hits for cache in caches.values()),
+        "seconds": elapsed,
+        "mb_per_s": (hashed_bytes / 1e6) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+@keyword("Validate Firmware Directory")
+def validate_firmware_directory(directory, pattern="*.bin", reference=None, workers=None):
+    """Hash every image in a directory in one call.
+
+    Args:
+        directory: Directory containing firmware images.
+        pattern: Glob selecting the images.
+        reference: Optional image path; the result reports which images
+            match its digest.
+        workers: Thread pool size.
+
+    Returns:
+        dict: ``sha256_many`` summary plus ``matches`` (paths whose digest
+        equals the reference) when a reference is given.
+    """
+    paths = sorted(Path(directory).glob(pattern))
+    report = sha256_many(paths, int(workers) if workers else None)
+    if reference is not None:
+        expected = sha256(reference)
+        report["matches"] = [p for p, d in report["digests"].items() if d == expected]
+    print(
+        f"Hashed {report['files']} images ({report['bytes']} bytes, "
+        f"{report['cache_hits']} cached) at {report['mb_per_s']:.1f} MB/s"
+    )
+    return report
+
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", help="Hash every image in this directory")
+    parser.add_argument("--pattern", default="*.bin", help="Glob for --dir")
+    parser.add_argument("--workers", type=int, help="Hashing threads")
+    args = parser.parse_args(argv)
+
+    if args.dir:
+        report = validate_firmware_directory(args.dir, args.pattern, workers=args.workers)
+        for path, digest in report["digests"].items():
+            print(f"{digest}  {path}")
+        return
+
     new_hash = sha256(NEW_FIRMWARE_PATH)
     installed_hash = sha256(DEVICE_FIRMWARE_PATH)
 
@@ -28,3 +199,10 @@ if __name__ == "__main__":
         print("Checksum match: Firmware integrity validated.")
     else:
         print("Checksum mismatch: Firmware may be corrupted.")
+
+
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
+
+
+if __name__ == "__main__":
+    _main()
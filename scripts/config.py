@@ -1,24 +1,158 @@
-"""Configuration for medical device testing framework."""
+"""Configuration for medical device testing framework.
 
+Device models are described by named profiles in a JSON file
+(``device_profiles.json`` in the base directory, or ``CPAP_PROFILES``)::
+
+    {"default": {"pressure_tolerance": 0.5, "apnea_threshold": 10.0},
+     "travel":  {"max_firmware_size": 4000000, "firmware_dir": "firmware/travel"}}
+
+Missing fields take the ``DeviceConfig`` defaults; ``firmware_dir`` is
+relative to the base directory (``CPAP_BASE_DIR``, default the repository).
+``CPAP_DEVICE_PROFILE`` selects the profile of a process (default
+``default``).
+
+The selected profile is loaded and validated once per process. It is then
+exported, already resolved, in ``CPAP_DEVICE_CONFIG`` together with the size
+and mtime of its file, so worker processes and ``robot`` subprocesses start
+from the same profile without parsing the profile file again.
+"""
+
+import json
+import os
+from dataclasses import asdict, dataclass, fields
 from pathlib import Path
-from dataclasses import dataclass
+from typing import Dict, Optional
 
+BASE_DIR = Path(os.getenv("CPAP_BASE_DIR") or Path(__file__).resolve().parent.parent)
+PROFILES_FILE = Path(os.getenv("CPAP_PROFILES") or BASE_DIR / "device_profiles.json")
+DEFAULT_PROFILE = "default"
 
-@dataclass
+# Environment variable carrying the resolved profile to subprocesses
+PROFILE_CACHE_ENV = "CPAP_DEVICE_CONFIG"
+
+
+@dataclass(frozen=True, slots=True)
 class DeviceConfig:
+    """Thresholds and firmware location of one device model."""
+
     pressure_tolerance: float = 0.5  # cmH2O
     apnea_threshold: float = 10.0    # seconds
     max_firmware_size: int = 10_000_000  # 10MB
+    firmware_dir: Path = BASE_DIR / "firmware"
+    name: str = DEFAULT_PROFILE
+
+    def __post_init__(self):
+        if not self.pressure_tolerance > 0:
+            raise ValueError(f"{self.name}: pressure_tolerance must be positive")
+        if not self.apnea_threshold > 0:
+            raise ValueError(f"{self.name}: apnea_threshold must be positive")
+        if self.max_firmware_size <= 0:
+            raise ValueError(f"{self.name}: max_firmware_size must be positive")
+
+    @classmethod
+    def from_dict(cls, name: str, values: Dict, base_dir=BASE_DIR) -> "DeviceConfig":
+        """Build a validated profile from a JSON object.
+
+        Raises:
+            ValueError: On unknown fields or values of the wrong type.
+        """
+        known = {f.name for f in fields(cls)} - {"name"}
+        unknown = set(values) - known
+        if unknown:
+            raise ValueError(f"{name}: unknown profile fields {', '.join(sorted(unknown))}")
+        try:
+            converted = {
+                key: (
+                    Path(base_dir) / value if key == "firmware_dir"
+                    else int(value) if key == "max_firmware_size"
+                    else float(value)
+                )
+                for key, value in values.items()
+            }
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{name}: invalid profile value - {e}") from None
+        return cls(name=name, **converted)
+
+    def to_dict(self) -> Dict:
+        values = asdict(self)
+        values["firmware_dir"] = str(self.firmware_dir)
+        return values
+
+
+def load_profiles(path=PROFILES_FILE, base_dir=BASE_DIR) -> Dict[str, DeviceConfig]:
+    """Read and validate every profile in a profiles file.
 
+    A missing file yields only the built-in ``default`` profile.
+    """
+    try:
+        with open(path) as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return {DEFAULT_PROFILE: DeviceConfig()}
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: expected an object of named profiles")
+    return {name: DeviceConfig.from_dict(name, values, base_dir) for name, values in data.items()}
+
+
+def _source_key(path) -> Optional[list]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [str(path), stat.st_size, stat.st_mtime_ns]
+
+
+def load_profile(name: Optional[str] = None, path=PROFILES_FILE) -> DeviceConfig:
+    """Return one validated profile, reusing the exported one when current.
+
+    Args:
+        name: Profile name (default: ``CPAP_DEVICE_PROFILE`` or ``default``).
+        path: Profiles file.
+
+    Raises:
+        KeyError: If the file defines no such profile.
+    """
+    name = name or os.getenv("CPAP_DEVICE_PROFILE") or DEFAULT_PROFILE
+    source = _source_key(path)
+    try:
+        cached = json.loads(os.environ[PROFILE_CACHE_ENV])
+        if cached["name"] == name and cached["source"] == source:
+            return DeviceConfig(**{**cached["config"], "firmware_dir": Path(cached["config"]["firmware_dir"])})
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    profiles = load_profiles(path)
+    if name not in profiles:
+        raise KeyError(f"No device profile {name!r} in {path} (have {', '.join(sorted(profiles))})")
+    return profiles[name]
+
+
+def export_profile(config: DeviceConfig, env=os.environ, path=PROFILES_FILE) -> None:
+    """Publish a resolved profile to subprocesses started with ``env``."""
+    env[PROFILE_CACHE_ENV] = json.dumps({
+        "name": config.name, "source": _source_key(path), "config": config.to_dict(),
+    }, separators=(",", ":"))
+
+
+# Profile of this process, shared by every script and keyword library
+device_config = load_profile()
+export_profile(device_config)
 
 # Path configuration
-BASE_DIR = Path("/home/pi/cpap-firmware-simulator")
-FIRMWARE_DIR = BASE_DIR / "firmware"
+FIRMWARE_DIR = device_config.firmware_dir
 TEST_DATA_DIR = BASE_DIR / "test_data"
 
 DEVICE_FIRMWARE_PATH = FIRMWARE_DIR / "installed_firmware.bin"
 NEW_FIRMWARE_PATH = FIRMWARE_DIR / "new_firmware.bin"
 BACKUP_FIRMWARE_PATH = FIRMWARE_DIR / "firmware_backup.bin"
+FIRMWARE_STORE_DIR = FIRMWARE_DIR / "store"
+
 
-# Test configuration instance
-device_config = DeviceConfig()
+def firmware_paths(firmware_dir):
+    """Return the (installed, new, backup) image paths inside a firmware directory."""
+    firmware_dir = Path(firmware_dir)
+    return (
+        firmware_dir / DEVICE_FIRMWARE_PATH.name,
+        firmware_dir / NEW_FIRMWARE_PATH.name,
+        firmware_dir / BACKUP_FIRMWARE_PATH.name,
+    )
@@ -2,24 +2,43 @@
 
 This module provides Robot Framework keywords for simulating
 hardware fault conditions, following IEC 62304 and PEP 8 standards.
+Faults are played on a simulated device by the timeline engine in
+``fault_timeline``, so their durations and effects are actually applied.
 """
 
+import numpy as np
 from robot.api.deco import keyword
-from influx_logger import AuditLogger
+from fault_timeline import Fault, FaultEngine
+from influx_logger import SuiteFlushListener, logger as _logger
+from instrumentation import instrumented
 
-# Shared logger instance
-_logger = AuditLogger()
+
+def _log_fault(fault: Fault) -> None:
+    _logger.log_event(
+        "fault_injection",
+        {
+            "type": fault.kind,
+            "start": fault.start,
+            "duration": fault.duration,
+            "severity": "critical"
+        }
+    )
 
 
 @keyword("Simulate Pressure Sensor Fault")
+@instrumented("fault.pressure_sensor", "fault_injection")
 def simulate_pressure_sensor_fault(duration):
     """Simulate pressure sensor failure to test alarm behavior.
 
+    The sensor of a simulated device drops out for ``duration`` seconds,
+    replayed in virtual time.
+
     Args:
         duration: Duration of fault in seconds (int or string convertible to int).
 
     Returns:
-        bool: True if fault injected successfully, False if input is invalid.
+        bool: True if the dropout was applied for the whole duration,
+        False if input is invalid.
 
     Note:
         Logs fault to InfluxDB.
@@ -27,43 +46,100 @@ def simulate_pressure_sensor_fault(duration):
     """
     try:
         fault_duration = int(duration)
-        _logger.log_event(
-            "fault_injection",
-            {
-                "type": "pressure_sensor",
-                "duration": fault_duration,
-                "severity": "critical"
-            }
-        )
-        print(f"Simulating pressure sensor fault for {fault_duration} seconds")
-        return True
-
+        fault = Fault("dropout", start=1.0, duration=fault_duration)
     except (ValueError, TypeError):
         print("Invalid duration input for pressure sensor fault.")
         return False
 
+    engine = FaultEngine([fault])
+    summary = engine.run()
+    _log_fault(fault)
+    expected = round(fault_duration * engine.sample_rate)
+    print(f"Simulated pressure sensor fault for {fault_duration} seconds: "
+          f"{summary['missing_samples']} samples lost")
+    return summary["missing_samples"] == expected
+
 
 @keyword("Simulate Power Interruption")
-def simulate_power_interruption():
+@instrumented("fault.power_interruption", "fault_injection")
+def simulate_power_interruption(firmware_dir=None, offset=None):
     """Simulate a sudden power loss during operation.
 
+    Args:
+        firmware_dir: Optional firmware sandbox; power is then lost while
+            its new image is being installed.
+        offset: Bytes of the image written before the power loss
+            (default: half the image).
+
     Returns:
-        bool: Always True, assumes simulation is successfully initiated.
+        bool: Without a firmware directory, always True. With one, True
+        if the installed image survived the interrupted update unchanged
+        and valid.
 
     Note:
         Logs fault to InfluxDB.
         Complies with IEC 62304 Clause 5.7.
     """
-    _logger.log_event(
-        "fault_injection",
-        {
-            "type": "power_interruption",
-            "severity": "critical"
-        }
+    if firmware_dir is None:
+        _logger.log_event(
+            "fault_injection",
+            {
+                "type": "power_interruption",
+                "severity": "critical"
+            }
+        )
+        print("Simulating power interruption")
+        return True
+
+    fault = Fault("power_loss", start=0.0, duration=1.0,
+                  offset=None if offset is None else int(offset))
+    summary = FaultEngine([fault], firmware_dir=firmware_dir).run()
+    _log_fault(fault)
+    event = summary["power_events"][0]
+    print(f"Power lost after {event['offset']} bytes of the update")
+    return event["installed_unchanged"] and event["valid_after_restore"]
+
+
+@keyword("Run Fault Timeline")
+@instrumented("fault.timeline", "fault_injection")
+def run_fault_timeline(timeline, speed=0, duration=None, sample_rate=50, target=12.0,
+                       firmware_dir=None, seed=0, output=None):
+    """Play a fault timeline on a simulated device.
+
+    Args:
+        timeline: JSON file, JSON text or list of fault dicts (see
+            ``fault_timeline``).
+        speed: Scenario seconds per wall second; 0 replays in virtual time.
+        duration: Scenario length in seconds (default: last fault end + 1 s).
+        sample_rate: Pressure samples per second.
+        target: Pressure setpoint in cmH2O.
+        firmware_dir: Firmware sandbox for ``power_loss`` faults.
+        seed: Seed for noise faults.
+        output: Optional CSV for the sampled ``timestamp,measured,target``
+            trace, e.g. for ``Validate Pressure Trace``.
+
+    Returns:
+        dict: Samples, missing and affected sample counts, power loss
+        outcomes, scheduler jitter and wall versus scenario time.
+    """
+    engine = FaultEngine(
+        timeline, float(speed), float(sample_rate), float(target),
+        firmware_dir, int(seed),
     )
-    print("Simulating power interruption")
-    return True
+    summary = engine.run(None if duration is None else float(duration))
+    # Audit after the run, so logging never delays a timed event
+    for fault in engine.started:
+        _log_fault(fault)
+    if output:
+        np.savetxt(output, engine.trace(), delimiter=",",
+                   header="timestamp,measured,target", comments="")
+    print(f"Fault timeline: {summary['scenario_seconds']}s scenario in "
+          f"{summary['wall_seconds'] * 1000:.1f} ms, {summary['missing_samples']} samples lost, "
+          f"max jitter {summary['max_jitter_ms']:.3f} ms")
+    return summary
 
 
 # Required for Robot Framework to detect keywords
+ROBOT_AUTO_KEYWORDS = False
 ROBOT_LIBRARY_SCOPE = "GLOBAL"
+ROBOT_LIBRARY_LISTENER = SuiteFlushListener()
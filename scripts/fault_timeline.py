@@ -0,0 +1,296 @@
+"""Timeline-driven fault injection on a simulated CPAP device.
+
+A timeline is a list of faults at scenario times (seconds)::
+
+    [{"kind": "dropout", "start": 10, "duration": 5},
+     {"kind": "stuck", "start": 30, "duration": 20},
+     {"kind": "noise", "start": 60, "duration": 2, "amplitude": 1.5},
+     {"kind": "power_loss", "start": 120, "duration": 3, "offset": 65536}]
+
+* ``dropout`` -- the pressure sensor returns no reading (NaN),
+* ``stuck`` -- it repeats the last reading taken before the fault,
+* ``noise`` -- Gaussian noise of ``amplitude`` cmH2O is added, and
+* ``power_loss`` -- the device is off for ``duration``; if a firmware
+  directory is given, an update running at ``start`` loses power after
+  ``offset`` bytes of the image are written, and the installed image is
+  checked when power returns.
+
+``FaultEngine`` turns fault boundaries and sensor samples into events on a
+``MonotonicScheduler``. At ``speed=1`` events fire at their real times,
+within sub-millisecond jitter (sleep until just before, then spin on the
+monotonic clock); ``speed=60`` replays a minute per second, and
+``speed=0`` runs in virtual time, as fast as the events execute, so a
+five-minute scenario takes milliseconds in CI.
+"""
+
+import contextlib
+import gc
+import heapq
+import io
+import json
+import math
+import random
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+FAULT_KINDS = ("dropout", "stuck", "noise", "power_loss")
+
+# Sleep until this close to an event, then spin on the clock
+_SPIN_NS = 1_000_000
+# GIL switch interval while timed, so other threads (audit logging) cannot
+# hold the interpreter past an event for the default 5 ms
+_SWITCH_INTERVAL = 0.0001
+
+
+@dataclass
+class Fault:
+    """One fault on the timeline."""
+
+    kind: str
+    start: float
+    duration: float = 0.0
+    amplitude: float = 0.0
+    offset: Optional[int] = None
+
+    def __post_init__(self):
+        if self.kind not in FAULT_KINDS:
+            raise ValueError(f"Unknown fault kind {self.kind!r} (expected one of {', '.join(FAULT_KINDS)})")
+        self.start = float(self.start)
+        self.duration = float(self.duration)
+        self.amplitude = float(self.amplitude)
+        if self.start < 0 or self.duration < 0:
+            raise ValueError(f"{self.kind}: start and duration must not be negative")
+
+    @property
+    def end(self) -> float:
+        return self.start + self.duration
+
+
+def load_timeline(source) -> List[Fault]:
+    """Build a sorted timeline from a JSON file, JSON text or a list of dicts."""
+    if isinstance(source, (str, Path)):
+        text = str(source)
+        if not text.lstrip().startswith("["):
+            text = Path(source).read_text()
+        source = json.loads(text)
+    faults = [fault if isinstance(fault, Fault) else Fault(**fault) for fault in source]
+    return sorted(faults, key=lambda fault: fault.start)
+
+
+class MonotonicScheduler:
+    """Runs callbacks at scenario times on the monotonic clock."""
+
+    def __init__(self, speed: float = 1.0):
+        """Create a scheduler.
+
+        Args:
+            speed: Scenario seconds per wall second; 0 runs in virtual time.
+        """
+        self.speed = float(speed)
+        self.jitter_ns: List[int] = []
+
+    @property
+    def virtual(self) -> bool:
+        return self.speed <= 0 or math.isinf(self.speed)
+
+    def run(self, events: Iterable[tuple]) -> None:
+        """Run ``(time, priority, callback)`` events in time order.
+
+        Callbacks receive their scenario time; at equal times lower
+        priorities run first.
+        """
+        heap = [(t, priority, index, callback)
+                for index, (t, priority, callback) in enumerate(events)]
+        heapq.heapify(heap)
+        if self.virtual:
+            self._dispatch(heap)
+            return
+        interval = sys.getswitchinterval()
+        collecting = gc.isenabled()
+        sys.setswitchinterval(_SWITCH_INTERVAL)
+        gc.disable()
+        try:
+            self._dispatch(heap)
+        finally:
+            sys.setswitchinterval(interval)
+            if collecting:
+                gc.enable()
+
+    def _dispatch(self, heap: list) -> None:
+        start = time.perf_counter_ns()
+        while heap:
+            due, _, _, callback = heapq.heappop(heap)
+            if not self.virtual:
+                due_ns = start + int(due * 1e9 / self.speed)
+                while True:
+                    remaining = due_ns - time.perf_counter_ns()
+                    if remaining <= 0:
+                        break
+                    if remaining > _SPIN_NS:
+                        time.sleep((remaining - _SPIN_NS) / 1e9)
+                self.jitter_ns.append(time.perf_counter_ns() - due_ns)
+            callback(due)
+
+
+class SimulatedPressureSensor:
+    """Pressure sensor whose readings the active faults perturb."""
+
+    def __init__(self, target: float = 12.0, ripple: float = 0.1,
+                 breath_period: float = 4.0, seed: int = 0):
+        self.target = target
+        self.ripple = ripple
+        self.breath_period = breath_period
+        self.active: Dict[int, Fault] = {}
+        self._rng = random.Random(seed)
+        self._last = target
+        self._stuck: Dict[int, float] = {}
+
+    def start_fault(self, key: int, fault: Fault) -> None:
+        self.active[key] = fault
+        if fault.kind == "stuck":
+            self._stuck[key] = self._last
+
+    def end_fault(self, key: int) -> None:
+        self.active.pop(key, None)
+        self._stuck.pop(key, None)
+
+    def read(self, t: float) -> float:
+        value = self.target + self.ripple * math.sin(2 * math.pi * t / self.breath_period)
+        for key, fault in self.active.items():
+            if fault.kind in ("dropout", "power_loss"):
+                return math.nan
+            if fault.kind == "stuck":
+                value = self._stuck[key]
+            elif fault.kind == "noise":
+                value += self._rng.gauss(0.0, fault.amplitude)
+        self._last = value
+        return value
+
+
+class FaultEngine:
+    """Plays a fault timeline against a simulated sensor and firmware store."""
+
+    def __init__(self, timeline, speed: float = 0.0, sample_rate: float = 50.0,
+                 target: float = 12.0, firmware_dir=None, seed: int = 0):
+        """Create an engine.
+
+        Args:
+            timeline: Faults, or anything ``load_timeline`` accepts.
+            speed: Replay speed (see ``MonotonicScheduler``).
+            sample_rate: Sensor samples per scenario second.
+            target: Pressure setpoint in cmH2O.
+            firmware_dir: Firmware sandbox for ``power_loss`` faults.
+            seed: Seed for noise faults.
+        """
+        self.faults = load_timeline(timeline)
+        self.scheduler = MonotonicScheduler(speed)
+        self.sample_rate = float(sample_rate)
+        self.sensor = SimulatedPressureSensor(target, seed=seed)
+        self.firmware_dir = firmware_dir
+        # Faults applied so far, for reporting once the timed run is over
+        self.started: List[Fault] = []
+        self.timestamps: List[float] = []
+        self.readings: List[float] = []
+        self.affected_samples = {kind: 0 for kind in FAULT_KINDS}
+        self.power_events: List[Dict] = []
+        # Power loss outcomes by fault key; power losses may overlap
+        self._power_by_key: Dict[int, Dict] = {}
+
+    def run(self, duration: Optional[float] = None) -> Dict:
+        """Run the scenario for ``duration`` seconds (default: until the last fault ends + 1 s).
+
+        Returns:
+            Dict: Sample counts per effect, power loss outcomes, scheduler
+            jitter and wall versus scenario time.
+        """
+        if duration is None:
+            duration = max((fault.end for fault in self.faults), default=0.0) + 1.0
+        events = []
+        for key, fault in enumerate(self.faults):
+            if fault.start > duration:
+                continue
+            events.append((fault.start, 0, lambda t, k=key, f=fault: self._start(k, f)))
+            events.append((fault.end, 0, lambda t, k=key, f=fault: self._end(k, f)))
+        samples = int(duration * self.sample_rate) + 1
+        for index in range(samples):
+            events.append((index / self.sample_rate, 1, self._sample))
+
+        wall = time.perf_counter()
+        self.scheduler.run(events)
+        wall = time.perf_counter() - wall
+        return self.summary(duration, wall)
+
+    def _start(self, key: int, fault: Fault) -> None:
+        self.sensor.start_fault(key, fault)
+        self.started.append(fault)
+        if fault.kind == "power_loss":
+            event = self._interrupt_update(fault)
+            self._power_by_key[key] = event
+            self.power_events.append(event)
+
+    def _end(self, key: int, fault: Fault) -> None:
+        self.sensor.end_fault(key)
+        if fault.kind == "power_loss" and self.firmware_dir is not None:
+            from validate_firmware import is_valid_firmware
+            from config import firmware_paths
+
+            installed, _, _ = firmware_paths(self.firmware_dir)
+            self._power_by_key[key]["valid_after_restore"] = is_valid_firmware(path=installed)
+
+    def _sample(self, t: float) -> None:
+        self.timestamps.append(t)
+        self.readings.append(self.sensor.read(t))
+        for kind in {fault.kind for fault in self.sensor.active.values()}:
+            self.affected_samples[kind] += 1
+
+    def _interrupt_update(self, fault: Fault) -> Dict:
+        event = {"start": fault.start, "offset": fault.offset}
+        if self.firmware_dir is None:
+            return event
+        from atomic_io import PowerLoss, power_loss_at
+        from checksum_validator import sha256
+        from config import firmware_paths
+        from firmware_updater import update_firmware
+
+        installed, new, backup = firmware_paths(self.firmware_dir)
+        before = sha256(installed, use_cache=False)
+        offset = fault.offset if fault.offset is not None else new.stat().st_size // 2
+        try:
+            with power_loss_at(offset), contextlib.redirect_stdout(io.StringIO()):
+                update_firmware(new_path=new, device_path=installed, backup_path=backup)
+            event["interrupted"] = False
+        except PowerLoss:
+            event["interrupted"] = True
+        event["offset"] = offset
+        event["installed_unchanged"] = sha256(installed, use_cache=False) == before
+        return event
+
+    def trace(self) -> np.ndarray:
+        """Return the sampled ``timestamp, measured, target`` rows."""
+        return np.column_stack((
+            np.asarray(self.timestamps),
+            np.asarray(self.readings),
+            np.full(len(self.readings), self.sensor.target),
+        ))
+
+    def summary(self, duration: float, wall: float) -> Dict:
+        readings = np.asarray(self.readings)
+        jitter = np.asarray(self.scheduler.jitter_ns, dtype=np.float64) / 1e6
+        return {
+            "faults": [asdict(fault) for fault in self.faults],
+            "samples": int(readings.size),
+            "missing_samples": int(np.isnan(readings).sum()),
+            "affected_samples": dict(self.affected_samples),
+            "power_events": self.power_events,
+            "scenario_seconds": duration,
+            "wall_seconds": wall,
+            "speedup": duration / wall if wall > 0 else math.inf,
+            "max_jitter_ms": float(jitter.max()) if jitter.size else 0.0,
+            "p50_jitter_ms": float(np.median(jitter)) if jitter.size else 0.0,
+            "p99_jitter_ms": float(np.percentile(jitter, 99)) if jitter.size else 0.0,
+        }
@@ -0,0 +1,194 @@
+"""In-process Robot Framework keywords for firmware update testing.
+
+Exposes the update, rollback, failure simulation, validation and checksum
+functions directly, so a suite runs in a single interpreter and asserts
+their real return values and exceptions instead of spawning one
+``python3 scripts/...py`` process per step.
+
+Every keyword takes the firmware directory it operates on; it holds
+``installed_firmware.bin``, ``new_firmware.bin`` and ``firmware_backup.bin``
+as laid out in ``config``.
+"""
+
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+
+from robot.api.deco import keyword
+from atomic_io import atomic_copy
+from config import FIRMWARE_DIR, device_config, firmware_paths, load_profile
+from checksum_validator import sha256
+from result_cache import default_cache
+from firmware_updater import update_firmware
+from influx_logger import SuiteFlushListener
+from rollback import rollback
+from simulate_failure import simulate_partial_copy
+from validate_firmware import (
+    build_firmware_image, is_valid_firmware, validate_image, validate_image_cached,
+)
+
+
+@keyword("Create Firmware Sandbox")
+def create_firmware_sandbox(firmware_dir, image_size=200_000):
+    """Create a firmware directory with synthetic structured images.
+
+    The installed image and its backup hold the "old" firmware (1.0.0);
+    the new image (1.1.0) differs from it.
+
+    Args:
+        firmware_dir: Directory to (re)create.
+        image_size: Size of each image in bytes.
+
+    Returns:
+        str: The firmware directory.
+    """
+    firmware_dir = Path(firmware_dir)
+    shutil.rmtree(firmware_dir, ignore_errors=True)
+    firmware_dir.mkdir(parents=True)
+    installed, new, backup = firmware_paths(firmware_dir)
+    size = int(image_size)
+    new.write_bytes(synthetic_image(size, "1.1.0"))
+    installed.write_bytes(synthetic_image(size, "1.0.0"))
+    shutil.copyfile(installed, backup)
+    return str(firmware_dir)
+
+
+def synthetic_image(size, version):
+    boot, calibration = 4096, 256
+    application = max(size - boot - calibration - 512, 0)
+    return build_firmware_image({
+        "bootloader": os.urandom(boot),
+        "application": os.urandom(application),
+        "calibration": os.urandom(calibration),
+    }, version)
+
+
+@keyword("Update Firmware")
+def update_firmware_keyword(firmware_dir=FIRMWARE_DIR, use_cache=True):
+    """Install the new image, backing up the current one.
+
+    Args:
+        firmware_dir: Firmware directory.
+        use_cache: Reuse and record the validation verdict in the result cache.
+
+    Raises:
+        RuntimeError: If the update or its validation fails.
+    """
+    installed, new, backup = firmware_paths(firmware_dir)
+    update_firmware(new_path=new, device_path=installed, backup_path=backup, use_cache=use_cache)
+
+
+@keyword("Rollback Firmware")
+def rollback_keyword(firmware_dir=FIRMWARE_DIR):
+    """Restore the backup image onto the device."""
+    installed, _, backup = firmware_paths(firmware_dir)
+    rollback(backup_path=backup, device_path=installed)
+
+
+@keyword("Simulate Partial Copy")
+def simulate_partial_copy_keyword(firmware_dir=FIRMWARE_DIR, written_bytes=1024 * 10):
+    """Interrupt an update after ``written_bytes`` to mimic a power failure."""
+    installed, new, _ = firmware_paths(firmware_dir)
+    simulate_partial_copy(new_path=new, device_path=installed, written_bytes=int(written_bytes))
+
+
+@keyword("Is Valid Firmware")
+def is_valid_firmware_keyword(firmware_dir=FIRMWARE_DIR, min_size=100_000, use_cache=True):
+    """Return True if the installed image passes validation.
+
+    The verdict is reused from, and recorded in, the result cache unless
+    ``use_cache`` is False.
+    """
+    installed, _, _ = firmware_paths(firmware_dir)
+    return is_valid_firmware(min_size=int(min_size), path=installed, use_cache=use_cache)
+
+
+@keyword("Validate Firmware Image")
+def validate_firmware_image(path, use_cache=False, profile=None):
+    """Validate an image's header and sections.
+
+    Args:
+        path: Image to validate.
+        use_cache: Reuse the verdict recorded for identical content.
+        profile: Device profile whose limits apply (default: the active one).
+
+    Returns:
+        dict: ``valid``, ``size``, ``version``, ``sections`` and ``errors``
+        (one entry per corrupt region with offset, length and reason), plus
+        ``cache_hit`` when the cache is used.
+    """
+    config = load_profile(profile) if profile else device_config
+    if not use_cache:
+        return asdict(validate_image(path, config=config))
+    report, hit = validate_image_cached(path, config=config)
+    return {**asdict(report), "cache_hit": hit}
+
+
+@keyword("Clear Firmware Result Cache")
+def clear_firmware_result_cache(image=None):
+    """Forget recorded verdicts, for every image or only for ``image``.
+
+    Returns:
+        int: Number of verdicts removed.
+    """
+    return default_cache().invalidate(sha256(image) if image else None)
+
+
+@keyword("Firmware Checksum")
+def firmware_checksum(path):
+    """Return the SHA-256 hex digest of an image."""
+    return sha256(path)
+
+
+@keyword("Copy Firmware Image")
+def copy_firmware_image(source, target, expected_sha256=None):
+    """Copy an image over ``target`` atomically, verifying ``expected_sha256``.
+
+    Returns:
+        str: SHA-256 of the copied data, or None when it was not hashed.
+
+    Raises:
+        ValueError: If the data does not match ``expected_sha256``.
+    """
+    return atomic_copy(source, target, expected_sha256=expected_sha256)
+
+
+@keyword("Install Image From Concurrent Threads")
+def install_image_from_concurrent_threads(firmware_dir=FIRMWARE_DIR, threads=8):
+    """Copy the new image onto the device path from several threads at once.
+
+    Returns:
+        list: One message per copy that failed; empty if all succeeded.
+    """
+    installed, new, _ = firmware_paths(firmware_dir)
+    expected = sha256(new)
+
+    def install(_):
+        try:
+            atomic_copy(new, installed, expected_sha256=expected)
+        except Exception as e:
+            return f"{type(e).__name__}: {str(e)}"
+
+    with ThreadPoolExecutor(max_workers=int(threads)) as pool:
+        return [error for error in pool.map(install, range(int(threads))) if error]
+
+
+@keyword("Installed Firmware Should Match")
+def installed_firmware_should_match(firmware_dir=FIRMWARE_DIR, image="new"):
+    """Fail unless the installed image equals the ``new`` or ``backup`` image.
+
+    Raises:
+        AssertionError: If the checksums differ.
+    """
+    installed, new, backup = firmware_paths(firmware_dir)
+    expected = {"new": new, "backup": backup}[image]
+    if sha256(installed) != sha256(expected):
+        raise AssertionError(f"Installed firmware does not match {image} image")
+
+
+# Only @keyword functions are keywords; the imported helpers are not
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
+ROBOT_LIBRARY_LISTENER = SuiteFlushListener()
@@ -0,0 +1,298 @@
+"""Content-addressed firmware image store with version history.
+
+Images are split into fixed-size chunks stored once by SHA-256, so nightly
+builds that differ by a few KB share almost all of their storage. The most
+recently used images are also kept whole, which lets "install version X"
+and "rollback N versions" copy an image onto the device without
+reassembling it (a reflink where the filesystem supports one). The device
+never shares an inode with the store, so writing to the installed image
+cannot corrupt a stored version.
+
+Layout under the store root::
+
+    chunks/<aa>/<chunk sha256>   deduplicated chunk blobs
+    images/<image sha256>        whole images for recent versions
+    index.json                   versions and install history
+    index.lock                   held while a process updates the store
+
+The install history is a lineage with a pointer to the installed entry:
+rolling back moves the pointer, so two consecutive "rollback 1" calls go
+from C to B to A, and installing after a rollback replaces the versions
+that were rolled back past. Chunks, like the index, are fsynced before
+they are renamed into place, so a crash never leaves a torn chunk that
+later adds would trust.
+
+Several processes may share a store (parallel shards): every change
+reloads the index and saves it while holding an exclusive ``flock`` on
+``index.lock``, so no process overwrites another's versions or history.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from robot.api.deco import keyword
+from config import FIRMWARE_STORE_DIR, DEVICE_FIRMWARE_PATH
+from atomic_io import atomic_copy, fsync_dir
+from influx_logger import logger
+
+
+class FirmwareStore:
+    """Deduplicated store of firmware versions."""
+
+    def __init__(self, root=FIRMWARE_STORE_DIR, chunk_size: int = 64 * 1024, keep_images: int = 3):
+        """Open (or create) a store.
+
+        Args:
+            root: Store directory.
+            chunk_size: Chunk size in bytes for deduplication.
+            keep_images: Number of most recently used versions kept as
+                whole images; older ones are rebuilt from chunks on demand.
+        """
+        self.root = Path(root)
+        self.chunk_size = chunk_size
+        self.keep_images = keep_images
+        self._chunks = self.root / "chunks"
+        self._images = self.root / "images"
+        self._index_path = self.root / "index.json"
+        self._chunks.mkdir(parents=True, exist_ok=True)
+        self._images.mkdir(parents=True, exist_ok=True)
+        self._index = self._load()
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self._index_path) as file:
+                index = json.load(file)
+        except FileNotFoundError:
+            index = {"versions": {}, "history": []}
+        # Stores written before the pointer existed had the last entry installed
+        index.setdefault("position", len(index["history"]) - 1)
+        return index
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the store lock across processes, with the index reloaded."""
+        fd = os.open(self.root / "index.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self._index = self._load()
+            yield
+        finally:
+            os.close(fd)
+
+    def add(self, path, version: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """Add an image as ``version``.
+
+        Only chunks not already in the store are written.
+
+        Returns:
+            str: SHA-256 of the image.
+        """
+        with self._locked():
+            return self._add(path, version, metadata)
+
+    def _add(self, path, version: str, metadata: Optional[Dict[str, Any]]) -> str:
+        if version in self._index["versions"]:
+            raise ValueError(f"Version {version} already stored")
+        image_sha = hashlib.sha256()
+        chunks: List[str] = []
+        new_bytes = 0
+        touched = set()
+        with open(path, "rb") as file:
+            while chunk := file.read(self.chunk_size):
+                image_sha.update(chunk)
+                digest = hashlib.sha256(chunk).hexdigest()
+                chunks.append(digest)
+                blob = self._chunk_path(digest)
+                if not blob.exists():
+                    if not blob.parent.exists():
+                        blob.parent.mkdir(exist_ok=True)
+                        touched.add(self._chunks)
+                    self._write_chunk(blob, chunk)
+                    touched.add(blob.parent)
+                    new_bytes += len(chunk)
+        # Renames are durable before the index refers to the chunks
+        for directory in touched:
+            fsync_dir(directory)
+
+        digest = image_sha.hexdigest()
+        image = self._images / digest
+        if not image.exists():
+            atomic_copy(path, image, expected_sha256=digest)
+        self._index["versions"][version] = {
+            "sha256": digest,
+            "size": os.path.getsize(path),
+            "chunks": chunks,
+            "added": time.time(),
+            "last_used": time.time(),
+            "metadata": metadata or {},
+        }
+        self._trim_images()
+        self._save()
+        print(f"Stored firmware {version} ({new_bytes} new bytes)")
+        return digest
+
+    def versions(self) -> List[Dict[str, Any]]:
+        """Return stored versions, oldest first."""
+        return [
+            {"version": name, **{k: v for k, v in info.items() if k != "chunks"}}
+            for name, info in sorted(
+                self._index["versions"].items(), key=lambda item: item[1]["added"]
+            )
+        ]
+
+    def history(self) -> List[str]:
+        """Return the install lineage, oldest first, up to the installed version."""
+        return self._index["history"][:self._index["position"] + 1]
+
+    def installed(self) -> Optional[str]:
+        """Return the installed version, or None before the first install."""
+        position = self._index["position"]
+        return self._index["history"][position] if position >= 0 else None
+
+    def image_path(self, version: str) -> Path:
+        """Return the whole image of ``version``, rebuilding it from chunks if needed."""
+        info = self._version(version)
+        image = self._images / info["sha256"]
+        if not image.exists():
+            self._rebuild(info, image)
+        info["last_used"] = time.time()
+        return image
+
+    def install(self, version: str, device_path=DEVICE_FIRMWARE_PATH) -> None:
+        """Install ``version`` onto the device (copy + rename)."""
+        with self._locked():
+            atomic_copy(self.image_path(version), device_path)
+            # Versions rolled back past are no longer part of the lineage
+            self._index["history"] = self.history() + [version]
+            self._index["position"] = len(self._index["history"]) - 1
+            self._trim_images()
+            self._save()
+        logger.log_event("firmware_update", {"status": "success", "version": version})
+        print(f"Installed firmware {version}")
+
+    def rollback(self, steps: int = 1, device_path=DEVICE_FIRMWARE_PATH) -> str:
+        """Reinstall the version ``steps`` entries before the installed one.
+
+        Returns:
+            str: The version now installed.
+        """
+        with self._locked():
+            position = self._index["position"]
+            if steps < 1 or steps > position:
+                raise ValueError(f"Cannot roll back {steps} versions; {position} earlier in history")
+            version = self._index["history"][position - steps]
+            atomic_copy(self.image_path(version), device_path)
+            self._index["position"] = position - steps
+            self._save()
+        logger.log_event("firmware_rollback", {"status": "rolled_back", "version": version})
+        print(f"Rolled back to firmware {version}")
+        return version
+
+    def remove(self, version: str) -> None:
+        """Forget a version and delete chunks no other version uses."""
+        with self._locked():
+            info = self._index["versions"].pop(version)
+            history = self._index["history"]
+            self._index["position"] -= history[:self._index["position"] + 1].count(version)
+            self._index["history"] = [v for v in history if v != version]
+            used = {c for other in self._index["versions"].values() for c in other["chunks"]}
+            for digest in set(info["chunks"]) - used:
+                self._chunk_path(digest).unlink(missing_ok=True)
+            if not any(v["sha256"] == info["sha256"] for v in self._index["versions"].values()):
+                (self._images / info["sha256"]).unlink(missing_ok=True)
+            self._save()
+
+    def disk_usage(self) -> Dict[str, int]:
+        """Return logical image bytes versus bytes actually stored."""
+        stored = sum(p.stat().st_size for p in self._chunks.rglob("*") if p.is_file())
+        images = sum(p.stat().st_size for p in self._images.iterdir())
+        return {
+            "logical_bytes": sum(v["size"] for v in self._index["versions"].values()),
+            "chunk_bytes": stored,
+            "image_bytes": images,
+        }
+
+    def _version(self, version: str) -> Dict[str, Any]:
+        try:
+            return self._index["versions"][version]
+        except KeyError:
+            raise ValueError(f"Unknown firmware version: {version}") from None
+
+    def _chunk_path(self, digest: str) -> Path:
+        return self._chunks / digest[:2] / digest
+
+    def _write_chunk(self, blob: Path, chunk: bytes) -> None:
+        tmp = blob.with_name(f"{blob.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+        try:
+            with open(tmp, "wb") as file:
+                file.write(chunk)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp, blob)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def _rebuild(self, info: Dict[str, Any], image: Path) -> None:
+        tmp = image.with_name(f".{image.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+        sha = hashlib.sha256()
+        with open(tmp, "wb") as file:
+            for digest in info["chunks"]:
+                chunk = self._chunk_path(digest).read_bytes()
+                sha.update(chunk)
+                file.write(chunk)
+            file.flush()
+            os.fsync(file.fileno())
+        if sha.hexdigest() != info["sha256"]:
+            tmp.unlink()
+            raise ValueError(f"Stored chunks for {info['sha256']} are corrupt")
+        os.replace(tmp, image)
+
+    def _trim_images(self) -> None:
+        """Drop whole images of all but the most recently used versions."""
+        recent = sorted(
+            self._index["versions"].values(), key=lambda v: v["last_used"], reverse=True
+        )
+        keep = {v["sha256"] for v in recent[:self.keep_images]}
+        for image in self._images.iterdir():
+            # Dot names are images still being written
+            if image.name not in keep and not image.name.startswith("."):
+                image.unlink()
+
+    def _save(self) -> None:
+        tmp = self._index_path.with_name(f".index.json.tmp-{os.getpid()}-{threading.get_ident()}")
+        with open(tmp, "w") as file:
+            json.dump(self._index, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self._index_path)
+        fsync_dir(self.root)
+
+
+@keyword("Store Firmware Version")
+def store_firmware_version(image, version, store_dir=FIRMWARE_STORE_DIR):
+    """Add an image to the firmware store and return its SHA-256."""
+    return FirmwareStore(store_dir).add(image, version)
+
+
+@keyword("Install Firmware Version")
+def install_firmware_version(version, device_path=DEVICE_FIRMWARE_PATH, store_dir=FIRMWARE_STORE_DIR):
+    """Install a stored version onto the device."""
+    FirmwareStore(store_dir).install(version, device_path)
+
+
+@keyword("Rollback Firmware Versions")
+def rollback_firmware_versions(steps=1, device_path=DEVICE_FIRMWARE_PATH, store_dir=FIRMWARE_STORE_DIR):
+    """Roll back ``steps`` installs and return the version now installed."""
+    return FirmwareStore(store_dir).rollback(int(steps), device_path)
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
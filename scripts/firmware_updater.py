@@ -2,36 +2,56 @@
 
 This module handles the firmware update process for CPAP devices, including
 safety checks and logging for regulatory compliance.
+
+The installed image is never written in place: the new image is copied
+to a temporary file beside the device path, hashed as it is written, and
+that staged copy is validated before the current image is kept as a
+hard-linked backup and the copy is atomically renamed over the device
+path. The source image is read once; the digest from the copy keys the
+validation cache. The kernel copy fast path of ``atomic_io`` is not used
+here, since it yields no digest.
 """
 
-import shutil
-from typing import NoReturn
-from config import NEW_FIRMWARE_PATH, DEVICE_FIRMWARE_PATH
-from influx_logger import log_event
-from validation import validate_firmware_integrity
+from config import NEW_FIRMWARE_PATH, DEVICE_FIRMWARE_PATH, BACKUP_FIRMWARE_PATH, device_config
+from influx_logger import logger
+from atomic_io import atomic_link, staged_copy
+from validate_firmware import is_valid_firmware
+
 
-def update_firmware() -> None:
+def update_firmware(
+    new_path=NEW_FIRMWARE_PATH,
+    device_path=DEVICE_FIRMWARE_PATH,
+    backup_path=BACKUP_FIRMWARE_PATH,
+    config=device_config,
+    use_cache: bool = False,
+) -> None:
     """Perform a firmware update with validation and logging.
-    
+
+    Args:
+        new_path: Image to install.
+        device_path: Installed image on the device.
+        backup_path: Where the current image is backed up before updating.
+        config: Profile of the device being updated (default: the active one).
+        use_cache: Reuse and record the validation verdict in the result cache.
+
     Raises:
         RuntimeError: If the update fails or validation checks don't pass
     """
     try:
-        # Create backup before updating
-        shutil.copyfile(DEVICE_FIRMWARE_PATH, BACKUP_FIRMWARE_PATH)
-        
-        # Perform the update
-        shutil.copyfile(NEW_FIRMWARE_PATH, DEVICE_FIRMWARE_PATH)
-        
-        # Validate the update
-        if not validate_firmware_integrity(DEVICE_FIRMWARE_PATH):
-            raise RuntimeError("Firmware validation failed after update")
-            
-        log_event("firmware_update", {"status": "success"})
+        # Stage and hash the copy in one pass, then validate what will be installed
+        with staged_copy(new_path, device_path) as (staged, digest):
+            if not is_valid_firmware(path=staged, use_cache=use_cache, config=config,
+                                     digest=digest):
+                raise RuntimeError("New firmware image failed validation")
+
+            # Keep the current image as backup (hard link, no copy)
+            atomic_link(device_path, backup_path)
+
+        logger.log_event("firmware_update", {"status": "success", "sha256": digest})
         print("Firmware update completed successfully.")
     except Exception as e:
-        log_event("firmware_update", {"status": "failed", "error": str(e)})
+        logger.log_event("firmware_update", {"status": "failed", "error": str(e)})
         raise RuntimeError(f"Firmware update failed: {str(e)}") from e
 
 if __name__ == "__main__":
-    update_firmware()
\ No newline at end of file
+    update_firmware()
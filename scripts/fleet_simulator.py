@@ -0,0 +1,236 @@
+"""Fleet-scale firmware update campaign simulator.
+
+Spins up N virtual devices, each with its own firmware directory and
+DeviceConfig, and runs update / power-failure / rollback rounds on all of
+them concurrently. Power failures are injected at a configurable rate
+into the real update path, cutting the image copy at a random byte, and
+the device recovers by rolling back. The report gives per-operation
+latency percentiles for each device and for the whole fleet, and
+aggregate updates per second, for sizing a staging rig.
+
+Usage:
+    python3 scripts/fleet_simulator.py --devices 200 --rounds 5 --fault-rate 0.1
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from robot.api.deco import keyword
+from atomic_io import PowerLoss, power_loss_at
+from config import DeviceConfig, device_config, firmware_paths, load_profile
+import firmware_keywords
+from firmware_updater import update_firmware
+from rollback import rollback
+from validate_firmware import is_valid_firmware
+
+
+@dataclass
+class VirtualDevice:
+    """One simulated CPAP unit."""
+
+    device_id: str
+    firmware_dir: str
+    config: DeviceConfig = device_config
+
+
+@dataclass
+class DeviceResult:
+    """Outcome of a campaign on one device."""
+
+    device_id: str
+    updates: int = 0
+    faults: int = 0
+    rollbacks: int = 0
+    errors: List[str] = field(default_factory=list)
+    update_latencies: List[float] = field(default_factory=list)
+    rollback_latencies: List[float] = field(default_factory=list)
+
+
+def _run_device(device: VirtualDevice, rounds: int, fault_rate: float,
+                image_size: int, seed: int, quiet: bool) -> DeviceResult:
+    """Run every round of a campaign on one device."""
+    rng = random.Random(seed)
+    result = DeviceResult(device.device_id)
+    installed, new, backup = firmware_paths(device.firmware_dir)
+    with _quiet(quiet):
+        firmware_keywords.create_firmware_sandbox(device.firmware_dir, image_size)
+        for _ in range(rounds):
+            try:
+                if rng.random() < fault_rate:
+                    # Power loss while the update copies the image, then recovery
+                    with contextlib.suppress(PowerLoss), power_loss_at(rng.randrange(1, image_size)):
+                        update_firmware(new_path=new, device_path=installed, backup_path=backup,
+                                        config=device.config)
+                    result.faults += 1
+                    if not is_valid_firmware(path=installed, config=device.config):
+                        result.errors.append("invalid image after power loss")
+                    start = time.perf_counter()
+                    rollback(backup_path=backup, device_path=installed)
+                    result.rollback_latencies.append(time.perf_counter() - start)
+                    result.rollbacks += 1
+                    if not is_valid_firmware(path=installed, config=device.config):
+                        result.errors.append("invalid image after rollback")
+                    continue
+
+                start = time.perf_counter()
+                update_firmware(new_path=new, device_path=installed, backup_path=backup,
+                                config=device.config)
+                result.update_latencies.append(time.perf_counter() - start)
+                result.updates += 1
+                if os.path.getsize(installed) > device.config.max_firmware_size:
+                    result.errors.append("installed image exceeds max_firmware_size")
+            except Exception as e:
+                result.errors.append(str(e))
+    return result
+
+
+def _quiet(enabled: bool):
+    return contextlib.redirect_stdout(io.StringIO()) if enabled else contextlib.nullcontext()
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1]}
+
+
+def run_campaign(
+    devices: int = 10,
+    rounds: int = 3,
+    fault_rate: float = 0.1,
+    workers: Optional[int] = None,
+    image_size: int = 200_000,
+    root: Optional[str] = None,
+    use_processes: bool = False,
+    seed: int = 0,
+    quiet: bool = True,
+    profiles: Optional[List[str]] = None,
+) -> Dict:
+    """Run an update campaign across a fleet of virtual devices.
+
+    Args:
+        devices: Number of virtual devices.
+        rounds: Update attempts per device.
+        fault_rate: Probability that an attempt suffers a power failure.
+        workers: Concurrent devices (default: CPU count).
+        image_size: Synthetic image size in bytes.
+        root: Parent directory for device firmware directories
+            (default: a temporary directory removed afterwards).
+        use_processes: Use a process pool instead of threads.
+        seed: Base seed for fault placement.
+        quiet: Suppress per-step output from the device operations.
+        profiles: Device profile names assigned to devices in turn, to run
+            several device models in one campaign (default: the active
+            profile).
+
+    Returns:
+        Dict: Totals, fleet-wide latency percentiles (seconds) and the
+        same per device, updates per second, and devices that reported
+        errors.
+    """
+    cleanup = root is None
+    root = Path(root or tempfile.mkdtemp(prefix="cpap_fleet_"))
+    configs = [load_profile(name) for name in profiles] if profiles else [device_config]
+    fleet = [
+        VirtualDevice(f"cpap-{index:05d}", str(root / f"cpap-{index:05d}"),
+                      configs[index % len(configs)])
+        for index in range(devices)
+    ]
+    pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    start = time.perf_counter()
+    # sys.stdout is process-wide: threads are silenced once around the pool,
+    # worker processes each silence themselves
+    try:
+        with _quiet(quiet and not use_processes), \
+                pool_class(max_workers=workers or os.cpu_count()) as pool:
+            futures = [
+                pool.submit(_run_device, device, rounds, fault_rate, image_size,
+                            seed + i, quiet and use_processes)
+                for i, device in enumerate(fleet)
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        if cleanup:
+            shutil.rmtree(root, ignore_errors=True)
+    elapsed = time.perf_counter() - start
+
+    updates = sum(r.updates for r in results)
+    return {
+        "devices": devices,
+        "profiles": {config.name: len(fleet[i::len(configs)]) for i, config in enumerate(configs)},
+        "updates": updates,
+        "faults": sum(r.faults for r in results),
+        "rollbacks": sum(r.rollbacks for r in results),
+        "seconds": elapsed,
+        "updates_per_second": updates / elapsed if elapsed > 0 else 0.0,
+        "update_latency": _percentiles([t for r in results for t in r.update_latencies]),
+        "rollback_latency": _percentiles([t for r in results for t in r.rollback_latencies]),
+        "device_latency": {
+            r.device_id: {
+                "update": _percentiles(r.update_latencies),
+                "rollback": _percentiles(r.rollback_latencies),
+            }
+            for r in results
+        },
+        "failed_devices": {r.device_id: r.errors for r in results if r.errors},
+    }
+
+
+@keyword("Run Fleet Campaign")
+def run_fleet_campaign(devices=10, rounds=3, fault_rate=0.1, workers=None, profiles=None,
+                       image_size=200_000):
+    """Run an update campaign on virtual devices and return the report.
+
+    ``profiles`` is a list or comma-separated string of device profiles.
+    """
+    if isinstance(profiles, str):
+        profiles = [name.strip() for name in profiles.split(",")]
+    report = run_campaign(
+        int(devices), int(rounds), float(fault_rate), int(workers) if workers else None,
+        int(image_size), profiles=profiles,
+    )
+    print(
+        f"{report['updates']} updates on {report['devices']} devices at "
+        f"{report['updates_per_second']:.1f}/s, p95 {report['update_latency']['p95'] * 1000:.2f} ms"
+    )
+    return report
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a fleet firmware update campaign")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--fault-rate", type=float, default=0.1)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--image-size", type=int, default=200_000)
+    parser.add_argument("--root", help="Keep device directories here")
+    parser.add_argument("--processes", action="store_true", help="Use worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profiles", help="Comma-separated device profiles to mix")
+    args = parser.parse_args()
+
+    print(json.dumps(run_campaign(
+        args.devices, args.rounds, args.fault_rate, args.workers,
+        args.image_size, args.root, args.processes, args.seed,
+        profiles=args.profiles.split(",") if args.profiles else None,
+    ), indent=2))
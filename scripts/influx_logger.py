@@ -1,44 +1,347 @@
-"""Enhanced logging for medical device compliance."""
+"""Enhanced logging for medical device compliance.
 
-from influxdb import InfluxDBClient
+Audit events are appended to a durable on-disk spool (``AUDIT_SPOOL_DIR``,
+default ``.audit_spool`` in the base directory) and replayed to InfluxDB
+in bulk by a background thread, so keyword libraries never wait on a
+network round trip per event and none are lost while the database is
+unreachable. Processes running in parallel share the spool safely. On
+agents without InfluxDB at all, a local store directory
+(``AUDIT_STORE_DIR``) replaces the database as the write target; events
+for it are buffered in a bounded queue and written in batches, as they
+are for InfluxDB if the spool directory cannot be created.
+
+Nothing is connected or opened at import: the client, spool or store (and
+their libraries) are created on the first event that needs them. Keyword
+libraries share the module-level ``logger``.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+import weakref
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+
+from robot.api.deco import keyword
+from audit_spool import AuditSpool, SpoolReplayer
+from config import BASE_DIR
+from instrumentation import instrumented
+from line_protocol import encode_point
+
+INFLUX_HOST = os.getenv('INFLUXDB_HOST', 'localhost')
+INFLUX_PORT = int(os.getenv('INFLUXDB_PORT', '8086'))
+AUDIT_DATABASE = 'firmware_audit'
+DEFAULT_SPOOL_DIR = BASE_DIR / '.audit_spool'
+
+# Sentinel telling the flush thread to exit
+_STOP = object()
+
+# Every live logger, so suite end and interpreter exit can flush them all
+_LOGGERS = weakref.WeakSet()
 
 
 class AuditLogger:
     """Handles audit logging for regulatory compliance."""
-    
-    def __init__(self):
-        self.client = InfluxDBClient(
-            host='localhost',
-            port=8086,
-            database='firmware_audit'
+
+    def __init__(
+        self,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10_000,
+        put_timeout: float = 0.1,
+        spool_dir: Optional[str] = None,
+        store_dir: Optional[str] = None,
+    ):
+        """Create a buffered audit logger.
+
+        Args:
+            batch_size: Points written per InfluxDB request.
+            flush_interval: Maximum seconds a point waits before being written.
+            max_queue_size: Bound on buffered points; producers block when full.
+            put_timeout: Seconds a producer blocks on a full queue before the
+                point is dropped and counted.
+            spool_dir: Directory of the durable spool. Defaults to the
+                ``AUDIT_SPOOL_DIR`` environment variable, then
+                ``DEFAULT_SPOOL_DIR``.
+            store_dir: Directory of a local time-series store to write to
+                instead of InfluxDB. Defaults to the ``AUDIT_STORE_DIR``
+                environment variable; takes precedence over the spool.
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.flushed_points = 0
+        self.dropped_points = 0
+        self.failed_points = 0
+
+        # Targets are resolved now but opened on first use
+        self._store_dir = store_dir or os.getenv('AUDIT_STORE_DIR')
+        self._spool_dir = None if self._store_dir else (
+            spool_dir or os.getenv('AUDIT_SPOOL_DIR') or DEFAULT_SPOOL_DIR
         )
-    
+        self._open_lock = threading.Lock()
+        self._client = None
+        self._spool = None
+        self._replayer = None
+        _LOGGERS.add(self)
+
+    @property
+    def client(self):
+        """Write target: an ``InfluxDBClient`` or a local ``TimeSeriesStore``.
+
+        Created on first access; both provide ``write_points``.
+        """
+        if self._client is None:
+            with self._open_lock:
+                if self._client is None:
+                    if self._store_dir:
+                        from timeseries_store import TimeSeriesStore
+                        self._client = TimeSeriesStore(self._store_dir)
+                    else:
+                        from influxdb import InfluxDBClient
+                        self._client = InfluxDBClient(
+                            host=INFLUX_HOST,
+                            port=INFLUX_PORT,
+                            database=AUDIT_DATABASE
+                        )
+        return self._client
+
+    def _open_spool(self):
+        if self._spool is None:
+            with self._open_lock:
+                if self._spool is None:
+                    try:
+                        spool = AuditSpool(self._spool_dir)
+                    except OSError as e:
+                        print(f"Warning: audit spool unavailable, writing directly - {str(e)}")
+                        self._spool_dir = None
+                        return None
+                    self._replayer = SpoolReplayer(
+                        spool,
+                        f"http://{INFLUX_HOST}:{INFLUX_PORT}/write"
+                        f"?db={AUDIT_DATABASE}&precision=ns",
+                        batch_size=self.batch_size * 10,
+                        interval=self.flush_interval,
+                    )
+                    self._spool = spool
+        return self._spool
+
+    @instrumented("audit.log_event", "influx")
     def log_event(self, event_type: str, metadata: Dict[str, Any]) -> None:
         """Log an auditable event with timestamp and metadata.
-        
+
+        The point is appended to the spool; with a store directory, or if
+        the spool cannot be opened, it is queued for the background flush
+        thread instead.
+
         Args:
             event_type: Type of event (e.g., firmware_update)
             metadata: Additional event details
         """
-        try:
-            log_entry = {
-                "measurement": "device_events",
-                "time": datetime.utcnow().isoformat(),
-                "tags": {
+        if self._spool_dir and self._open_spool() is not None:
+            self._spool.append(encode_point(
+                "device_events",
+                {
                     "device_type": "CPAP",
                     "firmware_version": metadata.get('version', 'unknown')
                 },
-                "fields": {
-                    "event_type": event_type,
-                    **metadata
-                }
+                {"event_type": event_type, **metadata},
+                time.time_ns(),
+            ))
+            self._replayer.start()
+            return
+
+        log_entry = {
+            "measurement": "device_events",
+            "time": datetime.utcnow().isoformat(),
+            "tags": {
+                "device_type": "CPAP",
+                "firmware_version": metadata.get('version', 'unknown')
+            },
+            "fields": {
+                "event_type": event_type,
+                **metadata
+            }
+        }
+        self._ensure_thread()
+        try:
+            self._queue.put(log_entry, timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self.dropped_points += 1
+            print("Warning: Audit queue full - event dropped")
+
+    def flush(self, timeout: float = 10.0, replay: bool = True) -> bool:
+        """Block until every point queued so far has been written.
+
+        Args:
+            timeout: Maximum seconds to wait.
+            replay: With the spool, also replay it to InfluxDB now. If
+                False, spooled points are only synced to disk and left to
+                the background replayer.
+
+        Returns:
+            bool: True if the queue drained within the timeout; with the
+            spool and ``replay`` False, True once the points are on disk.
+        """
+        if self._spool is not None:
+            if not replay:
+                self._spool.sync()
+                self._replayer.wake()
+                return True
+            self._replayer.drain(timeout)
+            return self._spool.pending_records() == 0
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Flush outstanding points and stop the background thread."""
+        if self._spool is not None:
+            with self._open_lock:
+                spool, replayer = self._spool, self._replayer
+                self._spool = self._replayer = None
+            if spool is not None:
+                replayer.stop(timeout)
+                spool.close()
+            return
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> Dict[str, int]:
+        """Return counters for the write pipeline.
+
+        Returns:
+            Dict: flushed, dropped, failed and currently queued (in memory)
+            point counts; with the spool, ``spooled`` counts records on disk
+            not yet replayed, from every process sharing it.
+        """
+        if self._spool is not None:
+            return {
+                "flushed": self._replayer.replayed_records,
+                "dropped": 0,
+                "failed": self._replayer.failed_requests,
+                "queued": 0,
+                "spooled": self._spool.pending_records(),
+            }
+        with self._lock:
+            return {
+                "flushed": self.flushed_points,
+                "dropped": self.dropped_points,
+                "failed": self.failed_points,
+                "queued": self._queue.qsize(),
             }
-            self.client.write_points([log_entry])
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="audit-flush", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        """Collect points into batches and write them by size or age."""
+        batch: List[Dict[str, Any]] = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, dict):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+
+            if batch:
+                self._write(batch)
+            batch = []
+            deadline = None
+
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch:
+            return
+        try:
+            self.client.write_points(batch)
+            with self._lock:
+                self.flushed_points += len(batch)
         except Exception as e:
+            with self._lock:
+                self.failed_points += len(batch)
             print(f"Warning: Audit logging failed - {str(e)}")
 
 
-# Create default logger instance
-logger = AuditLogger()
\ No newline at end of file
+def flush_all(timeout: float = 10.0, replay: bool = True) -> None:
+    """Flush every live AuditLogger (see ``AuditLogger.flush``)."""
+    for audit_logger in list(_LOGGERS):
+        audit_logger.flush(timeout, replay)
+
+
+@atexit.register
+def _close_all() -> None:
+    for audit_logger in list(_LOGGERS):
+        audit_logger.close()
+
+
+class SuiteFlushListener:
+    """Robot listener that flushes buffered audit events at suite end.
+
+    Spooled events are only synced to disk; replaying them is left to the
+    background replayer, so a suite never waits on InfluxDB.
+
+    Keyword libraries that log events attach it via ROBOT_LIBRARY_LISTENER.
+    """
+
+    ROBOT_LISTENER_API_VERSION = 3
+
+    def end_suite(self, data, result):
+        flush_all(replay=False)
+
+    def close(self):
+        flush_all(replay=False)
+
+
+@keyword("Flush Audit Log")
+def flush_audit_log():
+    """Write all buffered audit events and return pipeline counters.
+
+    Returns:
+        Dict: Counters of the default logger after the flush.
+    """
+    flush_all()
+    return logger.stats()
+
+
+# Shared default logger; cheap to create, connects on first write
+logger = AuditLogger()
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
+ROBOT_LIBRARY_LISTENER = SuiteFlushListener()
@@ -0,0 +1,162 @@
+"""Local stand-in for the InfluxDB 1.x HTTP write endpoint.
+
+Accepts line protocol on ``/write`` and records every line, so audit and
+result publishing can be exercised without a running InfluxDB. It also
+accepts Grafana annotations on ``/api/annotations``, and can answer slowly
+or fail its first requests to exercise retries and deadlines.
+"""
+
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from robot.api.deco import keyword
+
+
+class StubInfluxServer:
+    """Threaded HTTP server that records line protocol writes and annotations."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, status: int = 204,
+                 delay: float = 0.0, failures: int = 0):
+        """Create the server (not yet serving).
+
+        Args:
+            host: Interface to bind.
+            port: TCP port, 0 picks a free one.
+            status: HTTP status returned for every write.
+            delay: Seconds to wait before answering each request.
+            failures: Number of first requests answered with 503.
+        """
+        self.status = status
+        self.delay = delay
+        self.failures = failures
+        self.lines: List[str] = []
+        # Per accepted /write request: line count and whether it was gzipped
+        self.writes: List[Dict] = []
+        self.annotations: List[Dict] = []
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubInfluxServer":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="influx-stub", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                gzipped = self.headers.get("Content-Encoding") == "gzip"
+                if gzipped:
+                    body = gzip.decompress(body)
+                if stub.delay:
+                    time.sleep(stub.delay)
+                with stub._lock:
+                    stub.requests += 1
+                    failing = stub.requests <= stub.failures
+                if failing:
+                    self._reply(503)
+                elif self.path.startswith("/api/annotations"):
+                    with stub._lock:
+                        stub.annotations.append(json.loads(body or b"{}"))
+                        annotation_id = len(stub.annotations)
+                    self._reply(200, json.dumps({"id": annotation_id}).encode())
+                elif stub.status < 300 and self.path.startswith("/write"):
+                    lines = [line for line in body.decode("utf-8").split("\n") if line]
+                    with stub._lock:
+                        stub.lines.extend(lines)
+                        stub.writes.append({"lines": len(lines), "gzip": gzipped})
+                    self._reply(stub.status)
+                else:
+                    self._reply(max(stub.status, 404))
+
+            def _reply(self, status, body=b""):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                if body:
+                    self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+_stubs: Dict[str, StubInfluxServer] = {}
+
+
+@keyword("Start Influx Stub")
+def start_influx_stub(status=204, delay=0.0, failures=0, name="influx"):
+    """Start a local InfluxDB write stub and return its base URL.
+
+    Several stubs, e.g. one per sink, are told apart by ``name``.
+    """
+    stop_influx_stub(name)
+    _stubs[name] = StubInfluxServer(
+        status=int(status), delay=float(delay), failures=int(failures)
+    ).start()
+    return _stubs[name].url
+
+
+@keyword("Stop Influx Stub")
+def stop_influx_stub(name=None):
+    """Stop the stub called ``name``, or every stub."""
+    for key in [name] if name else list(_stubs):
+        stub = _stubs.pop(key, None)
+        if stub is not None:
+            stub.stop()
+
+
+@keyword("Influx Stub Line Count")
+def influx_stub_line_count(name="influx"):
+    """Return the number of line protocol lines the stub has accepted."""
+    return len(_stubs[name].lines) if name in _stubs else 0
+
+
+@keyword("Influx Stub Lines")
+def influx_stub_lines(name="influx"):
+    """Return the line protocol lines the stub has accepted, in order."""
+    return list(_stubs[name].lines) if name in _stubs else []
+
+
+@keyword("Influx Stub Writes")
+def influx_stub_writes(name="influx"):
+    """Return one ``lines``/``gzip`` dict per write request the stub accepted."""
+    return list(_stubs[name].writes) if name in _stubs else []
+
+
+@keyword("Influx Stub Annotation Count")
+def influx_stub_annotation_count(name="influx"):
+    """Return the number of Grafana annotations the stub has accepted."""
+    return len(_stubs[name].annotations) if name in _stubs else 0
+
+
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
@@ -0,0 +1,345 @@
+"""Timing spans and latency histograms for the keyword libraries.
+
+Code is instrumented with ``span(name, category)`` blocks or the
+``@instrumented`` decorator; categories separate e.g. ``influx`` (audit
+writes) from ``validation`` (checking logic). While instrumentation is
+disabled a span is a shared no-op context manager and a decorated
+function costs one flag check per call.
+
+Instrumentation is enabled by ``CPAP_INSTRUMENT=1``, by ``enable()`` or by
+attaching the Robot listener, which also records a span per suite, test
+and keyword and writes the results when the run ends::
+
+    robot --pythonpath scripts \\
+          --listener instrumentation.KeywordTimingListener:reports tests/
+
+Results are exported as
+
+* ``instrumentation.lp`` -- line protocol: ``span_timing`` (count, total,
+  mean, percentiles per span) and ``span_latency_bucket`` (log2
+  histogram buckets, tagged with their upper bound ``le_ns``), and
+* ``instrumentation.collapsed`` -- collapsed stacks with self time in
+  microseconds, the input format of ``flamegraph.pl``.
+"""
+
+import contextlib
+import functools
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from robot.api.deco import keyword
+from line_protocol import InfluxBatchWriter, encode_point
+
+_enabled = os.getenv("CPAP_INSTRUMENT", "").lower() in ("1", "true", "yes")
+
+_NULL_SPAN = contextlib.nullcontext()
+
+# Log2 buckets of nanoseconds: bucket b holds durations in [2**(b-1), 2**b)
+_BUCKETS = 48
+
+
+class Histogram:
+    """Log2-bucketed latency histogram in nanoseconds."""
+
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self.buckets = [0] * _BUCKETS
+
+    def add(self, duration_ns: int) -> None:
+        if not self.count or duration_ns < self.min:
+            self.min = duration_ns
+        if duration_ns > self.max:
+            self.max = duration_ns
+        self.count += 1
+        self.total += duration_ns
+        self.buckets[min(duration_ns.bit_length(), _BUCKETS - 1)] += 1
+
+    def percentile(self, q: float) -> int:
+        """Upper bound (ns) of the bucket holding the ``q`` quantile."""
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(1 << bucket, self.max)
+        return self.max
+
+
+class _Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        # "frame;frame;frame" -> self time in ns
+        self.stacks: Dict[str, int] = {}
+
+    def record(self, category: str, name: str, path: str, total_ns: int, self_ns: int) -> None:
+        with self.lock:
+            histogram = self.histograms.get((category, name))
+            if histogram is None:
+                histogram = self.histograms[(category, name)] = Histogram()
+            histogram.add(total_ns)
+            self.stacks[path] = self.stacks.get(path, 0) + self_ns
+
+
+_registry = _Registry()
+_local = threading.local()
+
+
+def enable() -> None:
+    """Start recording spans."""
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    """Stop recording spans (recorded data is kept)."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Discard everything recorded so far."""
+    with _registry.lock:
+        _registry.histograms.clear()
+        _registry.stacks.clear()
+
+
+def _stack() -> List[list]:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def begin(name: str, category: str = "code") -> None:
+    """Open a span on this thread; close it with ``end()``."""
+    # Frame: [name, category, start_ns, time spent in child spans]
+    _stack().append([name.replace(";", ":"), category, time.perf_counter_ns(), 0])
+
+
+def end() -> None:
+    """Close the innermost span opened by ``begin()`` on this thread."""
+    stack = _stack()
+    if not stack:
+        return
+    path = ";".join(frame[0] for frame in stack)
+    name, category, start, children = stack.pop()
+    elapsed = time.perf_counter_ns() - start
+    if stack:
+        stack[-1][3] += elapsed
+    _registry.record(category, name, path, elapsed, elapsed - children)
+
+
+class _Span:
+    __slots__ = ("name", "category")
+
+    def __init__(self, name: str, category: str):
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        begin(self.name, self.category)
+        return self
+
+    def __exit__(self, *exc):
+        end()
+        return False
+
+
+def span(name: str, category: str = "code"):
+    """Return a context manager timing the enclosed block.
+
+    Args:
+        name: Span name, e.g. ``influx.write_points``.
+        category: Group for comparing where time goes, e.g. ``influx``,
+            ``validation`` or ``keyword``.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, category)
+
+
+def instrumented(name: Optional[str] = None, category: str = "code") -> Callable:
+    """Decorator timing every call of a function as a span.
+
+    Args:
+        name: Span name (default: the function's qualified name).
+        category: Span category.
+    """
+    def decorate(function: Callable) -> Callable:
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            begin(label, category)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                end()
+
+        return wrapper
+
+    return decorate
+
+
+def snapshot() -> Dict[str, Dict]:
+    """Return per-span statistics in milliseconds, keyed ``category/name``."""
+    with _registry.lock:
+        items = list(_registry.histograms.items())
+    return {
+        f"{category}/{name}": {
+            "count": h.count,
+            "total_ms": h.total / 1e6,
+            "mean_ms": h.total / h.count / 1e6,
+            "min_ms": h.min / 1e6,
+            "max_ms": h.max / 1e6,
+            "p50_ms": h.percentile(0.50) / 1e6,
+            "p95_ms": h.percentile(0.95) / 1e6,
+            "p99_ms": h.percentile(0.99) / 1e6,
+        }
+        for (category, name), h in items
+    }
+
+
+def line_protocol(time_ns: Optional[int] = None, tags: Optional[Dict[str, str]] = None,
+                  fields: Optional[Dict] = None) -> List[str]:
+    """Encode the recorded statistics as line protocol.
+
+    Args:
+        time_ns: Timestamp of every point (default: now).
+        tags: Extra tags for every point, e.g. the agent.
+        fields: Extra fields for every point, e.g. the build number, which
+            as a tag would start new series on every build.
+    """
+    time_ns = time_ns or time.time_ns()
+    tags = tags or {}
+    fields = fields or {}
+    lines = []
+    with _registry.lock:
+        items = list(_registry.histograms.items())
+    for (category, name), h in items:
+        span_tags = {**tags, "category": category, "span": name}
+        lines.append(encode_point("span_timing", span_tags, {
+            **fields,
+            "count": h.count,
+            "total_ms": h.total / 1e6,
+            "mean_ms": h.total / h.count / 1e6,
+            "max_ms": h.max / 1e6,
+            "p50_ms": h.percentile(0.50) / 1e6,
+            "p95_ms": h.percentile(0.95) / 1e6,
+            "p99_ms": h.percentile(0.99) / 1e6,
+        }, time_ns))
+        for bucket, count in enumerate(h.buckets):
+            if count:
+                lines.append(encode_point(
+                    "span_latency_bucket", {**span_tags, "le_ns": str(1 << bucket)},
+                    {**fields, "count": count}, time_ns,
+                ))
+    return lines
+
+
+def collapsed_stacks() -> List[str]:
+    """Return ``frame;frame;frame <self microseconds>`` lines for flame graphs."""
+    with _registry.lock:
+        stacks = sorted(_registry.stacks.items())
+    return [f"{path} {self_ns // 1000}" for path, self_ns in stacks if self_ns >= 1000]
+
+
+def export(directory, influx_url: Optional[str] = None) -> Dict[str, str]:
+    """Write ``instrumentation.lp`` and ``instrumentation.collapsed``.
+
+    Args:
+        directory: Output directory.
+        influx_url: Also post the line protocol batch to this ``/write`` URL.
+
+    Returns:
+        Dict[str, str]: Paths of the written files.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    lines = line_protocol(fields={"build": os.getenv("BUILD_NUMBER") or None})
+    paths = {
+        "line_protocol": directory / "instrumentation.lp",
+        "collapsed": directory / "instrumentation.collapsed",
+    }
+    paths["line_protocol"].write_text("".join(line + "\n" for line in lines))
+    paths["collapsed"].write_text("".join(line + "\n" for line in collapsed_stacks()))
+    if influx_url and lines:
+        InfluxBatchWriter(influx_url).write(lines)
+    return {key: str(path) for key, path in paths.items()}
+
+
+class KeywordTimingListener:
+    """Robot listener recording a span per suite, test and keyword.
+
+    Enables instrumentation, so spans inside the libraries nest under the
+    keyword that ran them, and exports the results when the top-level
+    suite ends.
+    """
+
+    ROBOT_LISTENER_API_VERSION = 2
+
+    def __init__(self, output_dir=".", influx_url=None):
+        self.output_dir = output_dir
+        self.influx_url = influx_url
+        self._depth = 0
+        enable()
+
+    def start_suite(self, name, attrs):
+        self._depth += 1
+        begin(name, "suite")
+
+    def end_suite(self, name, attrs):
+        end()
+        self._depth -= 1
+        if self._depth == 0:
+            paths = export(self.output_dir, self.influx_url)
+            print(f"Instrumentation: {paths['line_protocol']}, {paths['collapsed']}")
+
+    def start_test(self, name, attrs):
+        begin(name, "test")
+
+    def end_test(self, name, attrs):
+        end()
+
+    def start_keyword(self, name, attrs):
+        begin(name, "keyword")
+
+    def end_keyword(self, name, attrs):
+        end()
+
+
+@keyword("Start Instrumentation")
+def start_instrumentation():
+    """Discard earlier spans and start recording."""
+    reset()
+    enable()
+
+
+@keyword("Export Instrumentation")
+def export_instrumentation(directory, influx_url=None):
+    """Stop recording and write the line protocol and collapsed stacks.
+
+    Returns:
+        dict: Paths of ``line_protocol`` and ``collapsed``.
+    """
+    disable()
+    return export(directory, influx_url)
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
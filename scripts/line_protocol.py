@@ -0,0 +1,230 @@
+"""InfluxDB line protocol encoding and batched HTTP writes.
+
+``InfluxBatchWriter`` posts lines in gzip-compressed batches over one
+pooled, keep-alive ``requests.Session`` with automatic retries, so large
+metric exports cost a handful of requests instead of one per point.
+
+``post_with_retry`` retries a request with jittered exponential backoff
+and never runs past an absolute deadline, for callers that manage retries
+themselves (sessions created with ``retries=0``).
+
+``requests`` is imported on first use, so modules that only encode points
+do not pay for it at import time.
+"""
+
+import gzip
+import random
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional, Tuple
+
+if TYPE_CHECKING:
+    import requests
+
+
+def _escape_key(value: str) -> str:
+    return (
+        str(value).replace("\\", "\\\\").replace(",", "\\,")
+        .replace("=", "\\=").replace(" ", "\\ ")
+    )
+
+
+def _format_field(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{text}"'
+
+
+def encode_point(
+    measurement: str,
+    tags: Dict[str, Any],
+    fields: Dict[str, Any],
+    time_ns: int,
+) -> str:
+    """Encode one point as InfluxDB line protocol.
+
+    Args:
+        measurement: Measurement name.
+        tags: Tag set (values are stringified; empty values are omitted).
+        fields: Field set; ``None`` values are omitted.
+        time_ns: Timestamp in nanoseconds since the epoch.
+
+    Returns:
+        str: A single line protocol line without trailing newline.
+    """
+    key = _escape_key(measurement)
+    for name, value in sorted(tags.items()):
+        if value is not None and value != "":
+            key += f",{_escape_key(name)}={_escape_key(value)}"
+    field_set = ",".join(
+        f"{_escape_key(name)}={_format_field(value)}"
+        for name, value in fields.items()
+        if value is not None
+    )
+    return f"{key} {field_set} {time_ns}"
+
+
+def pooled_session(retries: int = 3, backoff: float = 0.5, pool_size: int = 4) -> "requests.Session":
+    """Return a keep-alive session that retries transient write failures."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["POST"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+def post_with_retry(
+    session: "requests.Session",
+    url: str,
+    attempts: int = 4,
+    backoff: float = 0.25,
+    deadline: Optional[float] = None,
+    timeout: float = 5.0,
+    **kwargs,
+) -> "requests.Response":
+    """POST with full-jitter exponential backoff, bounded by a deadline.
+
+    Connection errors and ``RETRY_STATUSES`` responses are retried; the
+    wait before attempt ``n`` is uniform in ``[0, backoff * 2**n]``. Each
+    request's timeout and every wait are cut to the time left before
+    ``deadline``.
+
+    Args:
+        session: Session to post with.
+        url: Target URL.
+        attempts: Maximum number of requests.
+        backoff: Base backoff in seconds.
+        deadline: Absolute ``time.monotonic()`` time to give up at.
+        timeout: Per-request timeout in seconds.
+        **kwargs: Passed to ``session.post``.
+
+    Returns:
+        requests.Response: The last response received.
+
+    Raises:
+        requests.exceptions.RequestException: If the last attempt failed to
+            get a response, or the deadline passed before any response.
+    """
+    import requests
+
+    response = error = None
+    for attempt in range(attempts):
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            break
+        try:
+            response = session.post(
+                url, timeout=timeout if remaining is None else min(timeout, remaining), **kwargs
+            )
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            error = None
+        except requests.exceptions.RequestException as e:
+            error = e
+        if attempt + 1 < attempts:
+            wait = random.uniform(0, backoff * 2 ** attempt)
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - time.monotonic()))
+            time.sleep(wait)
+    if response is not None and error is None:
+        return response
+    if error is not None:
+        raise error
+    raise requests.exceptions.Timeout(f"Deadline passed before posting to {url}")
+
+
+class InfluxBatchWriter:
+    """Writes line protocol to an InfluxDB ``/write`` URL in compressed batches."""
+
+    def __init__(
+        self,
+        url: str,
+        auth: Optional[Tuple[str, str]] = None,
+        batch_size: int = 5000,
+        compress: bool = True,
+        timeout: float = 5.0,
+        session: Optional["requests.Session"] = None,
+        attempts: int = 1,
+        deadline: Optional[float] = None,
+    ):
+        """Create a writer.
+
+        Args:
+            url: Full write URL including ``db`` and ``precision``.
+            auth: Optional (user, password).
+            batch_size: Lines per HTTP request.
+            compress: Gzip request bodies.
+            timeout: Per-request timeout in seconds.
+            session: Session to reuse (default: a new pooled session).
+            attempts: Requests per batch, retried with ``post_with_retry``;
+                for sessions without their own retries.
+            deadline: Absolute ``time.monotonic()`` time to give up at.
+        """
+        self.url = url
+        self.auth = auth
+        self.batch_size = batch_size
+        self.compress = compress
+        self.timeout = timeout
+        self.session = session or pooled_session()
+        self.attempts = attempts
+        self.deadline = deadline
+        self.lines_written = 0
+        self.requests_sent = 0
+
+    def write(self, lines: Iterable[str]) -> bool:
+        """Write every line, chunked into batches.
+
+        Returns:
+            bool: True if every batch was accepted.
+        """
+        ok = True
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= self.batch_size:
+                ok = self._post(batch) and ok
+                batch = []
+        if batch:
+            ok = self._post(batch) and ok
+        return ok
+
+    def _post(self, batch) -> bool:
+        import requests
+
+        body = "\n".join(batch).encode("utf-8")
+        headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if self.compress:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        self.requests_sent += 1
+        try:
+            response = post_with_retry(
+                self.session, self.url, attempts=self.attempts, deadline=self.deadline,
+                timeout=self.timeout, data=body, headers=headers, auth=self.auth,
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"InfluxDB connection error: {str(e)}")
+            return False
+        if response.status_code == 204:
+            self.lines_written += len(batch)
+            return True
+        print(f"InfluxDB error {response.status_code}: {response.text}")
+        return False
@@ -0,0 +1,289 @@
+"""Run the Robot suites in parallel shards and merge the results.
+
+Suites are assigned to worker processes longest-first using the per-suite
+durations recorded by previous runs, so the slowest shard -- the wall time
+of the whole run -- stays as short as possible. Each shard runs in its own
+``robot`` process with a private temporary directory as ``TMPDIR``, which
+is where the suites create their firmware sandboxes (``${TEMPDIR}``), so
+one shard's partial copies and rollbacks never touch another's images.
+The shard outputs are merged into a single ``output.xml`` plus log and
+report, as a serial ``robot tests/`` run would produce.
+
+``--profile`` selects the device profile of every shard (see ``config``);
+it is validated once here and handed to the shards already resolved, so
+runs against different device models can proceed side by side in one job
+with separate ``--outputdir`` directories.
+
+Usage:
+    python3 scripts/parallel_runner.py --outputdir reports --workers 4 tests/
+"""
+
+import argparse
+import heapq
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from robot import rebot
+from robot.api import ExecutionResult
+from robot.api.deco import keyword
+from robot.errors import DataError
+from robot.result import TestSuite
+
+DURATION_HISTORY = ".suite_durations.json"
+
+# Weight given to the newest measurement when updating a suite's duration
+_SMOOTHING = 0.5
+
+# Lowest robot exit code that may not be a failed-test count
+_ROBOT_ERROR = 250
+
+
+def discover_suites(paths: List[str]) -> List[Path]:
+    """Return the ``.robot`` files under ``paths``, sorted by name."""
+    suites: List[Path] = []
+    for path in map(Path, paths):
+        suites.extend(sorted(path.glob("*.robot")) if path.is_dir() else [path])
+    return suites
+
+
+def load_durations(path) -> Dict[str, float]:
+    """Load recorded suite durations (seconds, keyed by file name)."""
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_durations(path, durations: Dict[str, float]) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as file:
+        json.dump(durations, file, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def plan_shards(
+    suites: List[Path], durations: Dict[str, float], workers: int
+) -> List[List[Path]]:
+    """Split suites into at most ``workers`` shards of similar total duration.
+
+    Longest-processing-time-first: suites are taken slowest first and each
+    goes to the currently lightest shard. Suites with no history count as
+    the average known duration.
+
+    Returns:
+        List[List[Path]]: Non-empty shards, each in discovery order.
+    """
+    known = [durations[s.name] for s in suites if s.name in durations]
+    default = sum(known) / len(known) if known else 1.0
+    order = {suite: index for index, suite in enumerate(suites)}
+
+    heap = [(0.0, index, []) for index in range(max(1, min(workers, len(suites))))]
+    for suite in sorted(suites, key=lambda s: durations.get(s.name, default), reverse=True):
+        load, index, shard = heapq.heappop(heap)
+        shard.append(suite)
+        heapq.heappush(heap, (load + durations.get(suite.name, default), index, shard))
+    return [sorted(shard, key=order.get) for _, _, shard in sorted(heap, key=lambda h: h[1]) if shard]
+
+
+def _elapsed_seconds(suite) -> float:
+    # RF 7 exposes a timedelta, RF 6 milliseconds
+    if hasattr(suite, "elapsed_time"):
+        return suite.elapsed_time.total_seconds()
+    return suite.elapsedtime / 1000.0
+
+
+def _run_shard(index: int, suites: List[Path], outputdir: Path, sandbox: Path,
+               robot_args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    shard_dir = outputdir / f"shard-{index:02d}"
+    # Never merge a stale output left by an earlier run
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    tmp = sandbox / f"shard-{index:02d}"
+    tmp.mkdir(parents=True, exist_ok=True)
+    env = dict(env, TMPDIR=str(tmp), TEMP=str(tmp), TMP=str(tmp))
+    command = [
+        sys.executable, "-m", "robot",
+        "--outputdir", str(shard_dir),
+        "--output", "output.xml", "--log", "NONE", "--report", "NONE",
+        "--console", "dotted",
+        *robot_args,
+        *map(str, suites),
+    ]
+    return subprocess.Popen(command, env=env)
+
+
+def _readable(output: Path) -> bool:
+    # A shard killed mid-run leaves a truncated output.xml
+    try:
+        ExecutionResult(str(output))
+    except DataError:
+        return False
+    return True
+
+
+def merge_outputs(outputs: List[Path], output: Path, name: str) -> ExecutionResult:
+    """Merge shard outputs into one result with every suite at the top level.
+
+    Shards ran disjoint suites, so their child suites are simply combined
+    under one top-level suite (sorted by source) rather than re-executed
+    test merging as ``rebot --merge`` does. A shard that ran one file has
+    no child suites; its top-level suite is that file's suite.
+    """
+    results = [ExecutionResult(str(path)) for path in outputs]
+    # A shard of a single file has that file as its top-level suite
+    children = [
+        child
+        for result in results
+        for child in (result.suite.suites or [result.suite])
+    ]
+    merged = results[0]
+    merged.suite = TestSuite(name=name)
+    merged.suite.suites = sorted(children, key=lambda s: str(s.source or s.name))
+    starts = [r.suite.starttime for r in results if r.suite.starttime not in (None, "N/A")]
+    ends = [r.suite.endtime for r in results if r.suite.endtime not in (None, "N/A")]
+    if starts and ends:
+        merged.suite.starttime, merged.suite.endtime = min(starts), max(ends)
+    merged.save(str(output))
+    return merged
+
+
+def run_parallel(
+    paths: List[str],
+    outputdir="reports",
+    workers: Optional[int] = None,
+    history=DURATION_HISTORY,
+    robot_args: Optional[List[str]] = None,
+    name: str = "Tests",
+    profile: Optional[str] = None,
+) -> Dict:
+    """Run suites in parallel shards and write a merged output, log and report.
+
+    Args:
+        paths: Suite files or directories of ``.robot`` files.
+        outputdir: Directory for the merged results and per-shard outputs.
+        workers: Parallel shards (default: CPU count).
+        history: JSON file of per-suite durations, read for scheduling
+            and updated with this run's measurements.
+        robot_args: Extra options passed to every ``robot`` process.
+        name: Name of the merged top-level suite.
+        profile: Device profile for every shard (default: inherited).
+
+    Returns:
+        Dict: Shard plan, merged statistics, wall time, each shard's exit
+        code and the exit code ``robot`` would have returned -- the highest
+        shard code when a shard exited with 250 or more.
+
+    Raises:
+        RuntimeError: A shard wrote no output, e.g. robot rejected its
+            options, or was killed before finishing it.
+    """
+    suites = discover_suites(paths)
+    if not suites:
+        raise ValueError(f"No .robot suites found in {paths}")
+    env = dict(os.environ)
+    if profile:
+        from config import export_profile, load_profile
+        env["CPAP_DEVICE_PROFILE"] = profile
+        export_profile(load_profile(profile), env)
+    outputdir = Path(outputdir)
+    outputdir.mkdir(parents=True, exist_ok=True)
+    durations = load_durations(history)
+    shards = plan_shards(suites, durations, workers or os.cpu_count() or 1)
+    for index, shard in enumerate(shards):
+        print(f"Shard {index}: {', '.join(s.name for s in shard)}")
+
+    start = time.perf_counter()
+    sandbox = Path(tempfile.mkdtemp(prefix="cpap_shards_"))
+    try:
+        processes = [
+            _run_shard(index, shard, outputdir, sandbox, robot_args or [], env)
+            for index, shard in enumerate(shards)
+        ]
+        codes = [process.wait() for process in processes]
+    finally:
+        shutil.rmtree(sandbox, ignore_errors=True)
+    wall = time.perf_counter() - start
+
+    # 0-249 count failed tests; 250 and above may be a robot usage or
+    # internal error, and a negative code a shard killed by a signal,
+    # neither of which the merged statistics would show
+    errors = {i: code for i, code in enumerate(codes) if code < 0 or code >= _ROBOT_ERROR}
+    for index, code in errors.items():
+        print(f"Shard {index} exited with code {code}")
+    outputs = [outputdir / f"shard-{i:02d}" / "output.xml" for i in range(len(shards))]
+    unusable = [
+        f"{path} (exit code {codes[index]})"
+        for index, path in enumerate(outputs)
+        if not path.exists() or (index in errors and not _readable(path))
+    ]
+    if unusable:
+        raise RuntimeError(f"Shards produced no usable output: {', '.join(unusable)}")
+    output = outputdir / "output.xml"
+    merged = merge_outputs(outputs, output, name)
+    with open(os.devnull, "w") as devnull:
+        rebot(str(output), outputdir=str(outputdir), output="NONE",
+              log="log.html", report="report.html", stdout=devnull)
+
+    for suite in merged.suite.suites:
+        if suite.source:
+            key = Path(suite.source).name
+            measured = _elapsed_seconds(suite)
+            previous = durations.get(key, measured)
+            durations[key] = round(_SMOOTHING * measured + (1 - _SMOOTHING) * previous, 3)
+    save_durations(history, durations)
+
+    total = merged.statistics.total
+    failed = getattr(total, "failed", 0)
+    print(
+        f"{total.passed} passed, {failed} failed, {total.skipped} skipped "
+        f"in {wall:.1f}s across {len(shards)} shards"
+    )
+    print(f"Output:  {output.resolve()}")
+    return {
+        "shards": [[s.name for s in shard] for shard in shards],
+        "passed": total.passed,
+        "failed": failed,
+        "skipped": total.skipped,
+        "seconds": wall,
+        "shard_return_codes": codes,
+        "return_code": max([min(failed, 250), *errors.values()]),
+    }
+
+
+@keyword("Plan Suite Shards")
+def plan_suite_shards(durations, workers):
+    """Return shard assignments (suite names) for ``{suite: seconds}`` durations."""
+    suites = [Path(name) for name in sorted(durations)]
+    durations = {name: float(seconds) for name, seconds in durations.items()}
+    return [[s.name for s in shard] for shard in plan_shards(suites, durations, int(workers))]
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run Robot suites in parallel shards and merge the results",
+        epilog="Unrecognised options are passed through to robot; "
+               "give their values as --option=value.",
+    )
+    parser.add_argument("paths", nargs="+", help="Suite files or directories")
+    parser.add_argument("--outputdir", "-d", default="reports")
+    parser.add_argument("--workers", "-w", type=int)
+    parser.add_argument("--history", default=DURATION_HISTORY,
+                        help="Per-suite duration history (JSON)")
+    parser.add_argument("--name", default="Tests")
+    parser.add_argument("--profile", help="Device profile for every shard")
+    args, passthrough = parser.parse_known_args()
+
+    report = run_parallel(args.paths, args.outputdir, args.workers,
+                          args.history, passthrough, args.name, args.profile)
+    sys.exit(report["return_code"])
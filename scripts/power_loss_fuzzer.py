@@ -0,0 +1,339 @@
+"""Power-loss fuzzing of firmware updates and rollbacks.
+
+``simulate_partial_copy`` tears an update at one fixed point. A campaign
+instead cuts power (``atomic_io.power_loss_at``) at every write boundary
+of the operations that touch the installed image, then "boots" the
+device: the installed image must be the old or the new image, byte for
+byte, and the backup must still hold the old one.
+
+Interruption points, per scenario:
+
+* ``update`` -- every ``block`` bytes (a flash page) of the new image
+  being staged, plus the end of the staged copy,
+* ``update_backup`` -- while the update links the current image as backup,
+* ``update_backup_sync`` -- after the backup link is renamed into place,
+  before its directory is synced,
+* ``update_install`` -- between the backup link and the rename of the
+  staged copy over the installed image,
+* ``update_sync`` -- after that rename, before its directory is synced,
+* ``rollback`` -- while the backup is linked back over an updated image,
+* ``rollback_sync`` -- after that link is renamed into place, before its
+  directory is synced.
+
+The page offsets all check that an unfinished staged copy never reaches
+the device; the other points are where a crash leaves the directory in a
+different state.
+
+Trials run in spawned worker processes, each in its own temporary
+directory, with their own audit spool and without the result cache, so a
+campaign leaves no trace in the checkout's spool or cache. The
+old and new images are created once and hard-linked into each trial
+directory, which is safe because images are never modified in place, so
+setting up a trial costs no copy even for 10 MB images; after the power
+loss, a path still linked to a pristine image needs no re-hashing. The
+pristine images are hashed again at the end to prove they were never
+written. ``samples`` limits the update offsets to a random subset for
+quick runs.
+
+Usage:
+    python3 scripts/power_loss_fuzzer.py --image-size 10000000 --workers 8
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from robot.api.deco import keyword
+from atomic_io import PowerLoss, power_loss_at
+from checksum_validator import sha256
+from config import firmware_paths
+import firmware_keywords
+from firmware_updater import update_firmware
+from influx_logger import logger
+from rollback import rollback
+
+SCENARIOS = ("update", "update_backup", "update_backup_sync", "update_install",
+             "update_sync", "rollback", "rollback_sync")
+
+# Operation cut by each scenario (see atomic_io.power_loss_at)
+_OPERATIONS = {
+    "update": "copy",
+    "update_backup": "link",
+    "update_backup_sync": "link_sync",
+    "update_install": "copy_rename",
+    "update_sync": "copy_sync",
+    "rollback": "link",
+    "rollback_sync": "link_sync",
+}
+
+# Flash page size; update interruptions are tried on these boundaries
+DEFAULT_BLOCK = 4096
+
+# (scenario, offset); the offset is None for link interruptions
+Trial = Tuple[str, Optional[int]]
+
+
+def interruption_points(image_size: int, block: int = DEFAULT_BLOCK,
+                        scenarios=SCENARIOS) -> List[Trial]:
+    """Return every interruption point of the given scenarios."""
+    points: List[Trial] = []
+    if "update" in scenarios:
+        offsets = list(range(0, image_size, block)) + [image_size]
+        points.extend(("update", offset) for offset in offsets)
+    points.extend((scenario, None) for scenario in SCENARIOS[1:] if scenario in scenarios)
+    return points
+
+
+def _interrupt(scenario: str, offset: Optional[int], trial_dir: Path) -> Optional[str]:
+    """Run one operation in ``trial_dir`` with power cut at the given point.
+
+    Returns:
+        Optional[str]: None if power was lost as planned, else why not.
+    """
+    installed, new, backup = firmware_paths(trial_dir)
+    try:
+        with power_loss_at(offset or 0, _OPERATIONS[scenario]):
+            if scenario.startswith("rollback"):
+                # An updated device (new installed, old as backup) rolls back
+                os.replace(new, installed)
+                rollback(backup_path=backup, device_path=installed)
+            else:
+                update_firmware(new_path=new, device_path=installed, backup_path=backup,
+                                use_cache=False)
+    except PowerLoss:
+        return None
+    except Exception as e:
+        return f"failed before the interruption point: {str(e)}"
+    return "completed without reaching the interruption point"
+
+
+def _identify(path: Path, inodes: Dict[Tuple[int, int], str],
+              digests: Dict[str, str]) -> Optional[str]:
+    """Return ``"old"``, ``"new"`` or None for the image at ``path``.
+
+    A path still linked to a pristine image is that image; anything else
+    is hashed.
+    """
+    stat = path.stat()
+    name = inodes.get((stat.st_dev, stat.st_ino))
+    if name is not None:
+        return name
+    digest = sha256(path, use_cache=False)
+    return next((name for name, known in digests.items() if known == digest), None)
+
+
+def _boot(trial_dir: Path, inodes: Dict[Tuple[int, int], str],
+          digests: Dict[str, str]) -> Tuple[Optional[str], Optional[str]]:
+    """Check the device after power returns.
+
+    Returns:
+        Tuple: The booted image (``"old"`` or ``"new"``) and the reason the
+        device is not intact, or None if it is.
+    """
+    installed, _, backup = firmware_paths(trial_dir)
+    if not installed.exists():
+        return None, "no installed image"
+    booted = _identify(installed, inodes, digests)
+    if booted is None:
+        return None, "installed image is neither the old nor the new image"
+    if backup.exists() and _identify(backup, inodes, digests) != "old":
+        return booted, "backup no longer holds the old image"
+    return booted, None
+
+
+def _run_trials(pristine: str, work_root: str, trials: List[Trial],
+                digests: Dict[str, str], quiet: bool) -> List[Dict]:
+    """Run a batch of trials in one private directory of a worker process."""
+    pristine = Path(pristine)
+    installed, new, _ = firmware_paths(pristine)
+    inodes = {(path.stat().st_dev, path.stat().st_ino): name
+              for path, name in ((installed, "old"), (new, "new"))}
+    trial_dir = Path(tempfile.mkdtemp(prefix="trial-", dir=work_root))
+    outcomes = []
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        for scenario, offset in trials:
+            shutil.rmtree(trial_dir)
+            trial_dir.mkdir()
+            for source, target in zip(firmware_paths(pristine), firmware_paths(trial_dir)):
+                os.link(source, target)
+            error = _interrupt(scenario, offset, trial_dir)
+            booted, boot_error = _boot(trial_dir, inodes, digests)
+            outcomes.append({"scenario": scenario, "offset": offset,
+                             "booted": booted, "error": error or boot_error})
+    shutil.rmtree(trial_dir, ignore_errors=True)
+    return outcomes
+
+
+def run_power_loss_campaign(
+    image_size: int = 200_000,
+    block: int = DEFAULT_BLOCK,
+    samples: Optional[int] = None,
+    scenarios=SCENARIOS,
+    workers: Optional[int] = None,
+    root: Optional[str] = None,
+    seed: int = 0,
+    quiet: bool = True,
+) -> Dict:
+    """Interrupt updates and rollbacks at every write boundary and boot the device.
+
+    Args:
+        image_size: Synthetic image size in bytes.
+        block: Distance in bytes between update interruption points.
+        samples: Test only this many update offsets, chosen at random
+            (default: all of them).
+        scenarios: Scenarios to run (see ``SCENARIOS``).
+        workers: Worker processes (default: CPU count).
+        root: Parent directory for the images and trial directories
+            (default: a temporary directory removed afterwards).
+        seed: Seed for sampling offsets.
+        quiet: Suppress per-step output from the firmware operations.
+
+    Returns:
+        Dict: Interruption points and the share tested (``coverage``), the
+        images booted, ``failures`` (trials whose device was not intact),
+        elapsed seconds and ``interruptions_per_second``.
+
+    Raises:
+        ValueError: On an unknown scenario or a non-positive block size.
+    """
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    if block <= 0:
+        raise ValueError("block must be positive")
+    points = interruption_points(image_size, block, scenarios)
+    trials = points
+    if samples is not None:
+        updates = [point for point in points if point[0] == "update"]
+        if samples < len(updates):
+            chosen = set(random.Random(seed).sample(updates, samples))
+            trials = [point for point in points if point[0] != "update" or point in chosen]
+
+    cleanup = root is None
+    root = Path(root or tempfile.mkdtemp(prefix="cpap_power_loss_"))
+    workers = workers or os.cpu_count()
+    try:
+        pristine = root / "pristine"
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            firmware_keywords.create_firmware_sandbox(pristine, image_size)
+        installed, new, _ = firmware_paths(pristine)
+        digests = {"old": sha256(installed, use_cache=False),
+                   "new": sha256(new, use_cache=False)}
+        # Several batches per worker, so a slow batch does not idle the rest
+        size = max(1, -(-len(trials) // (workers * 4)))
+        batches = [trials[index:index + size] for index in range(0, len(trials), size)]
+
+        # Spawned workers start without our threads (the audit replayer may
+        # hold locks a fork would copy) and inherit the environment and
+        # sys.path, so they log to a spool of their own and import this module
+        saved_spool = os.environ.get("AUDIT_SPOOL_DIR")
+        os.environ["AUDIT_SPOOL_DIR"] = str(root / "audit_spool")
+        scripts_dir = str(Path(__file__).resolve().parent)
+        added_path = scripts_dir not in sys.path
+        if added_path:
+            sys.path.insert(0, scripts_dir)
+        start = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [
+                    pool.submit(_run_trials, str(pristine), str(root), batch, digests, quiet)
+                    for batch in batches
+                ]
+                outcomes = [outcome for future in futures for outcome in future.result()]
+        finally:
+            if saved_spool is None:
+                os.environ.pop("AUDIT_SPOOL_DIR", None)
+            else:
+                os.environ["AUDIT_SPOOL_DIR"] = saved_spool
+            if added_path:
+                sys.path.remove(scripts_dir)
+        elapsed = time.perf_counter() - start
+        # Trials trusted links to the pristine images; make sure they are intact
+        if digests != {"old": sha256(installed, use_cache=False),
+                       "new": sha256(new, use_cache=False)}:
+            raise RuntimeError("Pristine images were modified during the campaign")
+    finally:
+        if cleanup:
+            shutil.rmtree(root, ignore_errors=True)
+
+    failures = [outcome for outcome in outcomes if outcome["error"]]
+    report = {
+        "image_size": image_size,
+        "block": block,
+        "scenarios": {name: sum(1 for o in outcomes if o["scenario"] == name)
+                      for name in scenarios},
+        "interruption_points": len(points),
+        "tested": len(outcomes),
+        "coverage": len(outcomes) / len(points) if points else 0.0,
+        "booted": {name: sum(1 for o in outcomes if o["booted"] == name)
+                   for name in ("old", "new")},
+        "failures": failures,
+        "workers": workers,
+        "seconds": elapsed,
+        "interruptions_per_second": len(outcomes) / elapsed if elapsed > 0 else 0.0,
+    }
+    logger.log_event("power_loss_campaign", {
+        "image_size": image_size,
+        "tested": report["tested"],
+        "coverage": report["coverage"],
+        "failures": len(failures),
+        "result": "failed" if failures else "passed",
+    })
+    return report
+
+
+@keyword("Run Power Loss Campaign")
+def run_power_loss_campaign_keyword(image_size=200_000, block=DEFAULT_BLOCK, samples=None,
+                                    scenarios=None, workers=None):
+    """Fuzz power loss over updates and rollbacks and return the report.
+
+    ``scenarios`` is a list or comma-separated string (default: all).
+    """
+    if isinstance(scenarios, str):
+        scenarios = [name.strip() for name in scenarios.split(",")]
+    report = run_power_loss_campaign(
+        int(image_size), int(block), int(samples) if samples else None,
+        scenarios or SCENARIOS, int(workers) if workers else None,
+    )
+    print(
+        f"{report['tested']} of {report['interruption_points']} interruption points "
+        f"({report['coverage']:.0%}) at {report['interruptions_per_second']:.0f}/s, "
+        f"{len(report['failures'])} failures"
+    )
+    return report
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuzz power loss during firmware updates")
+    parser.add_argument("--image-size", type=int, default=10_000_000)
+    parser.add_argument("--block", type=int, default=DEFAULT_BLOCK)
+    parser.add_argument("--samples", type=int, help="Update offsets to sample")
+    parser.add_argument("--scenarios", help="Comma-separated subset of " + ",".join(SCENARIOS))
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--root", help="Keep images and trial directories here")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = run_power_loss_campaign(
+        args.image_size, args.block, args.samples,
+        args.scenarios.split(",") if args.scenarios else SCENARIOS,
+        args.workers, args.root, args.seed,
+    )
+    print(json.dumps(report, indent=2))
+    raise SystemExit(1 if report["failures"] else 0)
@@ -4,13 +4,26 @@ Provides Robot Framework keywords to test pressure accuracy
 in compliance with ISO 80601-2-70.
 """
 
+from pathlib import Path
+
+import numpy as np
 from robot.api.deco import keyword
-from influx_logger import AuditLogger
+from capture_format import is_capture, open_capture
+from config import device_config
+from influx_logger import SuiteFlushListener, logger as _logger
+from instrumentation import instrumented, span
+
+# ISO 80601-2-70 specifies ±0.5 cmH2O tolerance for pressure delivery;
+# the active device profile sets it
+TOLERANCE = device_config.pressure_tolerance
 
-_logger = AuditLogger()
 
-# ISO 80601-2-70 specifies ±0.5 cmH2O tolerance for pressure delivery
-TOLERANCE = 0.5
+def pressure_within_tolerance(measured, target, tolerance=TOLERANCE):
+    """Return whether ``measured`` is within ``tolerance`` of ``target``.
+
+    Works element-wise on numpy arrays.
+    """
+    return abs(measured - target) <= tolerance
 
 
 @keyword("Validate Pressure")
@@ -31,7 +44,7 @@ def validate_pressure(measured_pressure, target_pressure=12.0):
         pressure = float(measured_pressure)
         target = float(target_pressure)
 
-        within_tolerance = abs(pressure - target) <= TOLERANCE
+        within_tolerance = pressure_within_tolerance(pressure, target)
 
         _logger.log_event("pressure_test", {
             "target": target,
@@ -52,5 +65,140 @@ def validate_pressure(measured_pressure, target_pressure=12.0):
         raise
 
 
+@instrumented("pressure.load_trace", "validation")
+def _load_trace(capture, target_pressure=None, start=None, end=None):
+    """Load a pressure capture into (timestamps, measured, target) arrays.
+
+    Args:
+        capture: Path to a capture (``.cpcap``), CSV (``timestamp,measured[,target]``
+            with optional header row) or ``.npy`` file, or an array of the
+            same columns.
+        target_pressure: Constant setpoint used when the capture has no
+            target column.
+        start: Keep only samples from this time in seconds.
+        end: Keep only samples before this time in seconds.
+
+    Returns:
+        Tuple of three float64 arrays of equal length.
+
+    Raises:
+        ValueError: If the capture has the wrong shape or no target is known.
+    """
+    if is_capture(capture):
+        # Only the pages of the window are read from the mapping
+        data = open_capture(capture).read(start, end)
+        start = end = None
+    elif isinstance(capture, (str, Path)):
+        path = Path(capture)
+        if path.suffix == ".npy":
+            data = np.load(path, mmap_mode="r")
+        else:
+            data = np.loadtxt(path, delimiter=",", ndmin=2, comments="#",
+                              skiprows=_header_rows(path))
+    else:
+        data = np.asarray(capture)
+
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim != 2 or data.shape[1] not in (2, 3):
+        raise ValueError(f"Expected 2 or 3 columns, got shape {data.shape}")
+    if start is not None:
+        data = data[data[:, 0] >= float(start)]
+    if end is not None:
+        data = data[data[:, 0] < float(end)]
+
+    timestamps, measured = data[:, 0], data[:, 1]
+    if data.shape[1] == 3:
+        target = data[:, 2]
+    elif target_pressure is not None:
+        target = np.full_like(measured, float(target_pressure))
+    else:
+        raise ValueError("Capture has no target column and no target_pressure given")
+    return timestamps, measured, target
+
+
+def _header_rows(path):
+    """Return 1 if the first line of a CSV is a header, else 0."""
+    with open(path) as file:
+        first = file.readline()
+    try:
+        float(first.split(",")[0])
+        return 0
+    except ValueError:
+        return 1
+
+
+@keyword("Validate Pressure Trace")
+def validate_pressure_trace(capture, target_pressure=None, tolerance=TOLERANCE,
+                            start=None, end=None):
+    """Validate a whole pressure waveform, or a time window of it, against
+    the tolerance band.
+
+    All samples are checked in one vectorized pass and a single aggregated
+    audit event is logged for the trace.
+
+    Args:
+        capture: Capture/CSV/``.npy`` path or array of
+            ``timestamp, measured[, target]``.
+        target_pressure: Setpoint in cmH2O when the capture has no target column.
+        tolerance: Allowed deviation in cmH2O (default: ISO ±0.5).
+        start: Validate from this time in seconds (default: the beginning).
+        end: Validate up to this time in seconds (default: the end).
+
+    Returns:
+        dict: ``samples``, ``violations``, ``longest_violation_samples``,
+        ``longest_violation_seconds``, ``max_deviation``, ``rms_error`` and
+        ``passed``.
+
+    Raises:
+        ValueError: If the capture cannot be interpreted.
+    """
+    timestamps, measured, target = _load_trace(
+        capture, target_pressure,
+        None if start is None else float(start), None if end is None else float(end),
+    )
+    tolerance = float(tolerance)
+
+    with span("pressure.analyse", "validation"):
+        error = measured - target
+        deviation = np.abs(error)
+        # Missing readings (NaN, e.g. a sensor dropout) count as violations
+        outside = ~(deviation <= tolerance)
+        valid = ~np.isnan(deviation)
+
+        # Run boundaries of consecutive out-of-tolerance samples
+        edges = np.diff(np.concatenate(([0], outside.view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        longest_samples = 0
+        longest_seconds = 0.0
+        if starts.size:
+            lengths = ends - starts
+            longest = int(np.argmax(lengths))
+            longest_samples = int(lengths[longest])
+            longest_seconds = float(timestamps[ends[longest] - 1] - timestamps[starts[longest]])
+
+        samples = int(measured.size)
+        summary = {
+            "samples": samples,
+            "violations": int(np.count_nonzero(outside)),
+            "missing_samples": samples - int(np.count_nonzero(valid)),
+            "longest_violation_samples": longest_samples,
+            "longest_violation_seconds": longest_seconds,
+            "max_deviation": float(deviation[valid].max()) if valid.any() else 0.0,
+            "rms_error": float(np.sqrt(np.mean(np.square(error[valid])))) if valid.any() else 0.0,
+        }
+        summary["passed"] = summary["violations"] == 0
+
+    _logger.log_event("pressure_trace_test", {
+        **{key: value for key, value in summary.items() if key != "passed"},
+        "tolerance": tolerance,
+        "result": "passed" if summary["passed"] else "failed"
+    })
+
+    print(f"Pressure trace validation: {summary}")
+    return summary
+
+
 # Required by Robot Framework to register keywords
 ROBOT_LIBRARY_SCOPE = "GLOBAL"
+ROBOT_LIBRARY_LISTENER = SuiteFlushListener()
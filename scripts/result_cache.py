@@ -0,0 +1,237 @@
+"""Persistent cache of firmware validation verdicts across runs.
+
+A verdict is stored under a key derived from everything it depends on --
+the image's SHA-256, the device profile values and the version of the
+validation code -- so an image that has not changed since an earlier build
+is answered from the cache, while a new image, a different profile or an
+edited validator misses and pays for the full check.
+
+The cache is one JSON file (``FIRMWARE_RESULT_CACHE``, default
+``.firmware_results.json`` in the base directory) bounded to
+``max_entries``; the least recently used entries are evicted. Saves merge
+with entries written meanwhile by other processes, such as parallel
+shards, and replace the file atomically while holding an ``flock`` on
+``<cache>.lock``, so concurrent saves never drop each other's entries.
+Recorded results are saved in batches of ``save_every``; the rest are
+saved by an explicit ``save`` (at exit for the process-wide cache).
+
+Invalidations are recorded in the file too, as the time each tag (or the
+whole cache) was invalidated. An entry stored before an invalidation that
+covers it is dropped on every merge, so a process that loaded the cache
+earlier cannot bring an invalidated verdict back by saving, and ``get``
+re-reads the file whenever it has been replaced since it was last read,
+so such an entry is not served either.
+"""
+
+import atexit
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from config import BASE_DIR
+
+CACHE_FILE = Path(os.getenv("FIRMWARE_RESULT_CACHE") or BASE_DIR / ".firmware_results.json")
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_SAVE_EVERY = 32
+
+
+def cache_key(*parts) -> str:
+    """Return a stable key for JSON-serialisable key parts."""
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class ResultCache:
+    """LRU-bounded, file-backed map of cache keys to recorded results."""
+
+    def __init__(self, path=CACHE_FILE, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 save_every: int = DEFAULT_SAVE_EVERY):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._unsaved = 0
+        self._stamp = None
+        self._entries, self._invalidated = self._read()
+
+    @staticmethod
+    def _file_stamp(stat: os.stat_result) -> Tuple[int, int, int]:
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read(self) -> Tuple[Dict[str, Dict], Dict[str, int]]:
+        """Return the entries and invalidation times (tag, or ``None`` for all) on disk."""
+        try:
+            with open(self.path) as file:
+                self._stamp = self._file_stamp(os.fstat(file.fileno()))
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}, {}
+        if not isinstance(data, dict):
+            return {}, {}
+        if "entries" not in data:
+            # Caches written before invalidations were recorded
+            return data, {}
+        invalidated = {tag: when for tag, when in data.get("invalidated", [])}
+        return data["entries"], invalidated
+
+    @staticmethod
+    def _covered(entry: Dict, invalidated: Dict[Optional[str], int]) -> bool:
+        """Whether ``entry`` was stored before an invalidation that covers it."""
+        stored = entry.get("stored", entry["used"])
+        return stored <= max(invalidated.get(None, 0), invalidated.get(entry.get("tag"), 0))
+
+    def _refresh(self) -> None:
+        """Pick up entries and invalidations saved by others since the last read."""
+        try:
+            stamp = self._file_stamp(os.stat(self.path))
+        except OSError:
+            return
+        if stamp == self._stamp:
+            return
+        entries, invalidated = self._read()
+        for tag, when in invalidated.items():
+            self._invalidated[tag] = max(when, self._invalidated.get(tag, 0))
+        for key, entry in entries.items():
+            self._entries.setdefault(key, entry)
+        self._entries = {
+            key: entry for key, entry in self._entries.items()
+            if not self._covered(entry, self._invalidated)
+        }
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the recorded result for ``key``, or None on a miss."""
+        with self._lock:
+            self._refresh()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["used"] = time.time_ns()
+            self._dirty = True
+            return entry["value"]
+
+    def put(self, key: str, value: Any, tag: str = "") -> None:
+        """Record a result, saving the cache once ``save_every`` are unsaved.
+
+        Args:
+            key: Key from ``cache_key``.
+            value: JSON-serialisable result.
+            tag: Label for selective invalidation, e.g. the image digest.
+        """
+        now = time.time_ns()
+        with self._lock:
+            self._entries[key] = {"value": value, "tag": tag, "stored": now, "used": now}
+            self._dirty = True
+            self._unsaved += 1
+            if self._unsaved < self.save_every:
+                return
+        self.save()
+
+    def invalidate(self, tag: Optional[str] = None) -> int:
+        """Drop every entry, or those recorded with ``tag``, and save.
+
+        The invalidation is recorded on disk, so entries stored before it
+        stay dropped even when a process that still holds them saves.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        with self._lock:
+            self._invalidated[tag] = time.time_ns()
+            self._dirty = True
+        return self.save()
+
+    def save(self) -> int:
+        """Merge with the file on disk, evict LRU entries and write atomically.
+
+        Returns:
+            int: Number of entries dropped by recorded invalidations.
+        """
+        with self._lock:
+            if not self._dirty:
+                return 0
+            try:
+                with self._file_lock():
+                    return self._merge_and_write()
+            except OSError as e:
+                print(f"Warning: could not lock result cache - {str(e)}")
+                return 0
+
+    def _merge_and_write(self) -> int:
+        entries, invalidated = self._read()
+        for tag, when in self._invalidated.items():
+            invalidated[tag] = max(when, invalidated.get(tag, 0))
+        for key, entry in self._entries.items():
+            if key not in entries or entries[key]["used"] < entry["used"]:
+                entries[key] = entry
+        cleared = invalidated.get(None, 0)
+        merged = {
+            key: entry for key, entry in entries.items() if not self._covered(entry, invalidated)
+        }
+        dropped = len(entries) - len(merged)
+        if len(merged) > self.max_entries:
+            recent = sorted(merged, key=lambda key: merged[key]["used"])[-self.max_entries:]
+            merged = {key: merged[key] for key in recent}
+        # Tag invalidations older than clearing everything are redundant; the
+        # rest are bounded like the entries, oldest first
+        invalidated = {tag: when for tag, when in invalidated.items() if when >= cleared}
+        if len(invalidated) > self.max_entries:
+            invalidated = dict(sorted(invalidated.items(), key=lambda item: item[1])[-self.max_entries:])
+        data = {"entries": merged, "invalidated": [[tag, when] for tag, when in invalidated.items()]}
+        tmp = self.path.with_name(f".{self.path.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+        try:
+            with open(tmp, "w") as file:
+                json.dump(data, file, separators=(",", ":"))
+                file.flush()
+                stamp = self._file_stamp(os.fstat(file.fileno()))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Warning: could not save result cache - {str(e)}")
+            return dropped
+        self._entries = merged
+        self._invalidated = invalidated
+        self._stamp = stamp
+        self._dirty = False
+        self._unsaved = 0
+        return dropped
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Hold an exclusive lock on ``<cache>.lock`` across processes."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path.with_name(f"{self.path.name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_default: Optional[ResultCache] = None
+_default_lock = threading.Lock()
+
+
+def default_cache() -> ResultCache:
+    """Return the process-wide cache, loading it on first use."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = ResultCache()
+                atexit.register(_default.save)
+    return _default
+
@@ -0,0 +1,274 @@
+"""Streaming parser for Robot Framework output.xml files.
+
+Results are extracted in a single incremental pass: every element is
+detached from the tree as soon as it ends, so memory stays constant no
+matter how large the output file grows. The parser records a checkpoint
+(byte offset plus the still-open suite elements) after each completed
+test, which lets a caller resume later -- or tail an output file that is
+still being written by a running suite.
+"""
+
+import json
+from dataclasses import asdict, dataclass, field
+from datetime import date
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import XMLPullParser
+from xml.sax.saxutils import quoteattr
+
+from robot.api.deco import keyword
+
+_XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+_BLOCK_SIZE = 1024 * 1024
+
+# Elements holding a keyword call (RF 6 uses <kw type=...>, RF 7 adds these)
+_KEYWORD_TAGS = ("kw", "setup", "teardown")
+
+# Test tags of the form "req:<ID>" name the requirement a test verifies
+REQUIREMENT_TAG_PREFIX = "req:"
+
+
+@dataclass
+class KeywordResult:
+    """One keyword call inside a test."""
+
+    name: str
+    library: str
+    depth: int
+    status: str = "NOT RUN"
+    elapsed: float = 0.0
+
+
+@dataclass
+class TestResult:
+    """One executed test case."""
+
+    name: str
+    suite: str
+    status: str
+    elapsed: float
+    tags: List[str] = field(default_factory=list)
+    message: str = ""
+    keywords: List[KeywordResult] = field(default_factory=list)
+    # File of the suite the test is defined in, as recorded by Robot
+    source: str = ""
+
+    @property
+    def longname(self) -> str:
+        return f"{self.suite}.{self.name}" if self.suite else self.name
+
+    @property
+    def requirements(self) -> List[str]:
+        """Requirement IDs from ``req:<ID>`` tags."""
+        return [
+            tag[len(REQUIREMENT_TAG_PREFIX):] for tag in self.tags
+            if tag.lower().startswith(REQUIREMENT_TAG_PREFIX)
+        ]
+
+
+@dataclass
+class Checkpoint:
+    """Resume position: byte offset and the elements open at that offset."""
+
+    offset: int = 0
+    open_elements: List[Tuple[str, Dict[str, str]]] = field(default_factory=list)
+
+    def save(self, path) -> None:
+        with open(path, "w") as file:
+            json.dump(asdict(self), file)
+
+    @classmethod
+    def load(cls, path) -> "Checkpoint":
+        try:
+            with open(path) as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return cls()
+        return cls(data["offset"], [tuple(item) for item in data["open_elements"]])
+
+
+@lru_cache(maxsize=64)
+def _day_seconds(day: str) -> float:
+    return date(int(day[:4]), int(day[4:6]), int(day[6:8])).toordinal() * 86400.0
+
+
+def _rf6_seconds(timestamp: str) -> float:
+    """Seconds for an RF 6 timestamp ``YYYYMMDD HH:MM:SS.fff`` (no strptime)."""
+    return (
+        _day_seconds(timestamp[:8])
+        + int(timestamp[9:11]) * 3600 + int(timestamp[12:14]) * 60
+        + float(timestamp[15:])
+    )
+
+
+def status_elapsed(attrib: Dict[str, str]) -> float:
+    """Return the elapsed seconds of a ``<status>`` element (RF 6 or RF 7)."""
+    if "elapsed" in attrib:
+        return float(attrib["elapsed"])
+    start, end = attrib.get("starttime"), attrib.get("endtime")
+    if not start or not end or start == "N/A" or end == "N/A":
+        return 0.0
+    try:
+        return round(_rf6_seconds(end) - _rf6_seconds(start), 3)
+    except ValueError:
+        return 0.0
+
+
+class RobotOutputStream:
+    """Incremental reader of one output.xml file."""
+
+    def __init__(
+        self, xml_file, checkpoint: Optional[Checkpoint] = None, keywords: bool = False
+    ):
+        """Create a reader.
+
+        Args:
+            xml_file: Path of the output.xml file.
+            checkpoint: Position to resume from (default: start of file).
+            keywords: Also collect every keyword call into ``TestResult.keywords``.
+        """
+        self.path = xml_file
+        self.collect_keywords = keywords
+        self.checkpoint = checkpoint or Checkpoint()
+        self.statistics: Dict[str, int] = {}
+        self.suite_elapsed: Optional[float] = None
+        self.root_attrib: Dict[str, str] = {}
+        self.complete = False
+
+        self._position = self.checkpoint.offset
+        self._parser = XMLPullParser(events=("start", "end"))
+        self._stack: List = []
+        self._test: Optional[TestResult] = None
+        self._keywords: List[KeywordResult] = []
+        if self._position:
+            self._parser.feed(_XML_DECLARATION)
+            for tag, attrib in self.checkpoint.open_elements:
+                attrs = "".join(f" {k}={quoteattr(v)}" for k, v in attrib.items())
+                self._parser.feed(f"<{tag}{attrs}>".encode("utf-8"))
+            self._drain([])
+
+    def __iter__(self) -> Iterator[TestResult]:
+        """Yield every test completed so far, reading to the end of the file."""
+        results: List[TestResult] = []
+        with open(self.path, "rb") as file:
+            file.seek(self._position)
+            while block := file.read(_BLOCK_SIZE):
+                end = block.rfind(b"\n") + 1
+                if end == 0 and len(block) == _BLOCK_SIZE:
+                    # A single line longer than a block: no safe resume point
+                    self._feed(block, results, mark=False)
+                    continue
+                if end < len(block) and block[end:].strip() != b"</robot>":
+                    # Partial line: re-read it with the next block or poll
+                    file.seek(self._position + end)
+                    block = block[:end]
+                    if not block:
+                        break
+                # Split after the last test so the checkpoint lands exactly there
+                cut = block.rfind(b"</test>\n") + len(b"</test>\n")
+                for piece in (block[:cut], block[cut:]) if cut > 8 else (block,):
+                    if piece:
+                        self._feed(piece, results)
+                yield from results
+                results.clear()
+
+    def poll(self) -> List[TestResult]:
+        """Read newly written complete lines and return the tests they finish."""
+        return list(self)
+
+    def _feed(self, data: bytes, results: List[TestResult], mark: bool = True) -> None:
+        self._parser.feed(data)
+        self._position += len(data)
+        self._drain(results)
+        if mark and self._test is None:
+            self.checkpoint = Checkpoint(
+                self._position,
+                [(e.tag, dict(e.attrib)) for e in self._stack],
+            )
+
+    def _drain(self, results: List[TestResult]) -> None:
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                self._start(elem)
+            else:
+                self._end(elem, results)
+
+    def _start(self, elem) -> None:
+        self._stack.append(elem)
+        if elem.tag == "robot":
+            self.root_attrib = dict(elem.attrib)
+        elif elem.tag == "test":
+            suites = [e for e in self._stack if e.tag == "suite"]
+            self._test = TestResult(
+                name=elem.get("name", "unnamed_test"),
+                suite=".".join(e.get("name", "") for e in suites),
+                status="NOT RUN",
+                elapsed=0.0,
+                source=suites[-1].get("source", "") if suites else "",
+            )
+        elif elem.tag in _KEYWORD_TAGS and self._test is not None and self.collect_keywords:
+            self._keywords.append(KeywordResult(
+                name=elem.get("name", ""),
+                library=elem.get("library", elem.get("owner", "")),
+                depth=len(self._keywords),
+            ))
+
+    def _end(self, elem, results: List[TestResult]) -> None:
+        self._stack.pop()
+        parent = self._stack[-1] if self._stack else None
+        parent_tag = parent.tag if parent is not None else None
+
+        if elem.tag == "tag" and self._test is not None and parent_tag in ("test", "tags"):
+            self._test.tags.append(elem.text or "")
+        elif elem.tag == "status":
+            if parent_tag == "test" and self._test is not None:
+                self._test.status = elem.get("status", "NOT RUN")
+                self._test.elapsed = status_elapsed(elem.attrib)
+                self._test.message = (elem.text or "").strip()
+            elif parent_tag in _KEYWORD_TAGS and self._keywords:
+                self._keywords[-1].status = elem.get("status", "NOT RUN")
+                self._keywords[-1].elapsed = status_elapsed(elem.attrib)
+            elif parent_tag == "suite" and sum(e.tag == "suite" for e in self._stack) == 1:
+                self.suite_elapsed = status_elapsed(elem.attrib)
+        elif elem.tag == "stat" and parent_tag == "total":
+            self.statistics = {
+                key: int(elem.get(key, 0)) for key in ("pass", "fail", "skip")
+            }
+        elif elem.tag in _KEYWORD_TAGS and self._keywords:
+            self._test.keywords.append(self._keywords.pop())
+        elif elem.tag == "test" and self._test is not None:
+            results.append(self._test)
+            self._test = None
+        elif elem.tag == "robot":
+            self.complete = True
+
+        # Detach finished elements so the tree never grows
+        if parent is not None:
+            parent.remove(elem)
+
+
+def iter_test_results(
+    xml_file, checkpoint: Optional[Checkpoint] = None, keywords: bool = False
+) -> Iterator[TestResult]:
+    """Yield every test in an output.xml file in one streaming pass."""
+    yield from RobotOutputStream(xml_file, checkpoint, keywords)
+
+
+@keyword("Read New Test Results")
+def read_new_test_results(xml_file, checkpoint_file):
+    """Return the tests an output.xml finished since the last call.
+
+    The position is kept in ``checkpoint_file``, so an output file that is
+    still being written can be read again as it grows.
+
+    Returns:
+        list: ``suite.test`` names, in file order.
+    """
+    stream = RobotOutputStream(xml_file, Checkpoint.load(checkpoint_file))
+    names = [test.longname for test in stream]
+    stream.checkpoint.save(checkpoint_file)
+    return names
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
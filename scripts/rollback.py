@@ -1,18 +1,26 @@
 """Firmware rollback logic using backup image."""
 
-import shutil
 from config import BACKUP_FIRMWARE_PATH, DEVICE_FIRMWARE_PATH
-from influx_logger import log_event
+from influx_logger import logger
+from atomic_io import atomic_link
 
 
-def rollback():
-    """Restore backup firmware image to device."""
+def rollback(backup_path=BACKUP_FIRMWARE_PATH, device_path=DEVICE_FIRMWARE_PATH):
+    """Restore backup firmware image to device.
+
+    The backup is hard-linked and renamed over the device path, an O(1)
+    atomic operation that leaves the backup in place.
+
+    Args:
+        backup_path: Backup image to restore.
+        device_path: Installed image on the device.
+    """
     try:
-        shutil.copyfile(BACKUP_FIRMWARE_PATH, DEVICE_FIRMWARE_PATH)
-        log_event("firmware_rollback", {"status": "rolled_back"})
+        atomic_link(backup_path, device_path)
+        logger.log_event("firmware_rollback", {"status": "rolled_back"})
         print("Firmware rollback completed.")
     except Exception as e:
-        log_event("firmware_rollback", {"status": "failed", "error": str(e)})
+        logger.log_event("firmware_rollback", {"status": "failed", "error": str(e)})
         raise
 
 
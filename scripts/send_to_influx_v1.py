@@ -1,17 +1,43 @@
+import argparse
 import xml.etree.ElementTree as ET
 import requests
 import os
+import threading
 import time
+from concurrent.futures import Future, wait
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
+from robot.api.deco import keyword
+from line_protocol import InfluxBatchWriter, encode_point, pooled_session, post_with_retry
+from robot_results import Checkpoint, RobotOutputStream, TestResult
+from traceability import TESTS_DIR, TraceabilityMatrix
+
 
 class ResultSender:
-    def __init__(self):
+    def __init__(
+        self,
+        influx_url: Optional[str] = None,
+        grafana_url: Optional[str] = None,
+        grafana_api_key: Optional[str] = None,
+        tests_dir=TESTS_DIR,
+    ):
+        """Configure both sinks from the environment.
+
+        Args:
+            influx_url: InfluxDB base URL (default: ``INFLUXDB_HOST``/``PORT``).
+            grafana_url: Grafana base URL (default: ``GRAFANA_URL``).
+            grafana_api_key: Grafana token (default: ``GRAFANA_API_KEY``).
+            tests_dir: Robot suites the per-test requirement tags are
+                traced from.
+        """
         # Enhanced InfluxDB configuration with auth support
-        self.influx_url = (
+        influx_base = influx_url or (
             f"http://{os.getenv('INFLUXDB_HOST', 'localhost')}:"
-            f"{os.getenv('INFLUXDB_PORT', '8086')}/write?"
+            f"{os.getenv('INFLUXDB_PORT', '8086')}"
+        )
+        self.influx_url = (
+            f"{influx_base}/write?"
             f"db={os.getenv('INFLUXDB_DB', 'cpap_tests')}"
             f"&precision=ns"
         )
@@ -26,7 +52,7 @@ class ResultSender:
 
         # Grafana configuration with multiple key options
         self.grafana_url = (
-            f"{os.getenv('GRAFANA_URL', 'http://localhost:3000')}/api/annotations"
+            f"{grafana_url or os.getenv('GRAFANA_URL', 'http://localhost:3000')}/api/annotations"
         )
         self.headers = {
             "Content-Type": "application/json"
@@ -34,6 +60,7 @@ class ResultSender:
         
         # Check for API key in multiple possible environment variables
         grafana_api_key = (
+            grafana_api_key or
             os.getenv('GRAFANA_API_KEY') or 
             os.getenv('GRAFANA_TOKEN') or
             os.getenv('GRAFANA_ANNOTATION_KEY')
@@ -42,57 +69,94 @@ class ResultSender:
             self.headers["Authorization"] = f"Bearer {grafana_api_key}"
 
         self.timeout = int(os.getenv('REQUEST_TIMEOUT', '5'))
+        self.checkpoint: Optional[Checkpoint] = None
+        self.tests_dir = tests_dir
+        self._matrix: Optional[TraceabilityMatrix] = None
+        self._matrix_lock = threading.Lock()
+
+        # Pooled keep-alive sessions per sink; requests are retried here with
+        # jittered backoff (post_with_retry) rather than inside the session
+        self.batch_size = int(os.getenv('INFLUXDB_BATCH_SIZE', '5000'))
+        self.attempts = int(os.getenv('PUBLISH_ATTEMPTS', '4'))
+        self.session = pooled_session(retries=0, pool_size=8)
+        self.grafana_session = pooled_session(retries=0, pool_size=2)
+
+        # Offline agents keep summary history in a local store instead
+        self.store = None
+        store_dir = os.getenv('RESULTS_STORE_DIR')
+        if store_dir:
+            from timeseries_store import TimeSeriesStore
+            self.store = TimeSeriesStore(store_dir)
 
     def parse_results(
-        self, xml_file: str
+        self,
+        xml_file: str,
+        checkpoint: Optional[Checkpoint] = None,
+        tests: Optional[List[TestResult]] = None,
+        deadline: Optional[float] = None,
     ) -> Tuple[Optional[Dict], Optional[List[str]]]:
+        """Parse an output.xml in one streaming pass with constant memory.
+
+        Args:
+            xml_file: Robot Framework output file.
+            checkpoint: Resume position from a previous (partial) parse;
+                only tests after it are counted.
+            tests: If given, every test, with its keyword calls, is
+                appended to it, e.g. for ``send_test_metrics``; memory then
+                grows with the number of tests.
+            deadline: Absolute ``time.monotonic()`` time to give up at.
+
+        Returns:
+            Tuple: (metrics, failed test names), or (None, None) on error
+            or past the deadline. ``self.checkpoint`` holds the position to
+            resume from.
+        """
         try:
-            tree = ET.parse(xml_file)
-            root = tree.getroot()
+            stream = RobotOutputStream(xml_file, checkpoint, keywords=tests is not None)
+            metrics = {"total": 0, "passed": 0, "failed": 0, "skipped": 0}
+            failed_tests = []
+            for test in stream:
+                if deadline is not None and time.monotonic() >= deadline:
+                    print(f"Warning: parsing {xml_file} did not finish before the deadline")
+                    return None, None
+                if tests is not None:
+                    tests.append(test)
+                metrics["total"] += 1
+                if test.status == "PASS":
+                    metrics["passed"] += 1
+                elif test.status == "SKIP":
+                    metrics["skipped"] += 1
+                elif test.status == "FAIL":
+                    metrics["failed"] += 1
+                    failed_tests.append(test.name)
+                    # Log additional failure context
+                    print(f"Test failed: {test.name} - {test.message or 'no message'}")
+            self.checkpoint = stream.checkpoint
+
+            # Prefer the suite's own statistics once the file is complete
+            if stream.statistics and checkpoint is None:
+                metrics.update({
+                    "passed": stream.statistics["pass"],
+                    "failed": stream.statistics["fail"],
+                    "skipped": stream.statistics["skip"],
+                    "total": stream.statistics["pass"] + stream.statistics["fail"],
+                })
+            else:
+                metrics["total"] = metrics["passed"] + metrics["failed"]
 
             # Enhanced duration handling with debugging
-            elapsed_time_str = root.get("elapsedtime", "0")
+            elapsed_time_str = stream.root_attrib.get("elapsedtime")
             try:
-                elapsed_ms = float(elapsed_time_str)
-                # Convert to seconds with 3 decimal places
-                elapsed_sec = round(elapsed_ms / 1000, 3)
+                if elapsed_time_str is not None:
+                    elapsed_ms = float(elapsed_time_str)
+                else:
+                    elapsed_ms = (stream.suite_elapsed or 0.0) * 1000
             except (ValueError, TypeError) as e:
                 print(f"Error parsing elapsed time '{elapsed_time_str}': {str(e)}")
-                elapsed_sec = 0.0
-
-            metrics = {
-                "total": 0,
-                "passed": 0,
-                "failed": 0,
-                "elapsed": elapsed_sec,  # Now using precise decimal value
-                "elapsed_ms": elapsed_ms,  # Also store original ms value
-            }
-
-            # Enhanced stats parsing with error handling
-            total_stat = root.find("statistics/total/stat")
-            if total_stat is not None:
-                try:
-                    metrics.update({
-                        "passed": int(total_stat.get("pass", 0)),
-                        "failed": int(total_stat.get("fail", 0)),
-                        "total": (
-                            int(total_stat.get("pass", 0)) + 
-                            int(total_stat.get("fail", 0))
-                        ),
-                    })
-                except (ValueError, AttributeError) as e:
-                    print(f"Error parsing test statistics: {str(e)}")
-
-            # Get failed test names with additional context
-            failed_tests = []
-            for test in root.findall(".//test"):
-                status = test.find("status")
-                if status is not None and status.get("status") == "FAIL":
-                    test_name = test.get("name", "unnamed_test")
-                    failed_tests.append(test_name)
-                    # Log additional failure context
-                    failure_msg = status.text.strip() if status.text else "no message"
-                    print(f"Test failed: {test_name} - {failure_msg}")
+                elapsed_ms = 0.0
+            # Convert to seconds with 3 decimal places
+            metrics["elapsed"] = round(elapsed_ms / 1000, 3)
+            metrics["elapsed_ms"] = elapsed_ms
 
             # Debug output
             print(f"Parsed metrics: {metrics}")
@@ -104,12 +168,130 @@ class ResultSender:
             print(f"XML parsing error: {str(e)}")
             return None, None
 
-    def send_to_influx(self, metrics: Dict) -> bool:
+    def parse_many(
+        self,
+        xml_files: List[str],
+        tests: Optional[Dict[str, List[TestResult]]] = None,
+        deadline: Optional[float] = None,
+    ) -> Tuple[Optional[Dict], Optional[List[str]]]:
+        """Parse several output.xml files, e.g. the shards of one build.
+
+        Counts are summed; ``elapsed`` is the longest file's, since shards
+        run side by side. Files that fail to parse are skipped.
+
+        Args:
+            xml_files: Robot output files.
+            tests: If given, receives the tests of every parsed file, keyed
+                by file (see ``parse_results``).
+            deadline: Absolute ``time.monotonic()`` time to give up at.
+
+        Returns:
+            Tuple: (metrics, failed test names), or (None, None) if no file
+            could be parsed.
+        """
+        totals, failed = None, []
+        for xml_file in xml_files:
+            file_tests = None if tests is None else []
+            metrics, failed_tests = self.parse_results(xml_file, tests=file_tests,
+                                                       deadline=deadline)
+            if metrics is None:
+                continue
+            if tests is not None:
+                tests[xml_file] = file_tests
+            if totals is None:
+                totals = dict(metrics)
+            else:
+                for key in ("total", "passed", "failed", "skipped"):
+                    totals[key] += metrics[key]
+                totals["elapsed"] = max(totals["elapsed"], metrics["elapsed"])
+                totals["elapsed_ms"] = max(totals["elapsed_ms"], metrics["elapsed_ms"])
+            failed.extend(failed_tests)
+        return (totals, failed) if totals is not None else (None, None)
+
+    def publish(
+        self,
+        xml_files: List[str],
+        deadline: float = 30.0,
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> Dict:
+        """Publish results of one or more output.xml files to every sink at once.
+
+        Each file is parsed once; the run summary, the per-test points of
+        each file and the Grafana annotation are then sent concurrently,
+        each retried independently. No sink is waited for beyond
+        ``deadline``: senders run in daemon threads and stop sending points
+        once it passes, so a stalled sink never holds up the caller or
+        interpreter exit.
+
+        Args:
+            xml_files: Robot output files.
+            deadline: Seconds allowed for the whole publish.
+            checkpoint: Resume position; only used with a single file.
+
+        Returns:
+            Dict: ``metrics``, per-sink success in ``sinks`` (a sink still
+            running at the deadline counts as failed) and ``seconds``.
+        """
+        start = time.monotonic()
+        until = start + deadline
+        tests: Dict[str, List[TestResult]] = {}
+        if checkpoint is not None and len(xml_files) == 1:
+            tests[xml_files[0]] = []
+            metrics, failed_tests = self.parse_results(
+                xml_files[0], checkpoint, tests[xml_files[0]], until
+            )
+        else:
+            metrics, failed_tests = self.parse_many(xml_files, tests, until)
+        if not metrics:
+            return {"metrics": None, "sinks": {}, "seconds": time.monotonic() - start}
+
+        status = "SUCCESS" if metrics["failed"] == 0 else "FAILURE"
+        tasks = {
+            "influx": (self.send_to_influx, metrics),
+            "grafana": (self.send_to_grafana, status,
+                        failed_tests if status == "FAILURE" else None),
+            **{f"influx_tests:{xml_file}": (self.send_test_metrics, xml_file, None, tests[xml_file])
+               for xml_file in xml_files if xml_file in tests},
+        }
+        futures = {}
+        for name, (function, *args) in tasks.items():
+            future = Future()
+            threading.Thread(
+                target=_run_task, args=(future, function, args, until),
+                name=f"publish-{name}", daemon=True,
+            ).start()
+            futures[future] = name
+        done, _ = wait(futures, timeout=max(0.0, until - time.monotonic()))
+
+        sinks = {f"influx_tests:{xml_file}": False for xml_file in xml_files if xml_file not in tests}
+        for future, name in futures.items():
+            if future not in done:
+                print(f"Warning: {name} did not finish within {deadline}s")
+                sinks[name] = False
+            elif future.exception() is not None:
+                print(f"Warning: {name} failed - {future.exception()}")
+                sinks[name] = False
+            else:
+                sinks[name] = bool(future.result())
+        return {"metrics": metrics, "sinks": sinks, "seconds": time.monotonic() - start}
+
+    def send_to_influx(self, metrics: Dict, deadline: Optional[float] = None) -> bool:
         if not metrics or metrics.get("total", 0) == 0:
             print("No valid metrics to send")
             return False
 
         timestamp = int(time.time() * 1e9)
+
+        if self.store is not None:
+            self.store.write_points([{
+                "measurement": "robot_tests",
+                "time": timestamp,
+                "tags": {"device_type": "CPAP"},
+                "fields": {key: metrics[key] for key in
+                           ("passed", "failed", "total", "elapsed", "elapsed_ms")},
+            }])
+            print(f"Stored test metrics in {self.store.root}")
+            return True
         
         # Enhanced InfluxDB line protocol with additional fields
         data = (
@@ -123,10 +305,13 @@ class ResultSender:
         print(f"Sending to InfluxDB: {data}")
 
         try:
-            response = requests.post(
+            response = post_with_retry(
+                self.session,
                 self.influx_url,
-                data=data,
+                attempts=self.attempts,
+                deadline=deadline,
                 timeout=self.timeout,
+                data=data,
                 auth=self.influx_auth
             )
             if response.status_code == 204:
@@ -138,7 +323,114 @@ class ResultSender:
 
         return False
 
-    def send_to_grafana(self, status: str, failed_tests: List[str] = None) -> bool:
+    def send_test_metrics(
+        self, xml_file: str, checkpoint: Optional[Checkpoint] = None,
+        tests: Optional[List[TestResult]] = None, deadline: Optional[float] = None,
+    ) -> bool:
+        """Send one point per test and per keyword call from an output.xml.
+
+        Points go to the ``robot_test`` and ``robot_keyword`` measurements,
+        tagged with suite, test, status and the requirements the test
+        traces to, and are posted as gzip-compressed line protocol in
+        ``INFLUXDB_BATCH_SIZE`` chunks over a pooled session. The build
+        number is a field: as a tag every build would add new series.
+
+        Args:
+            xml_file: Robot output file.
+            checkpoint: Resume position; only tests after it are sent.
+            tests: Tests already parsed from ``xml_file`` (with keywords),
+                sent instead of parsing the file again.
+            deadline: Absolute ``time.monotonic()`` time after which no
+                more points are sent.
+
+        Returns:
+            bool: True if every batch was accepted before the deadline.
+        """
+        writer = InfluxBatchWriter(
+            self.influx_url,
+            auth=self.influx_auth,
+            batch_size=self.batch_size,
+            timeout=self.timeout,
+            session=self.session,
+            attempts=self.attempts,
+            deadline=deadline,
+        )
+        build = os.getenv('BUILD_NUMBER') or None
+        base_ns = int(time.time() * 1e9)
+        matrix = self.traceability()
+
+        def requirements(test):
+            # Tests outside the scanned suites still carry their req: tags
+            test_id = matrix.test_id_for_result(test.suite, test.name, test.source)
+            if test_id is None:
+                return test.requirements
+            return matrix.get_requirements_for_test(test_id)
+
+        expired = False
+
+        def lines():
+            nonlocal expired
+            # Distinct timestamps keep repeated calls from overwriting each other
+            sequence = 0
+            results = tests if tests is not None else RobotOutputStream(
+                xml_file, checkpoint, keywords=True
+            )
+            for test in results:
+                if deadline is not None and time.monotonic() >= deadline:
+                    expired = True
+                    return
+                common = {
+                    "device_type": "CPAP",
+                    "suite": test.suite,
+                    "test": test.name,
+                    "requirement": ",".join(requirements(test)),
+                }
+                yield encode_point(
+                    "robot_test",
+                    {**common, "status": test.status},
+                    {
+                        "build": build,
+                        "duration": test.elapsed,
+                        "passed": int(test.status == "PASS"),
+                        "tags": ",".join(test.tags),
+                        "message": test.message[:200] or None,
+                    },
+                    base_ns + sequence,
+                )
+                sequence += 1
+                for kw in test.keywords:
+                    yield encode_point(
+                        "robot_keyword",
+                        {**common, "keyword": kw.name, "library": kw.library,
+                         "status": kw.status},
+                        {"build": build, "duration": kw.elapsed, "depth": kw.depth},
+                        base_ns + sequence,
+                    )
+                    sequence += 1
+
+        try:
+            ok = writer.write(lines())
+        except (ET.ParseError, FileNotFoundError) as e:
+            print(f"XML parsing error: {str(e)}")
+            return False
+        print(
+            f"Sent {writer.lines_written} test/keyword points to InfluxDB "
+            f"in {writer.requests_sent} requests"
+        )
+        if expired:
+            print(f"Warning: per-test points of {xml_file} stopped at the deadline")
+        return ok and not expired
+
+    def traceability(self) -> TraceabilityMatrix:
+        """Return the traceability matrix, built once for every publishing thread."""
+        with self._matrix_lock:
+            if self._matrix is None:
+                self._matrix = TraceabilityMatrix(self.tests_dir)
+            return self._matrix
+
+    def send_to_grafana(
+        self, status: str, failed_tests: List[str] = None, deadline: Optional[float] = None
+    ) -> bool:
         if "Authorization" not in self.headers:
             print("Grafana API token not found. Set GRAFANA_API_KEY or GRAFANA_TOKEN environment variable")
             return False
@@ -170,11 +462,14 @@ class ResultSender:
         print(f"Sending to Grafana: {data}")
 
         try:
-            res = requests.post(
+            res = post_with_retry(
+                self.grafana_session,
                 self.grafana_url,
+                attempts=self.attempts,
+                deadline=deadline,
+                timeout=self.timeout,
                 json=data,
-                headers=self.headers,
-                timeout=self.timeout
+                headers=self.headers
             )
             res.raise_for_status()
             print(f"Successfully created Grafana annotation (ID: {res.json().get('id', 'unknown')})")
@@ -187,39 +482,89 @@ class ResultSender:
         return False
 
 
+def _run_task(future: Future, function, args, deadline: float) -> None:
+    """Run one publishing task in a daemon thread and settle its future."""
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(function(*args, deadline=deadline))
+    except BaseException as e:
+        future.set_exception(e)
+
+
+@keyword("Publish Test Results")
+def publish_test_results(*xml_files, influx_url=None, grafana_url=None,
+                         grafana_api_key=None, deadline=30):
+    """Publish output.xml results to InfluxDB and Grafana concurrently.
+
+    Args:
+        *xml_files: Robot output files, e.g. every shard of a build.
+        influx_url: InfluxDB base URL (default: from the environment).
+        grafana_url: Grafana base URL (default: from the environment).
+        grafana_api_key: Grafana token (default: from the environment).
+        deadline: Seconds allowed for the whole publish.
+
+    Returns:
+        dict: ``metrics``, per-sink success in ``sinks`` and ``seconds``.
+    """
+    sender = ResultSender(influx_url, grafana_url, grafana_api_key)
+    return sender.publish(list(xml_files), float(deadline))
+
+
+@keyword("Send Test Metrics")
+def send_test_metrics(xml_file, influx_url=None, batch_size=None, tests_dir=TESTS_DIR):
+    """Send the per-test and per-keyword points of an output.xml to InfluxDB.
+
+    Returns:
+        bool: True if every batch was accepted.
+    """
+    sender = ResultSender(influx_url, tests_dir=tests_dir)
+    if batch_size is not None:
+        sender.batch_size = int(batch_size)
+    return sender.send_test_metrics(xml_file)
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish Robot results to InfluxDB and Grafana")
+    parser.add_argument("xml_files", nargs="*",
+                        help="Robot output files (default: TEST_RESULTS_XML or output.xml)")
+    parser.add_argument("--deadline", type=float, default=float(os.getenv('PUBLISH_DEADLINE', '30')),
+                        help="Seconds allowed for publishing to every sink")
+    args = parser.parse_args()
+
     print("Starting CPAP test results processing")
     
     sender = ResultSender()
     
-    # Allow custom XML file path but default to output.xml
-    xml_file = os.getenv('TEST_RESULTS_XML', 'output.xml')
-    print(f"Processing test results from: {xml_file}")
+    # Allow custom XML file paths but default to output.xml
+    xml_files = args.xml_files or [os.getenv('TEST_RESULTS_XML', 'output.xml')]
+    print(f"Processing test results from: {', '.join(xml_files)}")
     
-    metrics, failed_tests = sender.parse_results(xml_file)
+    # Optional checkpoint file: publish only tests finished since the last run,
+    # so a suite's output can be tailed while it is still executing
+    checkpoint_file = os.getenv('TEST_RESULTS_CHECKPOINT') if len(xml_files) == 1 else None
+    checkpoint = Checkpoint.load(checkpoint_file) if checkpoint_file else None
+
+    report = sender.publish(xml_files, args.deadline, checkpoint)
+    if checkpoint_file and sender.checkpoint is not None:
+        sender.checkpoint.save(checkpoint_file)
 
+    metrics = report["metrics"]
     if metrics:
         print(f"\nTest Results Summary:")
         print(f"Passed: {metrics['passed']}")
         print(f"Failed: {metrics['failed']}")
         print(f"Total: {metrics['total']}")
         print(f"Duration: {metrics['elapsed']:.3f} seconds")
-        
-        # Send to InfluxDB
-        print("\nSending metrics to InfluxDB...")
-        if sender.send_to_influx(metrics):
-            print("InfluxDB update successful")
-        else:
-            print("Warning: Failed to update InfluxDB")
 
-        # Determine status and send to Grafana
-        status = "SUCCESS" if metrics["failed"] == 0 else "FAILURE"
-        print(f"\nSending {status} status to Grafana...")
-        if sender.send_to_grafana(status, failed_tests if status == "FAILURE" else None):
-            print("Grafana update successful")
-        else:
-            print("Warning: Failed to update Grafana")
+        print(f"\nPublished in {report['seconds']:.2f}s:")
+        for sink, ok in report["sinks"].items():
+            print(f"  {sink}: {'ok' if ok else 'FAILED'}")
     else:
         print("Error: No valid test results to process")
 
-    print("\nProcessing complete")
\ No newline at end of file
+    print("\nProcessing complete")
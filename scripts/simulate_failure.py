@@ -4,10 +4,24 @@ import os
 from config import NEW_FIRMWARE_PATH, DEVICE_FIRMWARE_PATH
 
 
-def simulate_partial_copy():
-    """Copy only part of the firmware to simulate a failed update."""
-    with open(NEW_FIRMWARE_PATH, 'rb') as src, open(DEVICE_FIRMWARE_PATH, 'wb') as dst:
-        dst.write(src.read(1024 * 10))  # Simulate 10KB write
+def simulate_partial_copy(
+    new_path=NEW_FIRMWARE_PATH,
+    device_path=DEVICE_FIRMWARE_PATH,
+    written_bytes=1024 * 10,
+):
+    """Copy only part of the firmware to simulate a failed update.
+
+    Args:
+        new_path: Image being installed.
+        device_path: Installed image that gets truncated.
+        written_bytes: Bytes written before the simulated power loss.
+    """
+    # The installed image may share its inode with the backup; detach it
+    # first so the torn write cannot reach the backup
+    if os.path.exists(device_path):
+        os.unlink(device_path)
+    with open(new_path, 'rb') as src, open(device_path, 'wb') as dst:
+        dst.write(src.read(written_bytes))  # Simulate 10KB write by default
     print("Partial firmware update simulated (power failure).")
 
 
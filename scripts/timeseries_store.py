@@ -0,0 +1,440 @@
+"""Local columnar time-series store for audit events.
+
+A drop-in for ``InfluxDBClient.write_points`` on agents without InfluxDB:
+points are kept on disk per measurement, partitioned by UTC day, as
+immutable segments with one ``.npy`` file per column. Each measurement has
+an index of its segments with their min/max timestamps, so a range query
+only opens the segments that overlap it and, inside a segment (rows are
+time-sorted), only the rows in range via a binary search.
+
+Layout under the store root::
+
+    <measurement>/index.json                   segments with min/max time
+    <measurement>/<YYYYMMDD>/seg-<n>/time.npy   int64 nanoseconds
+    <measurement>/<YYYYMMDD>/seg-<n>/f.<col>.npy    float64 (NaN = missing)
+    <measurement>/<YYYYMMDD>/seg-<n>/s.<col>.npy    int32 codes (-1 = missing)
+    <measurement>/<YYYYMMDD>/seg-<n>/s.<col>.json   code -> string
+
+Tags and fields share one column namespace. Numeric and boolean values
+are stored as floats, anything else as dictionary-encoded strings.
+Segments are compacted in size tiers: once ``compact_after`` segments of
+one tier accumulate in a partition they are merged into one segment of
+the next tier, so each row is rewritten a logarithmic number of times.
+
+Any number of processes may write and query a store (parallel shards
+share ``AUDIT_STORE_DIR``): each measurement's ``index.lock`` is held
+exclusively while a writer updates the index and its segments, and
+shared while a query reads them.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from robot.api.deco import keyword
+
+_NS_PER_DAY = 86_400 * 10**9
+_INDEX_FILE = "index.json"
+_LOCK_FILE = "index.lock"
+
+
+def to_ns(value) -> int:
+    """Convert an int (ns), ISO string or datetime to UTC epoch nanoseconds.
+
+    Naive datetimes and strings are taken as UTC, as ``datetime.utcnow()``
+    timestamps are.
+    """
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        delta = value - datetime(1970, 1, 1, tzinfo=timezone.utc)
+        return (delta.days * 86_400 + delta.seconds) * 10**9 + delta.microseconds * 1000
+    raise TypeError(f"Unsupported timestamp: {value!r}")
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, bool, np.number))
+
+
+def _is_missing(value) -> bool:
+    return value is None or (isinstance(value, float) and value != value)
+
+
+class TimeSeriesStore:
+    """Append-only columnar store with range queries and windowed aggregates."""
+
+    def __init__(self, root, compact_after: int = 32, segment_rows: int = 1_000_000):
+        """Open (or create) a store.
+
+        Args:
+            root: Store directory.
+            compact_after: Number of segments of one tier in a partition
+                that triggers merging them into a segment of the next tier.
+            segment_rows: Segments with at least this many rows count as
+                full and are never merged again.
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.compact_after = compact_after
+        self.segment_rows = segment_rows
+        self._lock = threading.Lock()
+        # measurement -> ((index file inode, mtime_ns), index)
+        self._indexes: Dict[str, tuple] = {}
+
+    # -- writing ---------------------------------------------------------
+
+    def write_points(self, points: List[Dict[str, Any]]) -> bool:
+        """Store points shaped like ``InfluxDBClient.write_points`` input.
+
+        Each point is a dict with ``measurement``, ``time`` (ns int, ISO
+        string or datetime; default now), ``tags`` and ``fields``.
+
+        Returns:
+            bool: True, as the InfluxDB client does.
+        """
+        groups: Dict[tuple, List[tuple]] = {}
+        now = None
+        for point in points:
+            if point.get("time") is None:
+                now = now or to_ns(datetime.now(timezone.utc))
+                timestamp = now
+            else:
+                timestamp = to_ns(point["time"])
+            values = {**point.get("tags", {}), **point.get("fields", {})}
+            key = (point["measurement"], timestamp // _NS_PER_DAY)
+            groups.setdefault(key, []).append((timestamp, values))
+
+        with self._lock:
+            for (measurement, day), rows in groups.items():
+                rows.sort(key=lambda row: row[0])
+                times = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+                columns = _encode_columns([row[1] for row in rows])
+                partition = _partition_name(day)
+                with self._index_lock(measurement, fcntl.LOCK_EX):
+                    # Another process may have written since; never trust the cache here
+                    index = self._index(measurement, fresh=True)
+                    path = self._write_segment(measurement, partition, index, times, columns)
+                    index["segments"].append({
+                        "path": path, "partition": partition, "rows": len(rows),
+                        "min": int(times[0]), "max": int(times[-1]), "level": 0,
+                    })
+                    self._maybe_compact(measurement, partition, index)
+                    self._save_index(measurement, index)
+        return True
+
+    @contextlib.contextmanager
+    def _index_lock(self, measurement: str, mode: int):
+        """Hold ``measurement``'s index lock (``fcntl.LOCK_EX`` or ``LOCK_SH``)."""
+        directory = self.root / measurement
+        directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(directory / _LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, mode)
+            yield
+        finally:
+            os.close(fd)
+
+    def _write_segment(self, measurement: str, partition: str, index: Dict,
+                       times: np.ndarray, columns: Dict[str, tuple]) -> str:
+        index["next"] += 1
+        relative = f"{partition}/seg-{index['next']:06d}"
+        final = self.root / measurement / relative
+        tmp = final.with_name(f"{final.name}.tmp-{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        np.save(tmp / "time.npy", times)
+        for name, (kind, data, dictionary) in columns.items():
+            np.save(tmp / f"{kind}.{name}.npy", data)
+            if dictionary is not None:
+                with open(tmp / f"s.{name}.json", "w") as file:
+                    json.dump(dictionary, file)
+        os.replace(tmp, final)
+        return relative
+
+    def _maybe_compact(self, measurement: str, partition: str, index: Dict) -> None:
+        """Merge full tiers of the partition, cascading to higher tiers."""
+        level = 0
+        while True:
+            tier = [
+                segment for segment in index["segments"]
+                if segment["partition"] == partition and segment.get("level", 0) == level
+                and segment["rows"] < self.segment_rows
+            ]
+            if len(tier) < self.compact_after:
+                return
+            level += 1
+            self._merge(measurement, partition, index, tier, level)
+
+    def _merge(self, measurement: str, partition: str, index: Dict,
+               small: List[Dict], level: int) -> None:
+        frames = [self._read_segment(measurement, segment) for segment in small]
+        times = np.concatenate([frame["time"] for frame in frames])
+        order = np.argsort(times, kind="stable")
+        names = {name for frame in frames for name in frame if name != "time"}
+        columns: Dict[str, tuple] = {}
+        for name in names:
+            parts = [_column_or_missing(frame, name, len(frame["time"])) for frame in frames]
+            if all(part.dtype.kind == "f" for part in parts):
+                columns[name] = ("f", np.concatenate(parts)[order], None)
+            else:
+                merged = np.concatenate([part.astype(object) for part in parts])[order]
+                columns[name] = _encode_strings(merged)
+
+        path = self._write_segment(measurement, partition, index, times[order], columns)
+        merged_paths = {segment["path"] for segment in small}
+        index["segments"] = [s for s in index["segments"] if s["path"] not in merged_paths]
+        index["segments"].append({
+            "path": path, "partition": partition, "rows": int(len(times)),
+            "min": int(times.min()), "max": int(times.max()), "level": level,
+        })
+        # Old segments are removed only after the index no longer names them
+        self._save_index(measurement, index)
+        for old in merged_paths:
+            shutil.rmtree(self.root / measurement / old, ignore_errors=True)
+
+    # -- index -----------------------------------------------------------
+
+    def _index(self, measurement: str, fresh: bool = False) -> Dict:
+        path = self.root / measurement / _INDEX_FILE
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return {"segments": [], "next": 0}
+        # Every save replaces the file, so a new inode means a new index
+        version = (stat.st_ino, stat.st_mtime_ns)
+        cached = self._indexes.get(measurement)
+        if fresh or cached is None or cached[0] != version:
+            with open(path) as file:
+                cached = (version, json.load(file))
+            self._indexes[measurement] = cached
+        return cached[1]
+
+    def _save_index(self, measurement: str, index: Dict) -> None:
+        path = self.root / measurement / _INDEX_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{_INDEX_FILE}.tmp-{os.getpid()}")
+        with open(tmp, "w") as file:
+            json.dump(index, file)
+        os.replace(tmp, path)
+        stat = path.stat()
+        self._indexes[measurement] = ((stat.st_ino, stat.st_mtime_ns), index)
+
+    def measurements(self) -> List[str]:
+        """Return the stored measurement names."""
+        return sorted(p.parent.name for p in self.root.glob(f"*/{_INDEX_FILE}"))
+
+    def time_range(self, measurement: str) -> Optional[tuple]:
+        """Return ``(first, last)`` timestamps in ns, from the index alone."""
+        with self._index_lock(measurement, fcntl.LOCK_SH):
+            segments = self._index(measurement)["segments"]
+        if not segments:
+            return None
+        return min(s["min"] for s in segments), max(s["max"] for s in segments)
+
+    # -- reading ---------------------------------------------------------
+
+    def _read_segment(self, measurement: str, segment: Dict,
+                      columns: Optional[Iterable[str]] = None,
+                      start: Optional[int] = None, end: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Load a segment's rows in ``[start, end)`` (memory-mapped columns)."""
+        directory = self.root / measurement / segment["path"]
+        times = np.load(directory / "time.npy", mmap_mode="r")
+        lo = 0 if start is None else int(np.searchsorted(times, start, "left"))
+        hi = len(times) if end is None else int(np.searchsorted(times, end, "left"))
+        frame = {"time": np.array(times[lo:hi])}
+        if columns is None:
+            columns = {p.name.split(".", 1)[1][:-4] for p in directory.glob("[fs].*.npy")}
+        for name in columns:
+            numeric = directory / f"f.{name}.npy"
+            if numeric.exists():
+                frame[name] = np.array(np.load(numeric, mmap_mode="r")[lo:hi])
+                continue
+            codes_path = directory / f"s.{name}.npy"
+            if codes_path.exists():
+                with open(directory / f"s.{name}.json") as file:
+                    dictionary = np.array(json.load(file) + [None], dtype=object)
+                # Code -1 indexes the trailing None
+                frame[name] = dictionary[np.load(codes_path, mmap_mode="r")[lo:hi]]
+        return frame
+
+    def _frames(self, measurement: str, start, end, columns, where):
+        start = None if start is None else to_ns(start)
+        end = None if end is None else to_ns(end)
+        wanted = set(columns or []) | set(where or {})
+        # Shared lock: no compaction removes a segment while it is read
+        with self._index_lock(measurement, fcntl.LOCK_SH):
+            yield from self._locked_frames(measurement, start, end, columns, where, wanted)
+
+    def _locked_frames(self, measurement, start, end, columns, where, wanted):
+        for segment in self._index(measurement)["segments"]:
+            if (start is not None and segment["max"] < start) or \
+                    (end is not None and segment["min"] >= end):
+                continue
+            frame = self._read_segment(
+                measurement, segment, wanted if columns is not None else None, start, end
+            )
+            if where:
+                mask = np.ones(len(frame["time"]), dtype=bool)
+                for name, value in where.items():
+                    column = frame.get(name)
+                    if column is None:
+                        mask[:] = False
+                    elif column.dtype.kind == "f" and _is_number(value):
+                        mask &= column == float(value)
+                    else:
+                        mask &= column == value
+                frame = {name: column[mask] for name, column in frame.items()}
+            if len(frame["time"]):
+                yield frame
+
+    def query(self, measurement: str, start=None, end=None,
+              columns: Optional[List[str]] = None,
+              where: Optional[Dict[str, Any]] = None) -> Dict[str, np.ndarray]:
+        """Return the rows of ``measurement`` with ``start <= time < end``.
+
+        Args:
+            measurement: Measurement name.
+            start: Range start (ns, ISO string or datetime); None = unbounded.
+            end: Range end, exclusive; None = unbounded.
+            columns: Columns to return besides ``time`` (default: all).
+            where: Equality filters on tags or fields.
+
+        Returns:
+            Dict[str, np.ndarray]: ``time`` plus one array per column,
+            sorted by time. Missing values are NaN or None.
+        """
+        frames = list(self._frames(measurement, start, end, columns, where))
+        if not frames:
+            return {"time": np.empty(0, dtype=np.int64)}
+        names = set(columns) if columns is not None else {n for f in frames for n in f}
+        names.discard("time")
+        times = np.concatenate([frame["time"] for frame in frames])
+        order = np.argsort(times, kind="stable")
+        result = {"time": times[order]}
+        for name in names:
+            parts = [_column_or_missing(frame, name, len(frame["time"])) for frame in frames]
+            if not all(part.dtype.kind == "f" for part in parts):
+                parts = [part.astype(object) for part in parts]
+            result[name] = np.concatenate(parts)[order]
+        return result
+
+    def aggregate(self, measurement: str, field: Optional[str] = None,
+                  every: float = 3600.0, start=None, end=None,
+                  where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Count, mean and max of ``field`` per time window.
+
+        Args:
+            measurement: Measurement name.
+            field: Numeric column to aggregate; None counts rows only.
+            every: Window length in seconds. Windows are aligned to ``start``
+                when given, otherwise to multiples of ``every`` since the epoch.
+            start: Range start; None = unbounded.
+            end: Range end, exclusive; None = unbounded.
+            where: Equality filters on tags or fields.
+
+        Returns:
+            List[Dict]: One entry per non-empty window, oldest first, with
+            ``time`` (window start, ns), ``count`` and, for a field,
+            ``mean`` and ``max`` over the rows where it is set.
+        """
+        width = int(every * 1e9)
+        origin = 0 if start is None else to_ns(start)
+        columns = [field] if field else []
+        bins_parts, value_parts = [], []
+        for frame in self._frames(measurement, start, end, columns, where):
+            bins = (frame["time"] - origin) // width
+            if field:
+                values = frame.get(field)
+                if values is None or values.dtype.kind != "f":
+                    continue
+                present = ~np.isnan(values)
+                bins, values = bins[present], values[present]
+                value_parts.append(values)
+            bins_parts.append(bins)
+        if not bins_parts or not sum(len(b) for b in bins_parts):
+            return []
+
+        bins = np.concatenate(bins_parts)
+        order = np.argsort(bins, kind="stable")
+        bins = bins[order]
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        counts = np.diff(np.r_[starts, len(bins)])
+        windows = [
+            {"time": origin + int(b) * width, "count": int(c)}
+            for b, c in zip(bins[starts], counts)
+        ]
+        if field:
+            values = np.concatenate(value_parts)[order]
+            sums = np.add.reduceat(values, starts)
+            maxima = np.maximum.reduceat(values, starts)
+            for window, total, count, peak in zip(windows, sums, counts, maxima):
+                window["mean"] = float(total / count)
+                window["max"] = float(peak)
+        return windows
+
+
+def _partition_name(day: int) -> str:
+    return datetime.fromtimestamp(day * 86_400, tz=timezone.utc).strftime("%Y%m%d")
+
+
+def _encode_strings(values) -> tuple:
+    dictionary: Dict[str, int] = {}
+    codes = np.full(len(values), -1, dtype=np.int32)
+    for row, value in enumerate(values):
+        if not _is_missing(value):
+            codes[row] = dictionary.setdefault(str(value), len(dictionary))
+    return ("s", codes, list(dictionary))
+
+
+def _encode_columns(rows: List[Dict[str, Any]]) -> Dict[str, tuple]:
+    """Encode row dicts into ``name -> (kind, data, dictionary)`` columns."""
+    names = {name for row in rows for name in row}
+    columns = {}
+    for name in names:
+        values = [row.get(name) for row in rows]
+        if all(value is None or _is_number(value) for value in values):
+            columns[name] = ("f", np.array(
+                [np.nan if value is None else float(value) for value in values], dtype=np.float64
+            ), None)
+        else:
+            columns[name] = _encode_strings(values)
+    return columns
+
+
+def _column_or_missing(frame: Dict[str, np.ndarray], name: str, rows: int) -> np.ndarray:
+    column = frame.get(name)
+    if column is None:
+        return np.full(rows, np.nan)
+    return column
+
+
+@keyword("Append Audit Event To Store")
+def append_audit_event_to_store(store_dir, event_type, **metadata):
+    """Write one audit event to the local store in ``store_dir``."""
+    TimeSeriesStore(store_dir).write_points([{
+        "measurement": "device_events",
+        "tags": {"device_type": "CPAP", "firmware_version": metadata.get("version", "unknown")},
+        "fields": {"event_type": event_type, **metadata},
+    }])
+
+
+@keyword("Aggregate Audit Events")
+def aggregate_audit_events(store_dir, field=None, every=3600, event_type=None):
+    """Return per-window count (and mean/max of ``field``) of stored audit events."""
+    where = {"event_type": event_type} if event_type else None
+    return TimeSeriesStore(store_dir).aggregate("device_events", field, float(every), where=where)
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
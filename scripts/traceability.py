@@ -1,44 +1,179 @@
-"""Traceability matrix for regulatory compliance."""
+"""Traceability matrix for regulatory compliance.
 
-from dataclasses import dataclass
-from typing import Dict, List
+The matrix is built from the Robot suites themselves. A test verifies:
+
+* every requirement named by a ``req:<ID>`` tag, and
+* every standard clause cited in its documentation or its suite's
+  documentation, e.g. ``(IEC 62304 5.7)`` or
+  ``(ISO 80601-2-70 Section 201.12)``. A cited clause with no ``req:`` tag
+  on the test becomes a requirement of its own (``IEC_62304_5.7``).
+
+Clause descriptions come from ``REGULATORY_MAPPING.md``. Parsed suites are
+cached in ``.traceability_index.json`` next to them, keyed by file size
+and mtime, so only edited suites are parsed again.
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from robot.api import TestSuiteBuilder
+from robot.api.deco import keyword
+from robot_results import REQUIREMENT_TAG_PREFIX, iter_test_results
+
+_REPO_DIR = Path(__file__).resolve().parent.parent
+TESTS_DIR = _REPO_DIR / "tests"
+REGULATORY_MAPPING = _REPO_DIR / "REGULATORY_MAPPING.md"
+INDEX_FILE = ".traceability_index.json"
+
+_CITATION = re.compile(r"\b(IEC|ISO)\s+(\d+(?:-\d+)*)\s+(?:Section\s+)?(\d+(?:\.\d+)+)")
+_MAPPING_HEADING = re.compile(r"^##\s+(.+?)\s*$")
+_MAPPING_ENTRY = re.compile(r"^-\s+\*\*(?:Section\s+)?(.+?)\*\*:\s*(.+?)(?:\s+-\s+Covered by.*)?$")
 
 
 @dataclass
 class Requirement:
     """Represents a regulatory requirement and associated test cases."""
-    
+
     id: str
     description: str
     test_cases: List[str]
+    clauses: List[str] = field(default_factory=list)
+
+
+def clause_requirement_id(clause: str) -> str:
+    """Return the requirement ID of a clause: ``IEC 62304 5.7`` -> ``IEC_62304_5.7``."""
+    return clause.replace("-", "_").replace(" ", "_")
+
+
+def cited_clauses(text: str) -> List[str]:
+    """Return the standard clauses cited in documentation text."""
+    return [f"{org} {standard} {clause}" for org, standard, clause in _CITATION.findall(text or "")]
+
+
+def load_clause_descriptions(path=REGULATORY_MAPPING) -> Dict[str, str]:
+    """Read ``clause -> description`` from the regulatory mapping document."""
+    descriptions: Dict[str, str] = {}
+    standard = ""
+    try:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                heading = _MAPPING_HEADING.match(line)
+                if heading:
+                    standard = heading.group(1)
+                    continue
+                entry = _MAPPING_ENTRY.match(line.strip())
+                if entry and standard:
+                    descriptions[f"{standard} {entry.group(1)}"] = entry.group(2)
+    except FileNotFoundError:
+        pass
+    return descriptions
+
+
+def _parse_suite(path: Path) -> Dict:
+    suite = TestSuiteBuilder(process_curdir=False).build(str(path))
+    suite_clauses = cited_clauses(suite.doc)
+    tests = []
+    for test in suite.tests:
+        clauses = list(dict.fromkeys(suite_clauses + cited_clauses(test.doc)))
+        tagged = [
+            tag[len(REQUIREMENT_TAG_PREFIX):] for tag in test.tags
+            if tag.lower().startswith(REQUIREMENT_TAG_PREFIX)
+        ]
+        tests.append({"name": test.name, "requirements": tagged, "clauses": clauses})
+    return {"suite": suite.name, "tests": tests}
+
+
+def scan_suites(tests_dir=TESTS_DIR, use_cache: bool = True) -> Dict[str, Dict]:
+    """Parse every ``.robot`` file in ``tests_dir``, reusing cached parses.
+
+    Returns:
+        Dict[str, Dict]: File name to ``{"suite", "tests"}``.
+    """
+    tests_dir = Path(tests_dir)
+    index_path = tests_dir / INDEX_FILE
+    cache: Dict[str, Dict] = {}
+    if use_cache:
+        try:
+            with open(index_path) as file:
+                cache = json.load(file)
+        except (FileNotFoundError, ValueError):
+            cache = {}
+
+    suites: Dict[str, Dict] = {}
+    changed = False
+    for path in sorted(tests_dir.glob("*.robot")):
+        stat = path.stat()
+        key = [stat.st_size, stat.st_mtime_ns]
+        entry = cache.get(path.name)
+        if entry is None or entry.get("key") != key:
+            entry = {"key": key, **_parse_suite(path)}
+            changed = True
+        suites[path.name] = entry
+    if use_cache and (changed or suites.keys() != cache.keys()):
+        tmp = index_path.with_name(f"{index_path.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+        with open(tmp, "w") as file:
+            json.dump(suites, file)
+        os.replace(tmp, index_path)
+    return suites
 
 
 class TraceabilityMatrix:
     """Maps test cases to regulatory requirements."""
 
-    def __init__(self):
-        """Initialize the traceability matrix with predefined requirements."""
-        self.requirements = {
-            "IEC_62304_5.7": Requirement(
-                id="IEC_62304_5.7",
-                description="Software update reliability",
-                test_cases=[
-                    "firmware_update_test.robot::Valid Firmware Update",
-                    "firmware_recovery_test.robot::Rollback After Failed Update"
-                ]
-            ),
-            "ISO_80601_2_70_201.12": Requirement(
-                id="ISO_80601_2_70_201.12",
-                description="Pressure control accuracy",
-                test_cases=[
-                    "firmware_update_test.robot::Pressure Control Validation"
+    def __init__(self, tests_dir=TESTS_DIR, mapping=REGULATORY_MAPPING, use_cache: bool = True):
+        """Build the matrix by scanning the Robot suites.
+
+        Args:
+            tests_dir: Directory of ``.robot`` suites.
+            mapping: Markdown document with clause descriptions.
+            use_cache: Reuse parsed suites from the mtime-keyed index.
+        """
+        descriptions = load_clause_descriptions(mapping)
+        self.requirements: Dict[str, Requirement] = {}
+        self.test_requirements: Dict[str, List[str]] = {}
+        self.clause_requirements: Dict[str, List[str]] = {}
+        # (suite file, test name) -> test ID, for joining execution results;
+        # by suite name for results that do not record their file
+        self._test_ids: Dict[tuple, str] = {}
+        self._test_ids_by_suite: Dict[tuple, str] = {}
+        tests_dir = Path(tests_dir).resolve()
+
+        for file_name, entry in scan_suites(tests_dir, use_cache).items():
+            for test in entry["tests"]:
+                test_id = f"{file_name}::{test['name']}"
+                self._test_ids[(str(tests_dir / file_name), test["name"])] = test_id
+                self._test_ids_by_suite[(entry["suite"], test["name"])] = test_id
+                requirement_ids = test["requirements"] or [
+                    clause_requirement_id(clause) for clause in test["clauses"]
                 ]
+                for requirement_id in requirement_ids:
+                    requirement = self.requirements.get(requirement_id)
+                    if requirement is None:
+                        requirement = self.requirements[requirement_id] = Requirement(
+                            requirement_id, "", []
+                        )
+                    requirement.test_cases.append(test_id)
+                    for clause in test["clauses"]:
+                        if clause not in requirement.clauses:
+                            requirement.clauses.append(clause)
+                self.test_requirements[test_id] = requirement_ids
+
+        for requirement in self.requirements.values():
+            requirement.description = "; ".join(
+                descriptions[clause] for clause in requirement.clauses if clause in descriptions
             )
-        }
+            for clause in requirement.clauses:
+                self.clause_requirements.setdefault(clause, []).append(requirement.id)
 
     def get_tests_for_requirement(self, requirement_id: str) -> List[str]:
         """Get test cases mapped to a specific requirement.
-        
+
         Args:
             requirement_id (str): The ID of the regulatory requirement.
 
@@ -49,24 +184,129 @@ class TraceabilityMatrix:
             return self.requirements[requirement_id].test_cases
         return []
 
-    def generate_report(self) -> Dict:
+    def get_requirements_for_test(self, test_id: str) -> List[str]:
+        """Get requirements verified by a test (``<suite file>::<test name>``)."""
+        return self.test_requirements.get(test_id, [])
+
+    def test_id_for_result(self, suite: str, name: str, source: str = "") -> Optional[str]:
+        """Return the test ID of an executed test.
+
+        Args:
+            suite: Dotted suite name of the result.
+            name: Test name.
+            source: Suite file recorded with the result. Results are joined
+                on it, so suites of the same name elsewhere never match;
+                only results without one are joined on the suite name.
+        """
+        if source:
+            return self._test_ids.get((str(Path(source).resolve()), name))
+        return self._test_ids_by_suite.get((suite.rsplit(".", 1)[-1], name))
+
+    def get_requirements_for_clause(self, clause: str) -> List[str]:
+        """Get requirements tracing to a standard clause, e.g. ``IEC 62304 5.7``."""
+        return self.clause_requirements.get(clause, [])
+
+    def coverage(self, output_xml) -> Dict[str, Dict]:
+        """Join the matrix with execution results in one pass over ``output_xml``.
+
+        Returns:
+            Dict[str, Dict]: Per requirement: test, executed, passed, failed
+            and skipped counts, and an overall status -- ``FAIL`` if any
+            test failed, ``PASS`` if every test ran and passed, otherwise
+            ``NOT RUN`` (no test ran) or ``PARTIAL``.
+        """
+        counts = {
+            requirement_id: {"tests": len(requirement.test_cases), "executed": 0,
+                             "passed": 0, "failed": 0, "skipped": 0}
+            for requirement_id, requirement in self.requirements.items()
+        }
+        status_keys = {"PASS": "passed", "FAIL": "failed", "SKIP": "skipped"}
+        for result in iter_test_results(output_xml):
+            test_id = self.test_id_for_result(result.suite, result.name, result.source)
+            status_key = status_keys.get(result.status)
+            if test_id is None or status_key is None:
+                continue
+            for requirement_id in self.test_requirements[test_id]:
+                count = counts[requirement_id]
+                count["executed"] += 1
+                count[status_key] += 1
+
+        for count in counts.values():
+            if count["failed"]:
+                count["status"] = "FAIL"
+            elif count["passed"] == count["tests"]:
+                count["status"] = "PASS"
+            elif count["executed"] == 0:
+                count["status"] = "NOT RUN"
+            else:
+                count["status"] = "PARTIAL"
+        return counts
+
+    def generate_report(self, output_xml=None) -> Dict:
         """Generate traceability report summarizing requirements and test cases.
-        
+
+        Args:
+            output_xml: Optional Robot output to join for per-requirement status.
+
         Returns:
-            Dict: A dictionary containing the report with requirement details 
+            Dict: A dictionary containing the report with requirement details
                   and total test count.
         """
-        return {
+        coverage = self.coverage(output_xml) if output_xml else {}
+        report = {
             "requirements": [
                 {
                     "id": req.id,
                     "description": req.description,
-                    "test_count": len(req.test_cases)
+                    "clauses": req.clauses,
+                    "test_cases": req.test_cases,
+                    "test_count": len(req.test_cases),
+                    **coverage.get(req.id, {}),
                 }
                 for req in self.requirements.values()
             ],
             "total_tests": sum(
                 len(req.test_cases)
                 for req in self.requirements.values()
-            )
+            ),
+            "untraced_tests": sorted(
+                test_id for test_id, reqs in self.test_requirements.items() if not reqs
+            ),
         }
+        if coverage:
+            statuses: Dict[str, int] = {}
+            for count in coverage.values():
+                statuses[count["status"]] = statuses.get(count["status"], 0) + 1
+            report["requirement_status"] = statuses
+        return report
+
+
+@keyword("Requirements For Test")
+def requirements_for_test(test_id, tests_dir=TESTS_DIR):
+    """Return the requirement IDs a test (``<suite file>::<test name>``) verifies."""
+    return TraceabilityMatrix(tests_dir).get_requirements_for_test(test_id)
+
+
+@keyword("Requirement Coverage")
+def requirement_coverage(output_xml, tests_dir=TESTS_DIR):
+    """Return per-requirement execution counts and status for an output.xml."""
+    return TraceabilityMatrix(tests_dir).coverage(output_xml)
+
+
+@keyword("Tests For Requirement")
+def tests_for_requirement(requirement_id, tests_dir=TESTS_DIR):
+    """Return the test IDs tracing to a requirement."""
+    return TraceabilityMatrix(tests_dir).get_tests_for_requirement(requirement_id)
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the requirement traceability matrix as JSON")
+    parser.add_argument("output_xml", nargs="?", help="Robot output.xml to join for pass status")
+    parser.add_argument("--tests", default=str(TESTS_DIR), help="Directory of .robot suites")
+    args = parser.parse_args()
+
+    print(json.dumps(TraceabilityMatrix(args.tests).generate_report(args.output_xml), indent=2))
@@ -1,29 +1,245 @@
 """Firmware validation utility.
 
-Checks if the device firmware file meets the minimum size requirement,
-to ensure it is complete and not corrupt.
+Parses the firmware image header and checks every section against its
+declared CRC32 and SHA-256, to ensure the image is complete and not
+corrupt, and reports exactly which region is damaged.
+
+Image layout (little endian)::
+
+    header    magic "CPFW", format u16, section count u16,
+              firmware version u32 (major << 16 | minor << 8 | patch),
+              declared image length u64
+    sections  per section: name 16s, offset u64, length u64,
+              crc32 u32, sha256 32s
+    crc32     u32 over header and section table
+    payload   section data at the declared offsets
+
+The image is memory-mapped and sections are checked through memoryview
+slices, so no section is copied.
+
+On request, verdicts are recorded in the persistent result cache
+(``result_cache``) keyed by image digest, device profile and the version
+of this module, so an image validated by an earlier run is not checked
+again. Every such verdict, cached or not, is audit-logged with
+``cache_hit`` set accordingly. The cache is off by default, so library
+callers such as the fleet simulator and the power loss fuzzer leave no
+trace in the checkout; the Robot keywords turn it on.
 """
 
+import hashlib
+import mmap
 import os
-from config import DEVICE_FIRMWARE_PATH
+import struct
+import zlib
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from checksum_validator import sha256
+from config import DEVICE_FIRMWARE_PATH, DeviceConfig, device_config
+from influx_logger import logger
+from result_cache import ResultCache, cache_key, default_cache
+
+MAGIC = b"CPFW"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<4sHHIQ")
+_SECTION = struct.Struct("<16sQQI32s")
+_TABLE_CRC = struct.Struct("<I")
+
+# Cached verdicts are only reused by the same validation code and limits
+VALIDATOR_VERSION = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:16]
+
+
+def _profile_key(config: DeviceConfig) -> Dict:
+    """Return the profile values a verdict depends on."""
+    return {
+        name: value for name, value in config.to_dict().items()
+        if name not in ("name", "firmware_dir")
+    }
+
+
+@dataclass
+class FirmwareReport:
+    """Result of validating one firmware image."""
+
+    valid: bool
+    size: int
+    version: Optional[str] = None
+    sections: List[str] = field(default_factory=list)
+    errors: List[Dict] = field(default_factory=list)
+
+    def _fail(self, region: str, offset: int, length: int, reason: str) -> None:
+        self.valid = False
+        self.errors.append(
+            {"region": region, "offset": offset, "length": length, "reason": reason}
+        )
+
+
+def build_firmware_image(sections: Dict[str, bytes], version: str = "1.0.0") -> bytes:
+    """Assemble a firmware image with header and section table.
+
+    Args:
+        sections: Section name to payload, in layout order.
+        version: Firmware version as ``major.minor.patch``.
+
+    Returns:
+        bytes: The complete image.
+    """
+    major, minor, patch = (int(part) for part in version.split("."))
+    table_size = _HEADER.size + _SECTION.size * len(sections) + _TABLE_CRC.size
+    total = table_size + sum(len(data) for data in sections.values())
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(sections), major << 16 | minor << 8 | patch, total
+    )
+    table = b""
+    offset = table_size
+    for name, data in sections.items():
+        table += _SECTION.pack(
+            name.encode()[:16], offset, len(data),
+            zlib.crc32(data), hashlib.sha256(data).digest(),
+        )
+        offset += len(data)
+    crc = _TABLE_CRC.pack(zlib.crc32(header + table))
+    return header + table + crc + b"".join(sections.values())
+
 
+def validate_image(path, verify_sha256: bool = True,
+                   config: DeviceConfig = device_config) -> FirmwareReport:
+    """Validate a firmware image in one pass over a memory map.
+
+    Args:
+        path: Image to validate.
+        verify_sha256: Also check per-section SHA-256 (CRC32 is always checked).
+        config: Device profile whose limits apply (default: the active one).
+
+    Returns:
+        FirmwareReport: ``valid`` plus every corrupt region found.
+    """
+    size = os.path.getsize(path)
+    report = FirmwareReport(valid=True, size=size)
+    if size < _HEADER.size:
+        report._fail("header", 0, _HEADER.size, "truncated header")
+        return report
+
+    with open(path, "rb") as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            _check(view, size, report, verify_sha256, config)
+        finally:
+            view.release()
+    return report
+
+
+def _check(view: memoryview, size: int, report: FirmwareReport, verify_sha256: bool,
+           config: DeviceConfig) -> None:
+    magic, fmt, count, packed_version, declared = _HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        report._fail("header", 0, 4, "bad magic")
+        return
+    if fmt != FORMAT_VERSION:
+        report._fail("header", 4, 2, f"unsupported format {fmt}")
+        return
+    report.version = f"{packed_version >> 16}.{packed_version >> 8 & 0xFF}.{packed_version & 0xFF}"
+
+    table_end = _HEADER.size + _SECTION.size * count
+    if size < table_end + _TABLE_CRC.size:
+        report._fail("section_table", _HEADER.size, table_end - _HEADER.size, "truncated section table")
+        return
+    (table_crc,) = _TABLE_CRC.unpack_from(view, table_end)
+    if zlib.crc32(view[:table_end]) != table_crc:
+        report._fail("section_table", 0, table_end, "header CRC mismatch")
+        return
+
+    if declared > config.max_firmware_size:
+        report._fail("header", 12, 8, f"declared length {declared} exceeds maximum "
+                     f"{config.max_firmware_size} of profile {config.name}")
+    if size != declared:
+        report._fail("image", min(size, declared), abs(declared - size),
+                     f"size {size} differs from declared length {declared}")
+
+    for index in range(count):
+        name, offset, length, crc, digest = _SECTION.unpack_from(
+            view, _HEADER.size + index * _SECTION.size
+        )
+        name = name.rstrip(b"\0").decode(errors="replace")
+        report.sections.append(name)
+        if offset + length > size:
+            report._fail(name, offset, length, "section extends past end of image")
+            continue
+        data = view[offset:offset + length]
+        if zlib.crc32(data) != crc:
+            report._fail(name, offset, length, "CRC32 mismatch")
+        elif verify_sha256 and hashlib.sha256(data).digest() != digest:
+            report._fail(name, offset, length, "SHA-256 mismatch")
+        data.release()
 
-def is_valid_firmware(min_size=100_000):
-    """Check if firmware file is valid based on size.
+
+def validate_image_cached(
+    path, verify_sha256: bool = True, cache: Optional[ResultCache] = None,
+    config: DeviceConfig = device_config, digest: Optional[str] = None,
+) -> Tuple[FirmwareReport, bool]:
+    """Validate an image, reusing the verdict recorded for identical content.
+
+    Args:
+        path: Image to validate.
+        verify_sha256: Also check per-section SHA-256.
+        cache: Result cache (default: the process-wide one).
+        config: Device profile whose limits apply (default: the active one).
+        digest: SHA-256 of the image, when the caller already has it.
+
+    Returns:
+        Tuple[FirmwareReport, bool]: The report and whether it came from
+        the cache.
+    """
+    cache = cache or default_cache()
+    digest = digest or sha256(path)
+    key = cache_key("validate_image", digest, verify_sha256, VALIDATOR_VERSION, _profile_key(config))
+    recorded = cache.get(key)
+    if recorded is not None:
+        report = FirmwareReport(**recorded)
+    else:
+        report = validate_image(path, verify_sha256, config)
+        cache.put(key, asdict(report), tag=digest)
+    logger.log_event("firmware_validation", {
+        "result": "passed" if report.valid else "failed",
+        "cache_hit": recorded is not None,
+        "sha256": digest,
+        "version": report.version or "unknown",
+    })
+    return report, recorded is not None
+
+
+def is_valid_firmware(min_size=100_000, path=DEVICE_FIRMWARE_PATH, use_cache=False,
+                      config=device_config, digest=None):
+    """Check if firmware file is valid based on size and structure.
 
     Args:
         min_size (int): Minimum required file size in bytes. Default is 100,000.
+        path (Path): Firmware image to check. Default is the installed image.
+        use_cache (bool): Reuse and record the verdict for identical content
+            in the result cache. Default is False.
+        config (DeviceConfig): Device profile whose limits apply. Default is
+            the active profile.
+        digest (str): SHA-256 of the image, when the caller already has it.
 
     Returns:
-        bool: True if file size meets or exceeds the minimum, False otherwise.
+        bool: True if the file meets the minimum size and every section
+        matches its header, False otherwise.
     """
-    return os.path.getsize(DEVICE_FIRMWARE_PATH) >= min_size
+    if os.path.getsize(path) < min_size:
+        return False
+    if use_cache:
+        return validate_image_cached(path, config=config, digest=digest)[0].valid
+    return validate_image(path, config=config).valid
 
 
 if __name__ == "__main__":
-    if is_valid_firmware():
-        print("Firmware is valid.")
+    result = validate_image(DEVICE_FIRMWARE_PATH)
+    if result.valid and result.size >= 100_000:
+        print(f"Firmware is valid (version {result.version}).")
     else:
         print("Firmware is incomplete or corrupt.")
-
-
+        for error in result.errors:
+            print(f"  {error['region']} @ {error['offset']}+{error['length']}: {error['reason']}")
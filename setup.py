@@ -7,5 +7,6 @@ setup(
     install_requires=[
         'influxdb',
         'robotframework',
+        'numpy',
     ],
 )
\ No newline at end of file
@@ -0,0 +1,280 @@
+"""Test fixtures for the audit spool, time-series store, result cache and firmware store.
+
+Most keywords fork several writer processes against one spool, store or
+result cache, or interleave two handles on one file, as parallel shards
+would, and report what ended up on disk; others damage spool records the
+way a crash or a bad disk would.
+"""
+
+import multiprocessing
+import struct
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from robot.api.deco import keyword
+from audit_spool import AuditSpool, SpoolReplayer
+from firmware_store import FirmwareStore
+from influx_logger import AuditLogger
+from line_protocol import encode_point
+from result_cache import ResultCache, cache_key
+from timeseries_store import TimeSeriesStore
+
+
+def _start_writers(target, args_list):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=target, args=args) for args in args_list]
+    for process in processes:
+        process.start()
+    return processes
+
+
+def _join_writers(processes) -> None:
+    for process in processes:
+        process.join()
+        if process.exitcode:
+            raise RuntimeError(f"Writer process exited with {process.exitcode}")
+
+
+def _append_spool_events(spool_dir, writer: int, events: int, segment_size: int) -> None:
+    spool = AuditSpool(spool_dir, segment_size=segment_size)
+    try:
+        for index in range(events):
+            spool.append(encode_point(
+                "device_events", {"device_type": "CPAP", "writer": str(writer)},
+                {"event_type": "spool_test", "index": index}, time.time_ns(),
+            ))
+            time.sleep(0.001)
+    finally:
+        spool.close()
+
+
+@keyword("Append Audit Event To Spool")
+def append_audit_event_to_spool(spool_dir, event_type, **metadata):
+    """Append one audit event to the spool in ``spool_dir``."""
+    spool = AuditSpool(spool_dir)
+    try:
+        spool.append(encode_point(
+            "device_events",
+            {"device_type": "CPAP", "firmware_version": metadata.get("version", "unknown")},
+            {"event_type": event_type, **metadata},
+            time.time_ns(),
+        ))
+    finally:
+        spool.close()
+
+
+@keyword("Replay Audit Spool During Concurrent Writes")
+def replay_audit_spool_during_concurrent_writes(spool_dir, influx_url, writers=2, events=200,
+                                                segment_size=2048, database="firmware_audit"):
+    """Append events from several processes sharing ``spool_dir`` while replaying it.
+
+    Replays run continuously while the writers append and rotate their
+    segments, then once more after they exit.
+
+    Returns:
+        int: Records replayed in total.
+    """
+    processes = _start_writers(
+        _append_spool_events,
+        [(spool_dir, writer, int(events), int(segment_size)) for writer in range(int(writers))],
+    )
+    spool = AuditSpool(spool_dir)
+    replayer = SpoolReplayer(spool, f"{influx_url}/write?db={database}&precision=ns",
+                             batch_size=50, timeout=2.0)
+    try:
+        while any(process.is_alive() for process in processes):
+            replayer.drain()
+            time.sleep(0.005)
+        _join_writers(processes)
+        replayer.drain()
+        return replayer.replayed_records
+    finally:
+        spool.close()
+
+
+@keyword("Audit Spool Segment Count")
+def audit_spool_segment_count(spool_dir):
+    """Return the number of segment files left in ``spool_dir``."""
+    return len(AuditSpool(spool_dir).segments())
+
+
+@keyword("Write Audit Spool Segment")
+def write_audit_spool_segment(spool_dir, events=3):
+    """Append ``events`` audit events to one new segment and return its name."""
+    spool = AuditSpool(spool_dir)
+    try:
+        for index in range(int(events)):
+            spool.append(encode_point(
+                "device_events", {"device_type": "CPAP"},
+                {"event_type": "spool_test", "index": index}, time.time_ns(),
+            ))
+        return spool.active_segment
+    finally:
+        spool.close()
+
+
+@keyword("Damage Audit Spool Record")
+def damage_audit_spool_record(spool_dir, segment, record, part="payload"):
+    """Damage the ``record``-th record (from 0) of a spool segment.
+
+    Args:
+        spool_dir: Spool directory.
+        segment: Segment file name.
+        record: Index of the record to damage.
+        part: ``payload`` flips a payload byte, so the CRC fails;
+            ``length`` makes the length prefix run past the end of the file.
+    """
+    path = Path(spool_dir) / segment
+    data = bytearray(path.read_bytes())
+    header = struct.Struct("<II")
+    offset = 0
+    for _ in range(int(record)):
+        offset += header.size + header.unpack_from(data, offset)[0]
+    if part == "length":
+        struct.pack_into("<I", data, offset, len(data))
+    else:
+        data[offset + header.size] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+
+def _write_store_events(store_dir, writer: int, events: int, compact_after: int) -> None:
+    store = TimeSeriesStore(store_dir, compact_after=compact_after)
+    for index in range(events):
+        store.write_points([{
+            "measurement": "device_events",
+            "tags": {"device_type": "CPAP", "writer": str(writer)},
+            "fields": {"event_type": "store_test", "index": index},
+        }])
+
+
+@keyword("Write Audit Events To Store Concurrently")
+def write_audit_events_to_store_concurrently(store_dir, writers=4, events=40, compact_after=4):
+    """Write events one by one from several processes sharing ``store_dir``.
+
+    A small ``compact_after`` makes the writers compact while others write.
+
+    Returns:
+        dict: ``rows`` stored and ``segments`` in the index afterwards.
+    """
+    _join_writers(_start_writers(
+        _write_store_events,
+        [(store_dir, writer, int(events), int(compact_after)) for writer in range(int(writers))],
+    ))
+    store = TimeSeriesStore(store_dir)
+    return {
+        "rows": len(store.query("device_events", columns=[])["time"]),
+        "segments": len(store._index("device_events", fresh=True)["segments"]),
+    }
+
+
+@keyword("Flush Audit Logger While Replay Is Held")
+def flush_audit_logger_while_replay_is_held(spool_dir, timeout=0.5):
+    """Flush a spooling logger while another replayer holds the spool.
+
+    Returns:
+        dict: Whether a replaying flush ``replayed`` and how many
+        ``replay_seconds`` it took, whether a flush without replay
+        ``synced`` and its ``sync_seconds``, and whether ``close`` reset
+        the spool (``reopened`` by the next event).
+    """
+    audit_logger = AuditLogger(spool_dir=spool_dir, flush_interval=60.0)
+    audit_logger.log_event("flush_test", {"status": "held"})
+    spool = audit_logger._spool
+    try:
+        with AuditSpool(spool_dir).replay_lock():
+            start = time.perf_counter()
+            replayed = audit_logger.flush(float(timeout))
+            replay_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            synced = audit_logger.flush(float(timeout), replay=False)
+            sync_seconds = time.perf_counter() - start
+    finally:
+        audit_logger.close(float(timeout))
+    closed = audit_logger._spool is None and audit_logger._replayer is None
+    audit_logger.log_event("flush_test", {"status": "reopened"})
+    reopened = closed and audit_logger._spool is not spool
+    audit_logger.close(float(timeout))
+    return {
+        "replayed": replayed,
+        "replay_seconds": replay_seconds,
+        "synced": synced,
+        "sync_seconds": sync_seconds,
+        "reopened": reopened,
+    }
+
+
+def _add_firmware_versions(store_dir, image, writer: int, versions: int) -> None:
+    store = FirmwareStore(store_dir)
+    for index in range(versions):
+        store.add(image, f"{writer}.{index}.0")
+
+
+@keyword("Add Firmware Versions From Concurrent Processes")
+def add_firmware_versions_from_concurrent_processes(store_dir, image, writers=4, versions=5):
+    """Add versions of ``image`` from several processes sharing ``store_dir``.
+
+    Returns:
+        int: Versions in the store index afterwards.
+    """
+    _join_writers(_start_writers(
+        _add_firmware_versions,
+        [(store_dir, image, writer, int(versions)) for writer in range(int(writers))],
+    ))
+    return len(FirmwareStore(store_dir).versions())
+
+
+def _put_results(cache_file, writer: int, entries: int) -> None:
+    cache = ResultCache(cache_file)
+    for entry in range(entries):
+        cache.put(cache_key("writer", writer, entry), entry, tag=f"writer-{writer}")
+    cache.save()
+
+
+@keyword("Put Results From Concurrent Processes")
+def put_results_from_concurrent_processes(cache_file, writers=4, entries=25):
+    """Record results one by one from several processes sharing ``cache_file``.
+
+    Returns:
+        int: Entries in the cache file afterwards.
+    """
+    _join_writers(_start_writers(
+        _put_results, [(cache_file, writer, int(entries)) for writer in range(int(writers))]
+    ))
+    return len(ResultCache(cache_file)._entries)
+
+
+@keyword("Save Stale Result Cache After Invalidation")
+def save_stale_result_cache_after_invalidation(cache_file):
+    """Invalidate a tag while a second cache on the same file still holds it.
+
+    The second cache then looks the entry up and saves, as another shard would.
+
+    Returns:
+        dict: ``removed`` by the invalidation, whether the stale cache
+        still ``served`` the entry, whether it was ``resurrected`` by the
+        stale save, and whether a verdict stored after the invalidation was
+        ``recorded``.
+    """
+    first = ResultCache(cache_file)
+    first.put("verdict", True, tag="image")
+    first.save()
+    stale = ResultCache(cache_file)
+    removed = first.invalidate("image")
+    served = stale.get("verdict") is not None
+    stale.save()
+    resurrected = "verdict" in ResultCache(cache_file)._entries
+    stale.put("new-verdict", True, tag="image")
+    stale.save()
+    return {
+        "removed": removed,
+        "served": served,
+        "resurrected": resurrected,
+        "recorded": "new-verdict" in ResultCache(cache_file)._entries,
+    }
+
+
+ROBOT_AUTO_KEYWORDS = False
+ROBOT_LIBRARY_SCOPE = "GLOBAL"